@@ -0,0 +1,381 @@
+"""
+Замер скорости json_cleaner на искусственном каталоге
+
+Что делает скрипт:
+1. Генерирует NDJSON каталог нужного размера: ключи title и Наименование
+   вперемешку, дубликаты (в том числе чуть изменённые), пустые и битые строки,
+   длинные русские значения
+2. Прогоняет на нём обработку в нескольких режимах (обычный, параллельный,
+   точный индекс, обработка через диск...). Каждый режим запускается
+   в отдельном процессе, чтобы честно измерить пик памяти
+3. Отдельно меряет время каждого этапа: чтение, парсинг, поиск дубликатов,
+   замена полей, сериализация, запись
+4. Сверяет предварительную оценку по выборке (--estimate) с настоящим
+   числом уникальных записей того же каталога
+5. Сохраняет результаты в JSON файл и (по желанию) сравнивает с прошлым запуском
+
+Пример:
+    python benchmark.py --rows 500000 --output bench.json
+    python benchmark.py --rows 500000 --output bench2.json --compare bench.json
+"""
+
+# ==================== ИМПОРТ БИБЛИОТЕК ====================
+
+import argparse                         # Для параметров командной строки
+import json                             # Для генерации каталога и записи результатов
+import os                               # Для работы с файлами и папками
+import platform                         # Для описания машины в результатах
+import random                           # Для генерации каталога
+import shutil                           # Для удаления временной папки
+import subprocess                       # Для запуска каждого режима в своём процессе
+import sys                              # Для пути к интерпретатору Python
+import tempfile                         # Для временной папки с каталогом и результатом
+import time                             # Для измерения времени
+
+import json_cleaner
+
+
+# ==================== НАСТРОЙКИ ====================
+
+# Режимы обработки: название → настройки json_cleaner, которые меняются
+MODES = {
+    'sequential': {},
+    'exact-index': {'DEDUP_INDEX': 'exact'},
+    'hash-128': {'DEDUP_HASH_BITS': 128},
+    'parallel': {'PARALLEL_WORKERS': 0, 'PARALLEL_CHUNK_MB': 4},
+    'disk-spill': {'MEMORY_BUDGET_MB': 1},
+    'gzip-output': {'OUTPUT_COMPRESSION': 'gz'},
+    'pipeline': {'PIPELINE': True},
+    'near-duplicates': {'NEAR_DUPLICATES': True},
+}
+
+# Насколько (в процентах) режим может стать медленнее, прежде чем
+# сравнение с прошлым запуском пометит его как регрессию
+REGRESSION_THRESHOLD = 10.0
+
+# Слова для русских названий и описаний
+WORDS = (
+    "Кабель", "медный", "экранированный", "Провод", "силовой", "Розетка",
+    "двойная", "с заземлением", "Выключатель", "накладной", "Автомат",
+    "дифференциальный", "Светильник", "светодиодный", "потолочный", "белый",
+    "чёрный", "серый", "Удлинитель", "бытовой", "Гофра", "ПВХ", "Щиток",
+    "Клемма", "Изолента", "Хомут", "нейлоновый", "Коробка", "распаечная",
+)
+
+
+# ==================== ГЕНЕРАТОР КАТАЛОГА ====================
+
+def make_title(rng, length):
+    """Русское название товара примерно из length символов."""
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    words.append(f"{rng.randint(1, 999)} м")
+    words.append(f"арт. {rng.randint(100000, 999999)}")
+    return " ".join(words)
+
+
+def make_variant(rng, title):
+    """
+    Тот же товар, записанный чуть иначе (для поиска похожих title):
+    другой регистр, лишние пробелы, "5 м" вместо "5м" или переставленные слова.
+    """
+    kind = rng.randrange(4)
+    if kind == 0:
+        return title.upper() if rng.random() < 0.5 else title.lower()
+    if kind == 1:
+        return title.replace(" ", "  ", 2)
+    if kind == 2 and " м" in title:
+        return title.replace(" м", "м")
+    words = title.split(" ")
+    position = rng.randrange(len(words) - 1)
+    words[position], words[position + 1] = words[position + 1], words[position]
+    return " ".join(words)
+
+
+def generate_catalogue(path, rows, duplicate_ratio=0.3, blank_rate=0.02,
+                       malformed_rate=0.01, russian_keys_ratio=0.5,
+                       escaped_ratio=0.2, title_length=100, description_length=300,
+                       near_duplicate_ratio=0.1, seed=42):
+    """
+    Записывает в path NDJSON каталог из rows строк.
+    
+    duplicate_ratio — доля записей, повторяющих title уже встреченной записи
+    blank_rate — доля пустых строк
+    malformed_rate — доля строк с битым JSON
+    russian_keys_ratio — доля записей с русскими ключами (Наименование, Склад...)
+    escaped_ratio — доля строк, записанных с \\uXXXX вместо русских букв
+    near_duplicate_ratio — доля дубликатов, записанных с небольшими отличиями (make_variant)
+    title_length, description_length — примерная длина названия и описания
+    seed — зерно генератора: одинаковые параметры дают одинаковый файл
+    """
+    rng = random.Random(seed)
+    titles = []              # Уже выданные title (для дубликатов)
+    max_remembered = 100000  # Больше не запоминаем — экономим память генератора
+    
+    with open(path, 'w', encoding='utf-8') as f:
+        for number in range(rows):
+            roll = rng.random()
+            if roll < blank_rate:
+                f.write("\n")
+                continue
+            if roll < blank_rate + malformed_rate:
+                f.write('{"title": "битая строка", "price": \n')
+                continue
+            
+            if titles and rng.random() < duplicate_ratio:
+                title = rng.choice(titles)
+                if near_duplicate_ratio and rng.random() < near_duplicate_ratio:
+                    title = make_variant(rng, title)
+            else:
+                title = make_title(rng, title_length)
+                if len(titles) < max_remembered:
+                    titles.append(title)
+                else:
+                    titles[rng.randrange(max_remembered)] = title
+            
+            description = make_title(rng, description_length)
+            if rng.random() < russian_keys_ratio:
+                record = {
+                    "Наименование": title, "Артикул": number, "Склад": rng.randint(0, 500),
+                    "Под заказ": "нет", "Цена": f"{rng.randint(10, 99999)} руб",
+                    "Описание": description,
+                }
+            else:
+                record = {
+                    "title": title, "sku": number, "stock": rng.randint(0, 500),
+                    "under_order": "no", "price": f"{rng.randint(10, 99999)} руб",
+                    "description": description,
+                }
+            
+            f.write(json.dumps(record, ensure_ascii=rng.random() < escaped_ratio) + "\n")
+
+
+# ==================== ЗАМЕР ОДНОГО РЕЖИМА ====================
+
+def run_mode(mode, dataset_path, output_dir):
+    """
+    Обрабатывает каталог в режиме mode (вызывается в отдельном процессе).
+    Возвращает словарь с результатами.
+    """
+    for name, value in MODES[mode].items():
+        setattr(json_cleaner, name, value)
+    
+    engine = json_cleaner.CleanerEngine(output_dir=output_dir)
+    size = os.path.getsize(dataset_path)
+    
+    start = time.perf_counter()
+    stats = engine.process_single_file(dataset_path)
+    seconds = time.perf_counter() - start
+    
+    return {
+        'seconds': round(seconds, 4),
+        'rows_per_sec': round(stats['lines'] / seconds, 1) if seconds else None,
+        'mb_per_sec': round(size / 1024 / 1024 / seconds, 2) if seconds else None,
+        'peak_rss_mb': stats['report']['peak_memory_mb'],
+        'settings': MODES[mode],
+        'stats': stats['report']['counters'],
+        'stages': stats['report']['stages'],
+        'queues': stats['report']['queues'],
+        'duplicate_tiers': stats['report']['duplicate_tiers'],
+    }
+
+
+def run_mode_in_subprocess(mode, dataset_path):
+    """Запускает run_mode в новом процессе Python и возвращает его результат."""
+    output_dir = tempfile.mkdtemp(prefix='json_cleaner_bench_out_')
+    try:
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run-mode', mode,
+             '--dataset', dataset_path, '--output-dir', output_dir],
+            capture_output=True, text=True, check=True
+        )
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+# ==================== ВРЕМЯ ПО ЭТАПАМ ====================
+
+def measure_stages(dataset_path, output_dir):
+    """
+    Обрабатывает каталог с замером каждого этапа (STAGE_TIMING).
+    Замер сам по себе добавляет немного времени, поэтому сумма этапов
+    больше, чем время режима 'sequential'.
+    Возвращает (время по этапам, счётчики обработки).
+    """
+    json_cleaner.STAGE_TIMING = True
+    try:
+        stats = json_cleaner.CleanerEngine(output_dir=output_dir).process_single_file(dataset_path)
+    finally:
+        json_cleaner.STAGE_TIMING = False
+    
+    stages = dict(stats['report']['stages'])
+    stages['other'] = stats['report']['stages_other']
+    return stages, stats['report']['counters']
+
+
+# ==================== ТОЧНОСТЬ ПРЕДВАРИТЕЛЬНОЙ ОЦЕНКИ ====================
+
+def check_estimate(dataset_path, counters, sample_percent=None):
+    """
+    Сравнивает предварительную оценку (json_cleaner.estimate_file) с настоящей
+    обработкой того же каталога (counters — её счётчики).
+    Возвращает словарь: оценка и её диапазон, настоящее значение, ошибка в процентах.
+    """
+    estimate = json_cleaner.estimate_file(dataset_path, sample_percent)
+    actual = counters['unique']
+    low, high = estimate['unique_records_range']
+    return {
+        'sample_bytes': estimate['sample_bytes'],
+        'estimate_seconds': estimate['estimate_seconds'],
+        'lines': estimate['lines'],
+        'actual_lines': counters['lines'],
+        'unique_records': estimate['unique_records'],
+        'unique_records_range': [low, high],
+        'actual_unique_records': actual,
+        'error_percent': round((estimate['unique_records'] / actual - 1) * 100, 1) if actual else None,
+        'in_range': low <= actual <= high,
+    }
+
+
+# ==================== СРАВНЕНИЕ С ПРОШЛЫМ ЗАПУСКОМ ====================
+
+def compare_results(current, previous, threshold=REGRESSION_THRESHOLD):
+    """
+    Сравнивает скорость режимов с прошлым запуском.
+    Возвращает список строк отчёта и признак найденной регрессии.
+    """
+    report = []
+    regression = False
+    
+    for mode, result in current['modes'].items():
+        old = previous.get('modes', {}).get(mode)
+        if not old or not old.get('rows_per_sec') or not result.get('rows_per_sec'):
+            report.append(f"{mode:12} — нет данных для сравнения")
+            continue
+        
+        change = (result['rows_per_sec'] / old['rows_per_sec'] - 1) * 100
+        mark = ""
+        if change < -threshold:
+            mark = "  ⚠ медленнее"
+            regression = True
+        report.append(f"{mode:12} {old['rows_per_sec']:>12,.0f} → {result['rows_per_sec']:>12,.0f} "
+                      f"строк/с ({change:+.1f}%){mark}".replace(',', ' '))
+    
+    return report, regression
+
+
+# ==================== ЗАПУСК ====================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замер скорости json_cleaner")
+    parser.add_argument("--rows", type=int, default=200000, help="строк в каталоге")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.3)
+    parser.add_argument("--blank-rate", type=float, default=0.02)
+    parser.add_argument("--malformed-rate", type=float, default=0.01)
+    parser.add_argument("--russian-keys-ratio", type=float, default=0.5)
+    parser.add_argument("--escaped-ratio", type=float, default=0.2)
+    parser.add_argument("--title-length", type=int, default=100)
+    parser.add_argument("--near-duplicate-ratio", type=float, default=0.1,
+                        help="доля дубликатов с небольшими отличиями (для режима near-duplicates)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--modes", default=",".join(MODES),
+                        help=f"режимы через запятую (есть: {', '.join(MODES)})")
+    parser.add_argument("--dataset", help="готовый каталог (иначе он генерируется)")
+    parser.add_argument("--output", default="bench_results.json", help="куда записать результаты")
+    parser.add_argument("--compare", help="результаты прошлого запуска для сравнения")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="на сколько процентов режим может замедлиться без предупреждения")
+    parser.add_argument("--estimate-percent", type=float, default=json_cleaner.ESTIMATE_SAMPLE_PERCENT,
+                        help="доля файла для проверки предварительной оценки, %%")
+    # Служебные параметры для запуска одного режима в отдельном процессе
+    parser.add_argument("--run-mode", help=argparse.SUPPRESS)
+    parser.add_argument("--output-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    
+    if args.run_mode:
+        print(json.dumps(run_mode(args.run_mode, args.dataset, args.output_dir)))
+        return 0
+    
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        parser.error(f"неизвестные режимы: {', '.join(unknown)}")
+    
+    work_dir = tempfile.mkdtemp(prefix='json_cleaner_bench_')
+    try:
+        dataset_path = args.dataset
+        generator = None
+        if not dataset_path:
+            dataset_path = os.path.join(work_dir, 'catalogue.json')
+            generator = {
+                'rows': args.rows, 'duplicate_ratio': args.duplicate_ratio,
+                'blank_rate': args.blank_rate, 'malformed_rate': args.malformed_rate,
+                'russian_keys_ratio': args.russian_keys_ratio,
+                'escaped_ratio': args.escaped_ratio, 'title_length': args.title_length,
+                'near_duplicate_ratio': args.near_duplicate_ratio, 'seed': args.seed,
+            }
+            print(f"Генерация каталога: {args.rows:,} строк...".replace(',', ' '))
+            generate_catalogue(dataset_path, **generator)
+        
+        size = os.path.getsize(dataset_path)
+        print(f"Каталог: {size / 1024 / 1024:.1f} МБ")
+        
+        results = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'dataset': {'path': args.dataset, 'size_bytes': size, 'generator': generator},
+            'modes': {},
+        }
+        
+        for mode in modes:
+            result = run_mode_in_subprocess(mode, dataset_path)
+            results['modes'][mode] = result
+            rss = f"{result['peak_rss_mb']:.0f} МБ" if result['peak_rss_mb'] is not None else "—"
+            print(f"{mode:12} {result['seconds']:8.2f} с  {result['rows_per_sec']:>12,.0f} строк/с  "
+                  f"{result['mb_per_sec']:7.1f} МБ/с  пик памяти {rss}".replace(',', ' '))
+            if result['duplicate_tiers']:
+                print("             дубликаты по ступеням: " + ", ".join(
+                    f"{name} {count}" for name, count in result['duplicate_tiers'].items()))
+        
+        stages_dir = os.path.join(work_dir, 'stages')
+        os.makedirs(stages_dir)
+        results['stages'], counters = measure_stages(dataset_path, stages_dir)
+        print("Этапы (с): " + ", ".join(f"{name} {seconds:.2f}"
+                                          for name, seconds in results['stages'].items()))
+        
+        results['estimate'] = check = check_estimate(dataset_path, counters, args.estimate_percent)
+        number = lambda value: f"{value:,}".replace(',', ' ')
+        low, high = check['unique_records_range']
+        mark = "" if check['in_range'] else "  ⚠ вне диапазона"
+        print(f"Оценка по выборке ({check['sample_bytes'] / size * 100:.1f}% файла, "
+              f"{check['estimate_seconds']:.2f} с): уникальных ~{number(check['unique_records'])} "
+              f"(от {number(low)} до {number(high)}), на деле {number(check['actual_unique_records'])} "
+              f"({check['error_percent']:+.1f}%){mark}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {args.output}")
+    
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+        report, regression = compare_results(results, previous, args.threshold)
+        print("\nСравнение с " + args.compare + ":")
+        print("\n".join(report))
+        if regression:
+            return 1
+    
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,555 +1,5505 @@
-"""
-Скрипт для удаления дубликатов в JSON файлах
-Автор: Assistant
-Версия: 1.0
-
-Что делает скрипт:
-1. Открывает окно для выбора JSON файла (или нескольких файлов)
-2. Удаляет пустые строки
-3. Удаляет дубликаты по полю "title" или "Наименование"
-4. Заменяет значения полей stock/Склад, under_order/Под заказ, price/Цена
-5. Разбивает большие файлы на части по 3 000 000 строк
-6. Сохраняет результат в той же папке
-"""
-
-# ==================== ИМПОРТ БИБЛИОТЕК ====================
-# Это как "подключение инструментов" которые нам понадобятся
-
-import tkinter as tk                    # Библиотека для создания окон и кнопок
-from tkinter import filedialog          # Для окна выбора файлов
-from tkinter import ttk                 # Для красивой шкалы прогресса
-from tkinter import messagebox          # Для всплывающих сообщений
-import json                             # Для работы с JSON файлами
-import threading                        # Для работы в нескольких потоках (чтобы окно не зависало)
-import os                               # Для работы с файлами и папками
-import time                             # Для измерения времени работы
-
-
-# ==================== НАСТРОЙКИ ====================
-# Здесь можно менять значения для замены полей
-
-# Максимальное количество строк в одном файле
-MAX_LINES_PER_FILE = 3000000  # 3 миллиона строк
-
-# Значения для замены полей
-NEW_STOCK_VALUE = "188"           # Новое значение для поля "stock" или "Склад"
-NEW_UNDER_ORDER_VALUE = "5-8 дней"  # Новое значение для поля "under_order" или "Под заказ"
-NEW_PRICE_VALUE = "110 руб"       # Новое значение для поля "price" или "Цена"
-
-
-# ==================== ГЛАВНЫЙ КЛАСС ПРИЛОЖЕНИЯ ====================
-# Класс — это как "чертёж" нашей программы, в котором описано всё, что она умеет делать
-
-class JSONCleanerApp:
-    """
-    Главный класс приложения.
-    Создаёт окно с кнопками и управляет всей работой программы.
-    """
-    
-    def __init__(self, root):
-        """
-        Инициализация — это то, что происходит при запуске программы.
-        root — это главное окно программы.
-        """
-        self.root = root  # Сохраняем ссылку на главное окно
-        self.root.title("Очистка JSON от дубликатов")  # Заголовок окна
-        self.root.geometry("700x500")  # Размер окна: ширина x высота
-        self.root.resizable(True, True)  # Можно ли менять размер окна
-        
-        # Список выбранных файлов (пока пустой)
-        self.selected_files = []
-        
-        # Флаг для остановки обработки
-        self.stop_processing = False
-        
-        # Создаём все элементы интерфейса
-        self.create_widgets()
-    
-    
-    def create_widgets(self):
-        """
-        Создание всех элементов интерфейса: кнопок, надписей, шкалы прогресса.
-        """
-        
-        # ---------- РАМКА ДЛЯ КНОПОК ВВЕРХУ ----------
-        # Frame — это как "контейнер" для группировки элементов
-        top_frame = tk.Frame(self.root, pady=10)  # pady — отступ сверху и снизу
-        top_frame.pack(fill=tk.X)  # pack — размещаем на окне, fill=X — растянуть по ширине
-        
-        # Кнопка "Загрузить файлы"
-        self.btn_load = tk.Button(
-            top_frame,                          # В какой рамке разместить
-            text="📂 Загрузить файлы (до 10)",  # Текст на кнопке
-            command=self.load_files,            # Какую функцию вызвать при нажатии
-            font=("Arial", 12),                 # Шрифт и размер
-            width=25,                           # Ширина кнопки
-            height=2                            # Высота кнопки
-        )
-        self.btn_load.pack(side=tk.LEFT, padx=10)  # Разместить слева с отступом
-        
-        # Кнопка "Удалить дубликаты"
-        self.btn_process = tk.Button(
-            top_frame,
-            text="🔧 Удалить дубликаты",
-            command=self.start_processing,
-            font=("Arial", 12),
-            width=25,
-            height=2,
-            state=tk.DISABLED  # Кнопка неактивна, пока не выбраны файлы
-        )
-        self.btn_process.pack(side=tk.LEFT, padx=10)
-        
-        # Кнопка "Остановить"
-        self.btn_stop = tk.Button(
-            top_frame,
-            text="⏹ Остановить",
-            command=self.stop_process,
-            font=("Arial", 12),
-            width=15,
-            height=2,
-            state=tk.DISABLED  # Неактивна, пока обработка не идёт
-        )
-        self.btn_stop.pack(side=tk.LEFT, padx=10)
-        
-        # ---------- СПИСОК ВЫБРАННЫХ ФАЙЛОВ ----------
-        files_frame = tk.Frame(self.root, pady=5)
-        files_frame.pack(fill=tk.BOTH, expand=True, padx=10)
-        
-        # Заголовок списка
-        tk.Label(
-            files_frame, 
-            text="Выбранные файлы:", 
-            font=("Arial", 11, "bold")
-        ).pack(anchor=tk.W)  # anchor=W — прижать к левому краю (West)
-        
-        # Список файлов с прокруткой
-        list_container = tk.Frame(files_frame)
-        list_container.pack(fill=tk.BOTH, expand=True)
-        
-        # Полоса прокрутки
-        scrollbar = tk.Scrollbar(list_container)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        # Сам список (Listbox)
-        self.files_listbox = tk.Listbox(
-            list_container,
-            font=("Consolas", 10),
-            height=8,
-            yscrollcommand=scrollbar.set  # Связываем с прокруткой
-        )
-        self.files_listbox.pack(fill=tk.BOTH, expand=True)
-        scrollbar.config(command=self.files_listbox.yview)
-        
-        # ---------- ШКАЛА ПРОГРЕССА ----------
-        progress_frame = tk.Frame(self.root, pady=10)
-        progress_frame.pack(fill=tk.X, padx=10)
-        
-        # Надпись над шкалой прогресса (для текущего файла)
-        self.label_current_file = tk.Label(
-            progress_frame,
-            text="Ожидание...",
-            font=("Arial", 10)
-        )
-        self.label_current_file.pack(anchor=tk.W)
-        
-        # Шкала прогресса для файлов
-        tk.Label(
-            progress_frame, 
-            text="Прогресс по файлам:", 
-            font=("Arial", 9)
-        ).pack(anchor=tk.W)
-        
-        self.progress_files = ttk.Progressbar(
-            progress_frame,
-            orient=tk.HORIZONTAL,  # Горизонтальная шкала
-            length=650,            # Длина шкалы
-            mode='determinate'     # Режим с конкретным прогрессом (0-100%)
-        )
-        self.progress_files.pack(fill=tk.X, pady=2)
-        
-        # Шкала прогресса для текущего файла
-        tk.Label(
-            progress_frame, 
-            text="Прогресс текущего файла:", 
-            font=("Arial", 9)
-        ).pack(anchor=tk.W)
-        
-        self.progress_current = ttk.Progressbar(
-            progress_frame,
-            orient=tk.HORIZONTAL,
-            length=650,
-            mode='determinate'
-        )
-        self.progress_current.pack(fill=tk.X, pady=2)
-        
-        # ---------- ОБЛАСТЬ ДЛЯ ЛОГОВ (СООБЩЕНИЙ) ----------
-        log_frame = tk.Frame(self.root, pady=5)
-        log_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
-        
-        tk.Label(
-            log_frame, 
-            text="Лог выполнения:", 
-            font=("Arial", 11, "bold")
-        ).pack(anchor=tk.W)
-        
-        # Полоса прокрутки для лога
-        log_scrollbar = tk.Scrollbar(log_frame)
-        log_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        # Текстовое поле для лога
-        self.log_text = tk.Text(
-            log_frame,
-            font=("Consolas", 9),
-            height=8,
-            state=tk.DISABLED,  # Нельзя редактировать вручную
-            yscrollcommand=log_scrollbar.set
-        )
-        self.log_text.pack(fill=tk.BOTH, expand=True)
-        log_scrollbar.config(command=self.log_text.yview)
-    
-    
-    def log(self, message):
-        """
-        Добавляет сообщение в лог (текстовое поле внизу окна).
-        """
-        self.log_text.config(state=tk.NORMAL)  # Разрешаем редактирование
-        self.log_text.insert(tk.END, message + "\n")  # Добавляем текст в конец
-        self.log_text.see(tk.END)  # Прокручиваем к концу
-        self.log_text.config(state=tk.DISABLED)  # Запрещаем редактирование
-    
-    
-    def load_files(self):
-        """
-        Открывает диалог выбора файлов.
-        Позволяет выбрать до 10 JSON файлов.
-        """
-        # Открываем диалог выбора файлов
-        files = filedialog.askopenfilenames(
-            title="Выберите JSON файлы (до 10 штук)",
-            filetypes=[
-                ("JSON файлы", "*.json"),
-                ("Все файлы", "*.*")
-            ]
-        )
-        
-        # Если пользователь нажал "Отмена", files будет пустым
-        if not files:
-            return
-        
-        # Проверяем, что выбрано не более 10 файлов
-        if len(files) > 10:
-            messagebox.showwarning(
-                "Слишком много файлов",
-                "Можно выбрать максимум 10 файлов.\nВыбраны первые 10."
-            )
-            files = files[:10]  # Берём только первые 10
-        
-        # Сохраняем список файлов
-        self.selected_files = list(files)
-        
-        # Очищаем список в интерфейсе
-        self.files_listbox.delete(0, tk.END)
-        
-        # Добавляем файлы в список
-        for file_path in self.selected_files:
-            # Получаем только имя файла (без полного пути)
-            file_name = os.path.basename(file_path)
-            self.files_listbox.insert(tk.END, file_name)
-        
-        # Активируем кнопку обработки
-        self.btn_process.config(state=tk.NORMAL)
-        
-        # Сообщение в лог
-        self.log(f"Выбрано файлов: {len(self.selected_files)}")
-    
-    
-    def start_processing(self):
-        """
-        Запускает обработку файлов в отдельном потоке.
-        Отдельный поток нужен, чтобы окно не зависало во время работы.
-        """
-        if not self.selected_files:
-            messagebox.showwarning("Нет файлов", "Сначала выберите файлы для обработки!")
-            return
-        
-        # Сбрасываем флаг остановки
-        self.stop_processing = False
-        
-        # Блокируем кнопки во время обработки
-        self.btn_load.config(state=tk.DISABLED)
-        self.btn_process.config(state=tk.DISABLED)
-        self.btn_stop.config(state=tk.NORMAL)
-        
-        # Сбрасываем прогресс
-        self.progress_files['value'] = 0
-        self.progress_current['value'] = 0
-        
-        # Запускаем обработку в отдельном потоке
-        # threading.Thread создаёт новый поток выполнения
-        processing_thread = threading.Thread(target=self.process_files)
-        processing_thread.daemon = True  # Поток завершится при закрытии программы
-        processing_thread.start()
-    
-    
-    def stop_process(self):
-        """
-        Останавливает обработку файлов.
-        """
-        self.stop_processing = True
-        self.log("⏹ Остановка обработки... Дождитесь завершения текущего файла.")
-    
-    
-    def process_files(self):
-        """
-        Основная функция обработки всех выбранных файлов.
-        Выполняется в отдельном потоке.
-        """
-        total_files = len(self.selected_files)
-        start_time = time.time()
-        
-        self.log("=" * 50)
-        self.log(f"🚀 Начинаем обработку {total_files} файлов...")
-        self.log("=" * 50)
-        
-        for index, file_path in enumerate(self.selected_files):
-            # Проверяем, не нажата ли кнопка "Остановить"
-            if self.stop_processing:
-                self.log("❌ Обработка остановлена пользователем")
-                break
-            
-            # Обновляем надпись текущего файла
-            file_name = os.path.basename(file_path)
-            self.label_current_file.config(
-                text=f"Обрабатывается: {file_name} ({index + 1}/{total_files})"
-            )
-            
-            self.log(f"\n📄 Файл {index + 1}/{total_files}: {file_name}")
-            
-            try:
-                # Обрабатываем файл
-                self.process_single_file(file_path)
-            except Exception as e:
-                self.log(f"❌ Ошибка при обработке файла: {str(e)}")
-            
-            # Обновляем прогресс по файлам
-            progress_percent = ((index + 1) / total_files) * 100
-            self.progress_files['value'] = progress_percent
-            self.root.update_idletasks()  # Обновляем интерфейс
-        
-        # Обработка завершена
-        elapsed_time = time.time() - start_time
-        self.log("=" * 50)
-        self.log(f"✅ Обработка завершена за {elapsed_time:.1f} секунд")
-        self.log("=" * 50)
-        
-        # Разблокируем кнопки
-        self.btn_load.config(state=tk.NORMAL)
-        self.btn_process.config(state=tk.NORMAL)
-        self.btn_stop.config(state=tk.DISABLED)
-        self.label_current_file.config(text="Готово!")
-        
-        # Показываем сообщение об успешном завершении
-        if not self.stop_processing:
-            messagebox.showinfo(
-                "Готово!", 
-                f"Обработка {total_files} файлов завершена!\n"
-                f"Время: {elapsed_time:.1f} секунд"
-            )
-    
-    
-    def process_single_file(self, file_path):
-        """
-        Обрабатывает один JSON файл.
-        
-        Шаги:
-        1. Читаем файл построчно
-        2. Пропускаем пустые строки
-        3. Парсим JSON
-        4. Проверяем на дубликаты по title/Наименование
-        5. Заменяем значения полей
-        6. Если строк больше 3 000 000 — разбиваем на несколько файлов
-        7. Сохраняем результат
-        """
-        
-        file_name = os.path.basename(file_path)
-        file_dir = os.path.dirname(file_path)
-        file_name_without_ext = os.path.splitext(file_name)[0]
-        
-        # ШАГ 1: Подсчитываем количество строк в файле
-        self.log("   Подсчёт строк в файле...")
-        self.progress_current['value'] = 0
-        self.root.update_idletasks()
-        
-        total_lines = 0
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for _ in f:
-                total_lines += 1
-        
-        self.log(f"   Всего строк в файле: {total_lines:,}".replace(',', ' '))
-        
-        # ШАГ 2: Читаем и обрабатываем файл
-        self.log("   Чтение и обработка данных...")
-        
-        # Множество (set) для хранения уже встреченных значений title
-        # Множество позволяет быстро проверять, есть ли уже такое значение
-        seen_titles = set()
-        
-        # Список для хранения уникальных записей
-        unique_records = []
-        
-        # Счётчики для статистики
-        empty_lines = 0
-        duplicates = 0
-        processed_lines = 0
-        parse_errors = 0
-        
-        # Открываем файл для чтения
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line_number, line in enumerate(f, 1):
-                # Проверяем, не остановлена ли обработка
-                if self.stop_processing:
-                    return
-                
-                # Обновляем прогресс каждые 10000 строк
-                if line_number % 10000 == 0:
-                    progress_percent = (line_number / total_lines) * 100
-                    self.progress_current['value'] = progress_percent
-                    self.root.update_idletasks()
-                
-                # Убираем пробелы и переносы строк в начале и конце
-                line = line.strip()
-                
-                # Пропускаем пустые строки
-                if not line:
-                    empty_lines += 1
-                    continue
-                
-                # Пытаемся распарсить JSON
-                try:
-                    record = json.loads(line)
-                except json.JSONDecodeError:
-                    # Если строка — не валидный JSON, пропускаем её
-                    parse_errors += 1
-                    continue
-                
-                # Получаем значение title или Наименование
-                title = None
-                if 'title' in record:
-                    title = record.get('title')
-                elif 'Наименование' in record:
-                    title = record.get('Наименование')
-                
-                # Если title есть и уже был — это дубликат
-                if title is not None:
-                    if title in seen_titles:
-                        duplicates += 1
-                        continue  # Пропускаем дубликат
-                    else:
-                        seen_titles.add(title)  # Добавляем в множество
-                
-                # Заменяем значения полей
-                record = self.replace_field_values(record)
-                
-                # Добавляем запись в список уникальных
-                unique_records.append(record)
-                processed_lines += 1
-        
-        # Обновляем прогресс на 100%
-        self.progress_current['value'] = 100
-        self.root.update_idletasks()
-        
-        # Выводим статистику
-        self.log(f"   ✓ Пустых строк удалено: {empty_lines:,}".replace(',', ' '))
-        self.log(f"   ✓ Дубликатов удалено: {duplicates:,}".replace(',', ' '))
-        self.log(f"   ✓ Ошибок парсинга: {parse_errors:,}".replace(',', ' '))
-        self.log(f"   ✓ Уникальных записей: {len(unique_records):,}".replace(',', ' '))
-        
-        # ШАГ 3: Сохраняем результат
-        self.log("   Сохранение результата...")
-        
-        if len(unique_records) <= MAX_LINES_PER_FILE:
-            # Если записей меньше или равно 3 миллиона — сохраняем в один файл
-            output_file = os.path.join(file_dir, f"{file_name_without_ext}_cleaned.json")
-            self.save_records_to_file(unique_records, output_file)
-            self.log(f"   ✓ Сохранено в: {os.path.basename(output_file)}")
-        else:
-            # Если записей больше 3 миллионов — разбиваем на части
-            self.log(f"   📦 Разбиваем на части по {MAX_LINES_PER_FILE:,} строк...".replace(',', ' '))
-            
-            part_number = 1
-            for i in range(0, len(unique_records), MAX_LINES_PER_FILE):
-                chunk = unique_records[i:i + MAX_LINES_PER_FILE]
-                output_file = os.path.join(
-                    file_dir, 
-                    f"{file_name_without_ext}_cleaned_part{part_number}.json"
-                )
-                self.save_records_to_file(chunk, output_file)
-                self.log(f"   ✓ Часть {part_number}: {len(chunk):,} записей → {os.path.basename(output_file)}".replace(',', ' '))
-                part_number += 1
-        
-        self.log(f"   ✅ Файл обработан успешно!")
-    
-    
-    def replace_field_values(self, record):
-        """
-        Заменяет значения полей stock, under_order, price на новые.
-        Также обрабатывает русские названия полей.
-        
-        record — это словарь (одна запись из JSON)
-        """
-        
-        # Замена поля stock / Склад
-        if 'stock' in record:
-            record['stock'] = NEW_STOCK_VALUE
-        if 'Склад' in record:
-            record['Склад'] = NEW_STOCK_VALUE
-        
-        # Замена поля under_order / under-order / Под заказ
-        if 'under_order' in record:
-            record['under_order'] = NEW_UNDER_ORDER_VALUE
-        if 'under-order' in record:
-            record['under-order'] = NEW_UNDER_ORDER_VALUE
-        if 'Под заказ' in record:
-            record['Под заказ'] = NEW_UNDER_ORDER_VALUE
-        
-        # Замена поля price / Цена
-        if 'price' in record:
-            record['price'] = NEW_PRICE_VALUE
-        if 'Цена' in record:
-            record['Цена'] = NEW_PRICE_VALUE
-        
-        return record
-    
-    
-    def save_records_to_file(self, records, output_file):
-        """
-        Сохраняет список записей в JSON файл (по одной записи на строку).
-        
-        records — список словарей
-        output_file — путь к файлу для сохранения
-        """
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for record in records:
-                # Записываем каждую запись в отдельную строку
-                # ensure_ascii=False — чтобы русские буквы сохранялись как есть
-                json_line = json.dumps(record, ensure_ascii=False)
-                f.write(json_line + '\n')
-
-
-# ==================== ЗАПУСК ПРОГРАММЫ ====================
-
-if __name__ == "__main__":
-    """
-    Эта часть кода выполняется только если файл запущен напрямую
-    (а не импортирован как модуль в другую программу).
-    """
-    
-    # Создаём главное окно
-    root = tk.Tk()
-    
-    # Создаём наше приложение
-    app = JSONCleanerApp(root)
-    
-    # Запускаем главный цикл обработки событий
-    # (программа будет работать, пока окно не закроют)
-    root.mainloop()
\ No newline at end of file
+"""
+Скрипт для удаления дубликатов в JSON файлах
+Автор: Assistant
+Версия: 1.0
+
+Что делает скрипт:
+1. Открывает окно для выбора JSON файла (или нескольких файлов)
+2. Удаляет пустые строки
+3. Удаляет дубликаты по полю "title" или "Наименование"
+4. Заменяет значения полей stock/Склад, under_order/Под заказ, price/Цена
+5. Разбивает большие файлы на части по 3 000 000 строк
+6. Сохраняет результат в той же папке
+
+Запуск:
+    python json_cleaner.py                      — окно программы
+    python json_cleaner.py a.json b.json -o out — обработка без окна
+    python json_cleaner.py --help               — все параметры командной строки
+Из другой программы: CleanerEngine (файлы) или clean_lines (строки).
+"""
+
+# ==================== ИМПОРТ БИБЛИОТЕК ====================
+# Это как "подключение инструментов" которые нам понадобятся
+# Тяжёлые библиотеки (tkinter, concurrent.futures, tempfile) подключаются
+# только там, где они действительно нужны, — так запуск из командной строки
+# и импорт из других программ остаются быстрыми, а окно не требуется вовсе
+
+import json                             # Для работы с JSON файлами
+import threading                        # Для работы в нескольких потоках (чтобы окно не зависало)
+import queue                            # Для передачи событий из потока обработки в окно
+import os                               # Для работы с файлами и папками
+import time                             # Для измерения времени работы
+import re                               # Для регулярных выражений (правила полей)
+import sys                              # Для подсчёта памяти, занятой объектами
+import hashlib                          # Для компактных хешей title (blake2b)
+from array import array                 # Для плотной таблицы хешей без лишних объектов
+import struct                           # Для записи во временные файлы в двоичном виде
+import heapq                            # Для слияния отсортированных временных файлов
+import zlib                             # Для быстрого crc32 при разбиении по корзинам
+import mmap                             # Для постоянного индекса title в файле
+import io                               # Для разбора прочитанного блока на строки
+import codecs                           # Для постепенного декодирования JSON массива
+import math                             # Для оценки по выборке
+import unicodedata                      # Для нормализации title (NFKC) при поиске похожих
+import random                           # Для одинаковых "перестановок" MinHash
+from collections import deque           # Очередь задач для параллельной обработки
+
+
+# ==================== НАСТРОЙКИ ====================
+# Здесь можно менять значения для замены полей
+
+# Максимальное количество строк в одном файле
+MAX_LINES_PER_FILE = 3000000  # 3 миллиона строк
+# Максимальный размер одной части в мегабайтах (None — без ограничения).
+# Новая часть начинается, как только достигнут любой из двух лимитов.
+# Со сжатием размер считается до сжатия (сжатая часть получится меньше)
+MAX_PART_MB = None
+
+# Манифест частей "<имя>_cleaned_manifest.json": для каждой части — какие записи
+# в ней лежат, её размер и смещения начала блоков записей (чтобы загрузчик мог
+# перейти к любой записи или раздать части нескольким процессам без перечитывания)
+PART_MANIFEST = True
+
+# Значения для замены полей
+NEW_STOCK_VALUE = "188"           # Новое значение для поля "stock" или "Склад"
+NEW_UNDER_ORDER_VALUE = "5-8 дней"  # Новое значение для поля "under_order" или "Под заказ"
+NEW_PRICE_VALUE = "110 руб"       # Новое значение для поля "price" или "Цена"
+
+# Свои правила полей: путь к JSON файлу (None — только замены выше).
+# В файле задаются поля title для поиска дубликатов, переименование полей
+# и правила set/replace/regex/drop (формат — у класса FieldRules)
+FIELD_RULES = None
+
+# Как хранить уже встреченные title (индекс дубликатов):
+#   "hashed" — хранятся только хеши фиксированной длины (мало памяти,
+#              крошечная вероятность ложного дубликата, см. HashedTitleIndex)
+#   "exact"  — хранятся сами строки (точно, но памяти нужно в разы больше)
+DEDUP_INDEX = "hashed"
+DEDUP_HASH_BITS = 64   # Длина хеша: 64 или 128 бит
+
+# По каким полям искать дубликаты: None — только title (как раньше),
+# или список полей, например ("title", "sku") — дубликат, только если совпали все.
+# "title" здесь означает поле title по правилам (title или Наименование)
+DEDUP_KEY = None
+
+# Какую из записей с одинаковым ключом оставлять:
+#   "first" — первую (как раньше)
+#   "last" — последнюю (исправленные строки поставщик дописывает в конец)
+#   "merge" — первую, дополненную полями следующих (более поздние значения важнее)
+# "last" и "merge" читают файл дважды: сначала запоминаются только позиции
+# строк по ключам (PositionIndex), а записи в памяти не копятся
+DEDUP_KEEP = "first"
+
+# Поиск похожих title (см. NearDuplicateIndex): дубликатами считаются и title,
+# совпадающие после нормализации (регистр, пробелы, "2 м" / "2м"), и title
+# с почти тем же набором слов. False — только точное совпадение (как раньше)
+NEAR_DUPLICATES = False
+NEAR_DUP_THRESHOLD = 0.8     # Насколько похожими должны быть наборы слов (от 0 до 1)
+NEAR_DUP_PERMUTATIONS = 32   # Длина подписи MinHash (больше — точнее, но медленнее)
+
+# Лимит памяти для индекса дубликатов (в мегабайтах).
+# Если индекс перерастает лимит, дубликаты ищутся через временные файлы на диске
+# (см. DiskDeduplicator). Результат при этом получается точно таким же.
+# None — без лимита
+MEMORY_BUDGET_MB = None
+SPILL_BUCKETS = 128    # На сколько временных файлов ("корзин") делить записи
+SPILL_DIR = None       # Папка для временных файлов (None — системная временная папка)
+
+# Сколько процессов используется для обработки одного большого файла:
+#   1 — всё в одном потоке (как раньше)
+#   0 — по количеству ядер процессора
+PARALLEL_WORKERS = 1
+PARALLEL_CHUNK_MB = 16  # Размер куска файла, который получает один процесс
+
+# Как часто обновлять прогресс текущего файла (в секундах)
+PROGRESS_INTERVAL = 0.2
+
+# Окно: как часто (в миллисекундах) забирать события из потока обработки
+# и сколько последних строк лога держать на экране
+UI_REFRESH_MS = 50
+LOG_MAX_LINES = 2000
+
+# Сколько выбранных файлов разбирать одновременно (1 — по очереди, 0 — по числу ядер)
+PARALLEL_FILES = 1
+
+# Общий поиск дубликатов по всем выбранным файлам:
+# title, встреченный в более раннем файле (в порядке выбора), удаляется из следующих.
+# title файлов, которые не удалось обработать до конца, не учитываются.
+# False — каждый файл очищается отдельно (как раньше)
+GLOBAL_DEDUP = False
+
+# Отчёт о запуске: для каждого файла рядом с результатом сохраняется
+# "<имя>_cleaned_report.json" (время, байты, скорость, пик памяти),
+# а для всего запуска — "json_cleaner_report_<дата>.json"
+RUN_REPORT = False
+# Замер времени каждого этапа (чтение, json.loads, дубликаты, замена полей,
+# json.dumps, запись). Сами замеры немного замедляют обработку
+STAGE_TIMING = False
+TIMELINE_INTERVAL = 1.0   # Как часто (в секундах) записывать скорость в отчёт
+# Профилировщик "по выборке": какие строки кода выполнялись чаще всего
+PROFILE_SAMPLING = False
+PROFILE_INTERVAL = 0.005  # Пауза между выборками (в секундах)
+
+# Контрольные точки: во время обработки файла периодически сохраняется, докуда
+# она дошла (смещение во входном файле, счётчики, индекс дубликатов, готовые части).
+# После остановки или сбоя следующий запуск продолжит файл с этого места.
+# Не работают при общем поиске дубликатов, постоянном индексе title
+# и параллельной обработке нескольких файлов.
+# В окне их включает галочка "Сохранять прогресс", в командной строке — --checkpoint-interval
+CHECKPOINTS = False
+CHECKPOINT_INTERVAL = 60.0      # Не чаще, чем раз в столько секунд
+CHECKPOINT_MAX_OVERHEAD = 0.05  # На сохранение уходит не больше этой доли времени
+CHECKPOINT_RESUME = True        # Продолжать с найденной контрольной точки
+
+# Постоянный индекс title: путь к файлу (None — не использовать).
+# title из файла считаются уже опубликованными и отбрасываются,
+# новые title дописываются в файл после успешной обработки каждого файла
+# (поэтому файлы одного запуска тоже очищаются друг относительно друга)
+PERSISTENT_INDEX = None
+
+# Сжатые файлы: .gz, .bz2 и .xz на входе распознаются сами.
+# Сжатие результата: None — без сжатия, "gz", "bz2" или "xz"
+OUTPUT_COMPRESSION = None
+COMPRESSION_LEVEL = None   # Степень сжатия (None — обычная для формата)
+IO_BUFFER_KB = 1024        # Размер буфера чтения и записи (в килобайтах)
+
+# Как читать несжатый файл:
+#   "buffered" — построчно через обычный файл (как раньше)
+#   "mmap" — отобразить файл в память и резать на строки блоками по IO_BUFFER_KB;
+#            пустые строки отсеиваются без декодирования
+READER = "buffered"
+
+# Конвейер: чтение файла, разбор строк и запись результата идут одновременно
+# в трёх потоках, связанных ограниченными очередями (см. StageQueue).
+# Пока строки разбираются, следующий блок уже читается, а готовый пишется на диск.
+# Глубина очередей и время ожидания этапов попадают в отчёт ("queues")
+PIPELINE = False
+PIPELINE_QUEUE_BLOCKS = 8   # Сколько блоков (по IO_BUFFER_KB) может ждать в каждой очереди
+
+# Формат входного файла:
+#   "auto" — определить по началу файла
+#   "ndjson" — по одной записи на строку
+#   "array" — весь файл — один JSON массив [ {...}, {...} ] (читается по одному элементу)
+INPUT_FORMAT = "auto"
+
+# Предварительная оценка (--estimate, см. estimate_file): какую долю файла
+# прочитать, чтобы оценить число уникальных title, частей и время обработки
+ESTIMATE_SAMPLE_PERCENT = 1.0
+ESTIMATE_MIN_SAMPLE_MB = 2    # Но не меньше стольких мегабайт
+ESTIMATE_WINDOWS = 64         # Из скольких кусков, разбросанных по файлу, состоит выборка
+
+
+# ==================== ОЦЕНКА КОЛИЧЕСТВА СТРОК ====================
+
+def estimate_line_count(file_path, file_size, samples=8, sample_size=64 * 1024, line_end=b'\n'):
+    """
+    Быстро оценивает количество строк в файле, не читая его целиком.
+    
+    Берём несколько кусочков по sample_size байт, равномерно разбросанных
+    по файлу, и считаем в них переводы строк (line_end, см. detect_line_end). Средняя длина строки
+    в выборке даёт оценку: размер файла / средняя длина строки.
+    Для маленьких файлов выборка покрывает весь файл и оценка точная.
+    """
+    if file_size == 0:
+        return 0
+    
+    sampled_bytes = 0
+    sampled_newlines = 0
+    
+    with open(file_path, 'rb') as f:
+        if file_size <= samples * sample_size:
+            # Файл небольшой — просто читаем его весь
+            offsets = [0]
+            sample_size = file_size
+        else:
+            step = file_size // samples
+            offsets = [i * step for i in range(samples)]
+        
+        for offset in offsets:
+            f.seek(offset)
+            block = f.read(sample_size)
+            sampled_bytes += len(block)
+            sampled_newlines += block.count(line_end)
+    
+    if sampled_newlines == 0:
+        # В выборке нет ни одного перевода строки — считаем, что строка одна
+        return 1
+    
+    average_line_length = sampled_bytes / sampled_newlines
+    return max(1, round(file_size / average_line_length))
+
+
+# ==================== ИНДЕКС ДУБЛИКАТОВ ====================
+# Хранит уже встреченные title. Есть два варианта: точный и компактный (хеши)
+
+def equal_title_form(value):
+    """
+    Приводит значение title к виду, в котором равные для Python значения
+    выглядят одинаково: True и 1, 1.0 и 1 считаются одним и тем же title
+    (как было при проверке через обычное множество seen_titles).
+    Целые float и bool становятся int, списки и словари обходятся вглубь.
+    """
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, list):
+        return [equal_title_form(item) for item in value]
+    if isinstance(value, dict):
+        return {key: equal_title_form(item) for key, item in value.items()}
+    return value
+
+
+def title_key_bytes(title):
+    """
+    Превращает значение title в байты — ключ для индекса дубликатов.
+    Строки кодируются в UTF-8 как есть, остальные значения (числа, списки)
+    сериализуются в JSON, чтобы их тоже можно было сравнивать.
+    Числа и bool сначала приводятся через equal_title_form, поэтому
+    title 1, 1.0 и true дают один ключ — так же, как 1 == 1.0 == True в Python.
+    (Единственное отличие от обычного множества: NaN считается равным NaN.)
+    """
+    if isinstance(title, str):
+        return b's' + title.encode('utf-8', 'surrogatepass')
+    text = json.dumps(equal_title_form(title), ensure_ascii=False, sort_keys=True)
+    return b'j' + text.encode('utf-8', 'surrogatepass')
+
+
+class ExactTitleIndex:
+    """
+    Точный индекс: хранит ключи title целиком в обычном множестве (set).
+    Ложных дубликатов не бывает, но каждая строка занимает
+    свою длину плюс служебные байты Python-объекта.
+    """
+    
+    name = "exact"
+    
+    def __init__(self):
+        self.seen = set()
+        self.keys_bytes = 0   # Сколько памяти занимают сами ключи
+    
+    
+    def key(self, title):
+        """Ключ для title (для точного индекса — сами байты)."""
+        return title_key_bytes(title)
+    
+    
+    def add(self, title):
+        """
+        Добавляет title в индекс.
+        Возвращает True, если title встретился впервые, и False для дубликата.
+        """
+        return self.add_key(self.key(title))
+    
+    
+    def add_key(self, key):
+        """То же, что add, но для уже готового ключа."""
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        self.keys_bytes += sys.getsizeof(key)
+        return True
+    
+    
+    def contains_key(self, key):
+        """Есть ли ключ key в индексе (без добавления)."""
+        return key in self.seen
+    
+    
+    def merge(self, other):
+        """Добавляет в индекс все ключи индекса other. Возвращает, сколько из них было новыми."""
+        added = 0
+        for key in other.iter_keys():
+            if self.add_key(key):
+                added += 1
+        return added
+    
+    
+    def iter_keys(self):
+        """Перебирает все ключи индекса."""
+        return iter(self.seen)
+    
+    
+    def save(self, f):
+        """Записывает индекс в открытый двоичный файл (для контрольной точки)."""
+        header = struct.Struct('<I')
+        for key in self.seen:
+            f.write(header.pack(len(key)))
+            f.write(key)
+    
+    
+    def load(self, f):
+        """Добавляет в индекс ключи, записанные save."""
+        header = struct.Struct('<I')
+        while True:
+            data = f.read(header.size)
+            if not data:
+                return
+            self.add_key(f.read(header.unpack(data)[0]))
+    
+    
+    def release(self):
+        """Освобождает память, занятую ключами."""
+        self.seen = set()
+        self.keys_bytes = 0
+    
+    
+    def __len__(self):
+        return len(self.seen)
+    
+    
+    def memory_bytes(self):
+        """Примерный объём памяти, занятый индексом (в байтах)."""
+        return sys.getsizeof(self.seen) + self.keys_bytes
+    
+    
+    def memory_bytes_after_add(self, key):
+        """Сколько памяти займёт индекс, если добавить в него key."""
+        return self.memory_bytes() + sys.getsizeof(key)
+
+
+class HashedTitleIndex:
+    """
+    Компактный индекс: вместо строк хранит их хеши blake2b (64 или 128 бит)
+    в хеш-таблице с открытой адресацией поверх array('Q').
+    
+    На один title уходит 8 (или 16) байт хеша плюс запас пустых ячеек —
+    в среднем 11–23 байта на ключ для 64 бит вместо ~150+ байт у строки.
+    
+    Плата за это — вероятность того, что два разных title дадут одинаковый
+    хеш и второй будет ошибочно считаться дубликатом. Для n разных title
+    и хеша длиной b бит она примерно равна n² / 2^(b+1):
+        64 бита,  30 млн title — около 2.4 × 10⁻⁵ (1 шанс на ~40 000 запусков)
+        128 бит, 30 млн title — около 1.3 × 10⁻²⁴ (практически ноль)
+    Кому недопустим даже такой риск — DEDUP_INDEX = "exact".
+    """
+    
+    name = "hashed"
+    
+    # Таблица расширяется вдвое, когда заполнена больше чем на 70%
+    MAX_LOAD = 0.7
+    
+    def __init__(self, bits=64, capacity=1024):
+        if bits not in (64, 128):
+            raise ValueError(f"Длина хеша должна быть 64 или 128 бит, а не {bits}")
+        
+        self.bits = bits
+        self.digest_size = bits // 8
+        self.count = 0
+        self.allocate(capacity)
+    
+    
+    def allocate(self, capacity):
+        """Создаёт пустую таблицу на capacity ячеек (capacity — степень двойки)."""
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.grow_at = int(capacity * self.MAX_LOAD)
+        # Ноль в ячейке означает "пусто"
+        self.low = array('Q', bytes(8 * capacity))
+        self.high = array('Q', bytes(8 * capacity)) if self.bits == 128 else None
+    
+    
+    def key(self, title):
+        """Ключ для title — хеш blake2b нужной длины."""
+        digest = hashlib.blake2b(title_key_bytes(title), digest_size=self.digest_size).digest()
+        if not any(digest[:8]):
+            # Младшие 8 байт, равные нулю, заняты под "пусто" — заменяем на 1,
+            # чтобы ключ совпадал с тем, что реально лежит в таблице
+            digest = (1).to_bytes(8, 'little') + digest[8:]
+        return digest
+    
+    
+    def add(self, title):
+        """
+        Добавляет title в индекс.
+        Возвращает True, если title встретился впервые, и False для дубликата.
+        """
+        return self.add_key(self.key(title))
+    
+    
+    def add_key(self, key):
+        """То же, что add, но для уже готового хеша."""
+        low = int.from_bytes(key[:8], 'little')
+        high = int.from_bytes(key[8:], 'little') if self.high is not None else 0
+        
+        if self.insert(low, high):
+            self.count += 1
+            if self.count > self.grow_at:
+                self.grow()
+            return True
+        return False
+    
+    
+    def contains_key(self, key):
+        """Есть ли хеш key в индексе (без добавления)."""
+        low = int.from_bytes(key[:8], 'little')
+        high = int.from_bytes(key[8:], 'little') if self.high is not None else 0
+        table_low = self.low
+        table_high = self.high
+        mask = self.mask
+        slot = low & mask
+        
+        while True:
+            current = table_low[slot]
+            if current == 0:
+                return False
+            if current == low and (table_high is None or table_high[slot] == high):
+                return True
+            slot = (slot + 1) & mask
+    
+    
+    def merge(self, other):
+        """Добавляет в индекс все хеши индекса other. Возвращает, сколько из них было новыми."""
+        added = 0
+        for key in other.iter_keys():
+            if self.add_key(key):
+                added += 1
+        return added
+    
+    
+    def insert(self, low, high):
+        """
+        Линейное пробирование: идём по ячейкам, начиная с low & mask,
+        пока не найдём такой же хеш (дубликат) или пустую ячейку.
+        """
+        table_low = self.low
+        table_high = self.high
+        mask = self.mask
+        slot = low & mask
+        
+        while True:
+            current = table_low[slot]
+            if current == 0:
+                table_low[slot] = low
+                if table_high is not None:
+                    table_high[slot] = high
+                return True
+            if current == low and (table_high is None or table_high[slot] == high):
+                return False
+            slot = (slot + 1) & mask
+    
+    
+    def grow(self):
+        """Увеличивает таблицу вдвое и переносит в неё все хеши."""
+        old_low = self.low
+        old_high = self.high
+        self.allocate(self.capacity * 2)
+        
+        for slot, low in enumerate(old_low):
+            if low:
+                self.insert(low, old_high[slot] if old_high is not None else 0)
+    
+    
+    def iter_keys(self):
+        """Перебирает все хеши индекса (в том же виде, что возвращает key)."""
+        table_high = self.high
+        for slot, low in enumerate(self.low):
+            if low:
+                key = low.to_bytes(8, 'little')
+                if table_high is not None:
+                    key += table_high[slot].to_bytes(8, 'little')
+                yield key
+    
+    
+    def save(self, f):
+        """Записывает таблицу в открытый двоичный файл (для контрольной точки)."""
+        f.write(struct.pack('<QQ', self.count, self.capacity))
+        self.low.tofile(f)
+        if self.high is not None:
+            self.high.tofile(f)
+    
+    
+    def load(self, f):
+        """Заменяет таблицу той, что записана save (с тем же числом бит)."""
+        self.count, capacity = struct.unpack('<QQ', f.read(16))
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.grow_at = int(capacity * self.MAX_LOAD)
+        self.low = array('Q')
+        self.low.fromfile(f, capacity)
+        if self.high is not None:
+            self.high = array('Q')
+            self.high.fromfile(f, capacity)
+    
+    
+    def release(self):
+        """Освобождает память, занятую таблицей."""
+        self.count = 0
+        self.allocate(1024)
+    
+    
+    def __len__(self):
+        return self.count
+    
+    
+    def memory_bytes(self):
+        """Примерный объём памяти, занятый индексом (в байтах)."""
+        total = self.low.buffer_info()[1] * self.low.itemsize
+        if self.high is not None:
+            total += self.high.buffer_info()[1] * self.high.itemsize
+        return total
+    
+    
+    def memory_bytes_after_add(self, key):
+        """
+        Сколько памяти понадобится, если добавить в индекс key.
+        При расширении старая и новая таблицы какое-то время живут
+        одновременно, поэтому в пике памяти нужно втрое больше.
+        """
+        if self.count + 1 > self.grow_at:
+            return self.memory_bytes() * 3
+        return self.memory_bytes()
+
+
+def create_title_index(backend=None, bits=None):
+    """
+    Создаёт индекс дубликатов по настройкам DEDUP_INDEX / DEDUP_HASH_BITS
+    (или по явно переданным значениям). При NEAR_DUPLICATES — NearDuplicateIndex.
+    """
+    if NEAR_DUPLICATES:
+        return NearDuplicateIndex()
+    backend = backend or DEDUP_INDEX
+    if backend == "exact":
+        return ExactTitleIndex()
+    if backend == "hashed":
+        return HashedTitleIndex(bits or DEDUP_HASH_BITS)
+    raise ValueError(f"Неизвестный тип индекса дубликатов: {backend}")
+
+
+def describe_title_index(index):
+    """Короткое описание индекса для лога: тип, число ключей и память."""
+    name = index.name
+    if getattr(index, 'bits', None):
+        name += f"-{index.bits}"
+    keys = f"{len(index):,}".replace(',', ' ')
+    megabytes = f"{index.memory_bytes() / 1024 / 1024:,.1f}".replace(',', ' ')
+    if isinstance(index, AttachedTitleIndex):
+        new_keys = f"{len(index.new):,}".replace(',', ' ')
+        return f"{name} — ключей: {keys} (новых: {new_keys}), память: {megabytes} МБ"
+    return f"{name} — ключей: {keys}, память: {megabytes} МБ"
+
+
+# ==================== ПОХОЖИЕ TITLE (MinHash/LSH) ====================
+# Точное сравнение пропускает большую часть настоящих повторов: разный регистр
+# и пробелы, переставленные слова, "Кабель 2м" и "Кабель 2 м".
+# В режиме NEAR_DUPLICATES дубликат ищется по ступеням:
+#   exact — такой же title, как уже встреченный (как без этого режима)
+#   normalized — такой же title после нормализации (normalize_title)
+#   near — похожий набор слов (похожесть не ниже NEAR_DUP_THRESHOLD),
+#          при этом слова с цифрами (размеры, артикулы) должны совпадать:
+#          "Кабель 3х1.5" и "Кабель 3х2.5" — разные товары
+# Сравнивать каждую пару записей на десятках миллионов строк невозможно,
+# поэтому для каждого title считается короткая подпись MinHash, а кандидаты
+# ищутся по её кускам ("полосам", LSH): сравниваются только записи,
+# у которых совпала хотя бы одна полоса
+
+# Десятичная запятая: "2,5" → "2.5"
+DECIMAL_COMMA_RE = re.compile(r'(\d),(\d)')
+# Число и единица измерения через пробел: "2 м" → "2м" (длинные единицы — раньше коротких)
+UNIT_RE = re.compile(r'(\d)\s+(мм|см|км|м2|м³|м²|м|кг|мг|г|мл|л|шт|квт|вт|ма|а|в|'
+                     r'mm|cm|km|m|kg|mg|g|ml|l|pcs|kw|w|ma|a|v)(?!\w)')
+# Слова для подписи MinHash (число с точкой — одно слово: "2.5мм")
+TOKEN_RE = re.compile(r'\w+(?:\.\w+)*')
+DIGIT_RE = re.compile(r'\d')
+
+# Кэш нормализации: одни и те же title у поставщика повторяются постоянно
+NORMALIZED_TITLES = {}
+NORMALIZED_TITLES_LIMIT = 200000   # Сколько title помнить (дальше кэш начинается заново)
+
+
+def normalize_title(title):
+    """
+    Нормализует title для поиска похожих: Unicode NFKC (одинаковые на вид
+    символы становятся одинаковыми), casefold (регистр), десятичная запятая →
+    точка, число и единица измерения — слитно, пробелы — по одному.
+    """
+    normalized = NORMALIZED_TITLES.get(title)
+    if normalized is None:
+        text = unicodedata.normalize('NFKC', title).casefold()
+        text = DECIMAL_COMMA_RE.sub(r'\1.\2', text)
+        text = UNIT_RE.sub(r'\1\2', text)
+        normalized = ' '.join(text.split())
+        if len(NORMALIZED_TITLES) >= NORMALIZED_TITLES_LIMIT:
+            NORMALIZED_TITLES.clear()
+        NORMALIZED_TITLES[title] = normalized
+    return normalized
+
+
+def lsh_bands(threshold, permutations):
+    """
+    Как разрезать подпись на полосы: (строк в полосе, полос).
+    
+    Пара с похожестью s становится кандидатом с вероятностью 1 - (1 - s^r)^b
+    (r строк, b полос). Эта кривая круто растёт около (1/b)^(1/r) — берём
+    самые длинные полосы, при которых это место ещё заметно ниже threshold:
+    похожие пары почти всегда находятся, а лишних кандидатов отсеивает
+    сравнение подписей.
+    """
+    best = (1, permutations)
+    for rows in range(1, permutations + 1):
+        bands = permutations // rows
+        if (1 / bands) ** (1 / rows) <= threshold - 0.15:
+            best = (rows, bands)
+    return best
+
+
+class NearDuplicateIndex:
+    """
+    Индекс дубликатов с поиском похожих title (NEAR_DUPLICATES).
+    
+    Снаружи работает как HashedTitleIndex (key, add, add_key...), поэтому
+    подходит и для параллельной обработки: ключ title — 8 байт хеша
+    исходного title и нормализованный title в UTF-8, его можно посчитать
+    в процессе-помощнике.
+    
+    Внутри:
+        exact, normalized — хеши исходных и нормализованных title (HashedTitleIndex)
+        signatures — подписи MinHash оставленных записей подряд, по 16 бит
+                     на перестановку (меньше памяти; случайные совпадения
+                     16-битных значений почти не влияют на оценку похожести),
+                     последнее значение подписи — хеш слов с цифрами
+        band_slots — таблица полос: хеш полосы (32 бита, вместе со словами
+                     с цифрами) и номер записи в одной ячейке, открытая
+                     адресация; у одного хеша может быть много записей
+        tiers — сколько дубликатов найдено на каждой ступени
+    Поиск дубликатов через диск (MEMORY_BUDGET_MB) и постоянный индекс
+    с этим индексом не работают: они умеют только точное сравнение.
+    """
+    
+    name = "near"
+    MAX_LOAD = 0.7
+    BUCKET_LIMIT = 32        # Больше записей с одной полосой не запоминаем (частые слова)
+    TOKEN_CACHE_LIMIT = 100000   # Сколько слов помнить с их значениями (дальше кэш начинается заново)
+    PRIME = (1 << 61) - 1    # Простое число для хешей "перестановок" MinHash
+    
+    def __init__(self, threshold=None, permutations=None):
+        self.threshold = threshold if threshold is not None else NEAR_DUP_THRESHOLD
+        self.permutations = permutations or NEAR_DUP_PERMUTATIONS
+        if not 0 < self.threshold <= 1:
+            raise ValueError(f"Порог похожести должен быть от 0 до 1, а не {self.threshold}")
+        self.rows, self.bands = lsh_bands(self.threshold, self.permutations)
+        
+        # Одни и те же "перестановки" во всех процессах и запусках
+        rng = random.Random(self.permutations)
+        self.coefficients = [(rng.randrange(1, self.PRIME), rng.randrange(self.PRIME))
+                             for _ in range(self.permutations)]
+        self.token_hashes = {}   # Слово → его значения для всех перестановок (array по 16 бит)
+        
+        self.exact = HashedTitleIndex(64)
+        self.normalized = HashedTitleIndex(64)
+        self.signatures = array('H')
+        self.stride = self.permutations + 1   # Длина подписи вместе с хешем слов с цифрами
+        self.count = 0           # Сколько подписей запомнено
+        self.tiers = {'exact': 0, 'normalized': 0, 'near': 0}
+        self.allocate_bands(1024)
+    
+    
+    def allocate_bands(self, capacity):
+        """Создаёт пустую таблицу полос на capacity ячеек (capacity — степень двойки)."""
+        self.band_capacity = capacity
+        self.band_mask = capacity - 1
+        self.band_grow_at = int(capacity * self.MAX_LOAD)
+        self.band_count = 0
+        # Ноль в ячейке означает "пусто" (номера записей хранятся с единицы)
+        self.band_slots = array('Q', bytes(8 * capacity))
+    
+    
+    def key(self, title):
+        """
+        Ключ для title: хеш исходного title и нормализованный текст
+        (у составного ключа DEDUP_KEY нормализуется каждое строковое поле).
+        """
+        if isinstance(title, str):
+            text = normalize_title(title)
+        elif isinstance(title, list):
+            text = ' '.join(normalize_title(value) if isinstance(value, str)
+                            else json.dumps(equal_title_form(value), ensure_ascii=False, sort_keys=True)
+                            for value in title)
+        else:
+            text = json.dumps(equal_title_form(title), ensure_ascii=False, sort_keys=True)
+        return self.exact.key(title) + text.encode('utf-8', 'surrogatepass')
+    
+    
+    def add(self, title):
+        """
+        Добавляет title в индекс.
+        Возвращает True, если ни такого, ни похожего title ещё не было, и False для дубликата.
+        """
+        return self.add_key(self.key(title))
+    
+    
+    def add_key(self, key):
+        """То же, что add, но для уже готового ключа."""
+        if not self.exact.add_key(key[:8]):
+            self.tiers['exact'] += 1
+            return False
+        
+        text = key[8:].decode('utf-8', 'surrogatepass')
+        if not self.normalized.add(text):
+            self.tiers['normalized'] += 1
+            return False
+        
+        signature = self.signature(text)
+        if signature is None:
+            return True   # Ни одного слова — сравнивать не с чем
+        hashes = self.band_hashes(signature)
+        if self.find_similar(signature, hashes):
+            self.tiers['near'] += 1
+            return False
+        
+        self.remember(signature, hashes)
+        return True
+    
+    
+    def contains_key(self, key):
+        """
+        Есть ли в индексе такой же или похожий title (без добавления и без подсчёта в tiers).
+        Возвращает ступень, на которой нашёлся дубликат ('exact', 'normalized', 'near'), или None.
+        """
+        if self.exact.contains_key(key[:8]):
+            return 'exact'
+        
+        text = key[8:].decode('utf-8', 'surrogatepass')
+        if self.normalized.contains_key(self.normalized.key(text)):
+            return 'normalized'
+        
+        signature = self.signature(text)
+        if signature is not None and self.find_similar(signature, self.band_hashes(signature)):
+            return 'near'
+        return None
+    
+    
+    def merge(self, other):
+        """
+        Добавляет в индекс записи индекса other (с теми же настройками)
+        без новой проверки на похожесть — other уже проверен по этому индексу
+        (см. AttachedTitleIndex). Возвращает, сколько title добавлено.
+        """
+        added = self.exact.merge(other.exact)
+        self.normalized.merge(other.normalized)
+        stride = other.stride
+        for item in range(other.count):
+            signature = tuple(other.signatures[item * stride:(item + 1) * stride])
+            self.remember(signature, self.band_hashes(signature))
+        for name, count in other.tiers.items():
+            self.tiers[name] += count
+        return added
+    
+    
+    def signature(self, text):
+        """
+        Подпись MinHash набора слов text: для каждой перестановки —
+        наименьшее значение по словам (значения слов сразу берутся
+        по младшим 16 битам и хранятся в кэше). Доля совпавших
+        позиций у двух подписей — оценка похожести наборов слов.
+        В конце подписи — хеш слов с цифрами (16 бит).
+        """
+        token_hashes = self.token_hashes
+        tokens = set(TOKEN_RE.findall(text))
+        numbers = ' '.join(sorted(token for token in tokens if DIGIT_RE.search(token)))
+        numbers_hash = int.from_bytes(hashlib.blake2b(numbers.encode('utf-8', 'surrogatepass'),
+                                                      digest_size=2).digest(), 'little')
+        columns = []
+        for token in tokens:
+            values = token_hashes.get(token)
+            if values is None:
+                x = int.from_bytes(hashlib.blake2b(token.encode('utf-8', 'surrogatepass'),
+                                                   digest_size=8).digest(), 'little')
+                prime = self.PRIME
+                values = array('H', [(a * x + b) % prime & 0xFFFF for a, b in self.coefficients])
+                if len(token_hashes) >= self.TOKEN_CACHE_LIMIT:
+                    token_hashes.clear()
+                token_hashes[token] = values
+            columns.append(values)
+        
+        if not columns:
+            return None
+        if len(columns) == 1:
+            return tuple(columns[0]) + (numbers_hash,)
+        return tuple(map(min, zip(*columns))) + (numbers_hash,)
+    
+    
+    def band_hashes(self, signature):
+        """32-битные хеши полос подписи (номер полосы и слова с цифрами входят в хеш)."""
+        rows = self.rows
+        numbers_hash = signature[-1]
+        return [hash((band, numbers_hash) + signature[band * rows:(band + 1) * rows]) & 0xFFFFFFFF
+                for band in range(self.bands)]
+    
+    
+    def find_similar(self, signature, hashes):
+        """Есть ли запомненная подпись с совпавшей полосой и похожестью не ниже порога."""
+        slots = self.band_slots
+        mask = self.band_mask
+        checked = set()
+        
+        for band_hash in hashes:
+            slot = band_hash & mask
+            while True:
+                value = slots[slot]
+                if value == 0:
+                    break
+                if value >> 32 == band_hash:
+                    item = (value & 0xFFFFFFFF) - 1
+                    if item not in checked:
+                        checked.add(item)
+                        if self.similarity(signature, item) >= self.threshold:
+                            return True
+                slot = (slot + 1) & mask
+        return False
+    
+    
+    def similarity(self, signature, item):
+        """
+        Доля совпавших позиций подписи signature и подписи записи item
+        (0, если у них разные слова с цифрами).
+        """
+        start = item * self.stride
+        stored = self.signatures[start:start + self.stride]
+        if stored[-1] != signature[-1]:
+            return 0.0
+        return (sum(map(int.__eq__, signature, stored)) - 1) / self.permutations
+    
+    
+    def remember(self, signature, hashes):
+        """Запоминает подпись и её полосы."""
+        item = self.count
+        self.count += 1
+        self.signatures.extend(signature)
+        for band_hash in hashes:
+            self.insert_band((band_hash << 32) | (item + 1))
+        if self.band_count > self.band_grow_at:
+            self.grow_bands()
+    
+    
+    def insert_band(self, value):
+        """Кладёт полосу в таблицу (если у её хеша ещё меньше BUCKET_LIMIT записей)."""
+        slots = self.band_slots
+        mask = self.band_mask
+        band_hash = value >> 32
+        slot = band_hash & mask
+        same = 0
+        
+        while slots[slot]:
+            if slots[slot] >> 32 == band_hash:
+                same += 1
+                if same >= self.BUCKET_LIMIT:
+                    return
+            slot = (slot + 1) & mask
+        slots[slot] = value
+        self.band_count += 1
+    
+    
+    def grow_bands(self):
+        """Увеличивает таблицу полос вдвое и переносит в неё все полосы."""
+        old_slots = self.band_slots
+        self.allocate_bands(self.band_capacity * 2)
+        for value in old_slots:
+            if value:
+                self.insert_band(value)
+    
+    
+    def save(self, f):
+        """Записывает индекс в открытый двоичный файл (для контрольной точки)."""
+        self.exact.save(f)
+        self.normalized.save(f)
+        f.write(struct.pack('<6Q', self.count, self.band_capacity, self.band_count,
+                            self.tiers['exact'], self.tiers['normalized'], self.tiers['near']))
+        self.signatures.tofile(f)
+        self.band_slots.tofile(f)
+    
+    
+    def load(self, f):
+        """Заменяет индекс тем, что записан save (с теми же настройками)."""
+        self.exact.load(f)
+        self.normalized.load(f)
+        count, capacity, band_count, exact, normalized, near = struct.unpack('<6Q', f.read(48))
+        self.count = count
+        self.tiers = {'exact': exact, 'normalized': normalized, 'near': near}
+        self.signatures = array('H')
+        self.signatures.fromfile(f, count * self.stride)
+        self.allocate_bands(capacity)
+        self.band_slots = array('Q')
+        self.band_slots.fromfile(f, capacity)
+        self.band_count = band_count
+    
+    
+    def release(self):
+        """Освобождает память, занятую индексом."""
+        self.exact.release()
+        self.normalized.release()
+        self.signatures = array('H')
+        self.count = 0
+        self.token_hashes = {}
+        self.allocate_bands(1024)
+    
+    
+    def __len__(self):
+        return len(self.exact)
+    
+    
+    def memory_bytes(self):
+        """Примерный объём памяти, занятый индексом (в байтах, без кэша слов)."""
+        return (self.exact.memory_bytes() + self.normalized.memory_bytes()
+                + self.signatures.buffer_info()[1] * self.signatures.itemsize
+                + self.band_slots.buffer_info()[1] * self.band_slots.itemsize)
+    
+    
+    def memory_bytes_after_add(self, key):
+        """Сколько памяти займёт индекс после добавления key (примерно — как сейчас)."""
+        return self.memory_bytes()
+
+
+# ==================== ПОСТОЯННЫЙ ИНДЕКС TITLE ====================
+# Чтобы каждый день не обрабатывать заново всю историю, title уже
+# опубликованных записей можно хранить в файле между запусками.
+# Записи с такими title отбрасываются, новые title дописываются в файл
+
+class PersistentTitleIndex(HashedTitleIndex):
+    """
+    Хеш-таблица HashedTitleIndex, которая живёт в файле, отображённом
+    в память (mmap). При открытии файл не читается целиком: операционная
+    система подгружает только те страницы, к которым обращается поиск,
+    поэтому время запуска зависит от размера новой выгрузки, а не от истории.
+    
+    Формат файла: заголовок (HEADER), затем младшие 8 байт хешей
+    по ячейкам и (для 128 бит) старшие 8 байт.
+    Одновременно писать в один файл из нескольких программ нельзя.
+    """
+    
+    name = "persistent"
+    
+    MAGIC = b'JCTITLES'
+    # Магия, версия, длина хеша в битах, количество ключей, количество ячеек
+    HEADER = struct.Struct('<8sIIQQ')
+    
+    def __init__(self, path, bits=None):
+        self.path = path
+        self.file = None
+        self.map = None
+        
+        if os.path.exists(path):
+            self.open_file(path)
+            if bits is not None and bits != self.bits:
+                self.close()
+                raise ValueError(f"Постоянный индекс {path} хранит хеши по {self.bits} бит, "
+                                 f"а DEDUP_HASH_BITS = {bits}")
+        else:
+            bits = bits or DEDUP_HASH_BITS
+            if bits not in (64, 128):
+                raise ValueError(f"Длина хеша должна быть 64 или 128 бит, а не {bits}")
+            self.bits = bits
+            self.digest_size = bits // 8
+            self.count = 0
+            self.create_file(path, 1024)
+            self.open_file(path)
+    
+    
+    def create_file(self, path, capacity):
+        """Создаёт пустой файл индекса на capacity ячеек."""
+        tables = 2 if self.bits == 128 else 1
+        with open(path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, 1, self.bits, 0, capacity))
+            f.truncate(self.HEADER.size + 8 * capacity * tables)
+    
+    
+    def open_file(self, path):
+        """Отображает файл в память и настраивает таблицу поверх него."""
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        
+        magic, version, bits, count, capacity = self.HEADER.unpack_from(self.map)
+        if magic != self.MAGIC or version != 1:
+            self.close()
+            raise ValueError(f"{path} — не файл постоянного индекса title")
+        
+        self.bits = bits
+        self.digest_size = bits // 8
+        self.count = count
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.grow_at = int(capacity * self.MAX_LOAD)
+        
+        start = self.HEADER.size
+        view = memoryview(self.map)
+        self.low = view[start:start + 8 * capacity].cast('Q')
+        self.high = None
+        if bits == 128:
+            self.high = view[start + 8 * capacity:start + 16 * capacity].cast('Q')
+        view.release()
+    
+    
+    def grow(self):
+        """
+        Увеличивает таблицу вдвое: новая таблица строится в соседнем файле,
+        который потом заменяет старый (при сбое старый файл остаётся целым).
+        """
+        new_path = self.path + '.grow'
+        old = PersistentTitleIndex.__new__(PersistentTitleIndex)
+        old.__dict__.update(self.__dict__)
+        
+        self.create_file(new_path, self.capacity * 2)
+        self.open_file(new_path)
+        self.count = old.count  # В заголовке нового файла пока ноль
+        for slot, low in enumerate(old.low):
+            if low:
+                self.insert(low, old.high[slot] if old.high is not None else 0)
+        
+        old.close()
+        self.close()
+        os.replace(new_path, self.path)
+        self.open_file(self.path)
+    
+    
+    def merge(self, other):
+        """То же, что HashedTitleIndex.merge, но сразу сбрасывает таблицу на диск."""
+        added = super().merge(other)
+        self.flush()
+        return added
+    
+    
+    def flush(self):
+        """Записывает количество ключей в заголовок и сбрасывает таблицу на диск."""
+        self.HEADER.pack_into(self.map, 0, self.MAGIC, 1, self.bits, self.count, self.capacity)
+        self.map.flush()
+    
+    
+    def close(self):
+        """Закрывает файл индекса."""
+        if self.map is None:
+            return
+        self.flush()
+        if self.low is not None:
+            self.low.release()
+        if self.high is not None:
+            self.high.release()
+        self.low = self.high = None
+        self.map.close()
+        self.file.close()
+        self.map = self.file = None
+    
+    
+    def release(self):
+        """Постоянный индекс не очищается — его ключи нужны следующим запускам."""
+    
+    
+    def memory_bytes(self):
+        """Размер таблицы в файле (в память подгружается только нужная часть)."""
+        return len(self.map) - self.HEADER.size
+
+
+class AttachedTitleIndex:
+    """
+    Индекс одного файла поверх общего: постоянного (PersistentTitleIndex)
+    или общего для всех файлов запуска (GLOBAL_DEDUP).
+    
+    title из общего индекса base считаются уже встреченными, новые
+    складываются в отдельный индекс new в памяти (того же вида, что base)
+    и попадают в base только при commit — когда результат точно записан.
+    Если обработку остановили или она упала, base не меняется, и title
+    файла без результата не убирают записи следующих файлов.
+    """
+    
+    def __init__(self, base, new):
+        self.store = base
+        self.new = new
+        self.name = base.name
+        self.bits = getattr(new, 'bits', None)
+    
+    
+    def key(self, title):
+        """Ключ для title — в том же виде, что в общем индексе."""
+        return self.new.key(title)
+    
+    
+    def add(self, title):
+        """
+        Добавляет title в индекс.
+        Возвращает True, если title встретился впервые, и False для дубликата.
+        """
+        return self.add_key(self.key(title))
+    
+    
+    def add_key(self, key):
+        """То же, что add, но для уже готового ключа."""
+        found = self.store.contains_key(key)
+        if found:
+            if self.tiers is not None:
+                # Дубликаты файла считаются в его индексе и попадут в общий при commit
+                self.tiers[found] += 1
+            return False
+        return self.new.add_key(key)
+    
+    
+    @property
+    def tiers(self):
+        """Ступени поиска похожих title этого файла (None — поиск похожих выключен)."""
+        return getattr(self.new, 'tiers', None)
+    
+    
+    def iter_keys(self):
+        """Перебирает ключи общего индекса и новые."""
+        yield from self.store.iter_keys()
+        yield from self.new.iter_keys()
+    
+    
+    def commit(self):
+        """
+        Переносит новые title в общий индекс.
+        Возвращает, сколько title добавлено.
+        """
+        added = self.store.merge(self.new)
+        self.new.release()
+        return added
+    
+    
+    def save(self, f):
+        """Для контрольной точки достаточно новых title — общий индекс не меняется до commit."""
+        self.new.save(f)
+    
+    
+    def load(self, f):
+        """Восстанавливает новые title из контрольной точки."""
+        self.new.load(f)
+    
+    
+    def release(self):
+        """Освобождает память, занятую новыми title."""
+        self.new.release()
+    
+    
+    def __len__(self):
+        return len(self.store) + len(self.new)
+    
+    
+    def memory_bytes(self):
+        """Память, занятая новыми title (общий индекс считается отдельно)."""
+        return self.new.memory_bytes()
+    
+    
+    def memory_bytes_after_add(self, key):
+        return self.new.memory_bytes_after_add(key)
+
+
+def open_persistent_index(path):
+    """
+    Открывает (или создаёт) постоянный индекс title.
+    Ключи в нём — хеши DEDUP_HASH_BITS бит, поэтому нужен DEDUP_INDEX = "hashed":
+    процессы-помощники считают ключи по тем же настройкам.
+    """
+    if DEDUP_INDEX != "hashed":
+        raise ValueError('Постоянный индекс title работает только с DEDUP_INDEX = "hashed"')
+    if NEAR_DUPLICATES:
+        raise ValueError('Постоянный индекс title не работает с поиском похожих title (NEAR_DUPLICATES)')
+    return PersistentTitleIndex(path, DEDUP_HASH_BITS)
+
+
+# ==================== ПОИСК ДУБЛИКАТОВ ЧЕРЕЗ ДИСК ====================
+# Используется, когда индекс дубликатов не помещается в лимит памяти
+
+class DiskDeduplicator:
+    """
+    Ищет дубликаты с помощью временных файлов, когда индекс не влезает в память.
+    
+    Как это работает:
+    1. Все ключи, уже накопленные в памяти, раскладываются по "корзинам"
+       (временным файлам) по хешу ключа с пометкой "уже записан".
+    2. Каждая следующая запись получает порядковый номер и вместе с ключом
+       и готовой JSON-строкой уходит в корзину своего ключа.
+       Записи без title складываются в отдельный файл — они всегда остаются.
+    3. В конце каждая корзина обрабатывается отдельно (в памяти только
+       ключи одной корзины): побеждает первое появление ключа.
+    4. Победители из всех корзин сливаются по порядковому номеру,
+       то есть в исходном порядке строк, и пишутся в PartWriter.
+    
+    Поэтому результат байт в байт совпадает с обработкой целиком в памяти.
+    """
+    
+    # Заголовок записи во временном файле: номер, длина ключа, длина строки
+    HEADER = struct.Struct('<qII')
+    
+    # Номер для ключей, которые уже были записаны до перехода на диск
+    ALREADY_WRITTEN = -1
+    
+    def __init__(self, index, bucket_count=None, temp_dir=None):
+        """
+        index — индекс дубликатов, накопленный в памяти (после переноса
+                на диск он очищается)
+        bucket_count — количество корзин
+        temp_dir — где создать временную папку
+        """
+        import tempfile  # Временная папка нужна только при переходе на диск
+        
+        self.bucket_count = bucket_count or SPILL_BUCKETS
+        self.temp_dir = tempfile.mkdtemp(prefix='json_cleaner_', dir=temp_dir or SPILL_DIR)
+        self.sequence = 0          # Порядковый номер следующей записи
+        self.spilled_bytes = 0     # Сколько байт записано во временные файлы
+        
+        self.bucket_paths = [
+            os.path.join(self.temp_dir, f"bucket{i}.bin") for i in range(self.bucket_count)
+        ]
+        self.buckets = [open(path, 'wb') for path in self.bucket_paths]
+        self.keep_path = os.path.join(self.temp_dir, "no_title.bin")
+        self.keep_file = open(self.keep_path, 'wb')
+        
+        # Переносим на диск то, что уже было в памяти
+        for key in index.iter_keys():
+            self.write_entry(self.buckets[self.bucket_for(key)], self.ALREADY_WRITTEN, key, b'')
+        index.release()
+    
+    
+    def bucket_for(self, key):
+        """Номер корзины для ключа."""
+        return zlib.crc32(key) % self.bucket_count
+    
+    
+    def write_entry(self, f, sequence, key, line_bytes):
+        """Пишет одну запись во временный файл."""
+        f.write(self.HEADER.pack(sequence, len(key), len(line_bytes)))
+        f.write(key)
+        f.write(line_bytes)
+        self.spilled_bytes += self.HEADER.size + len(key) + len(line_bytes)
+    
+    
+    def read_entries(self, path, with_lines=True):
+        """
+        Читает записи из временного файла: (номер, ключ, строка в байтах).
+        with_lines=False — строки пропускаются (нужны только ключи).
+        """
+        header_size = self.HEADER.size
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(header_size)
+                if not header:
+                    return
+                sequence, key_length, line_length = self.HEADER.unpack(header)
+                key = f.read(key_length)
+                if with_lines:
+                    line_bytes = f.read(line_length)
+                else:
+                    f.seek(line_length, os.SEEK_CUR)
+                    line_bytes = b''
+                yield sequence, key, line_bytes
+    
+    
+    def add(self, key, json_line):
+        """Добавляет запись с title (её судьба решится в finish)."""
+        self.write_entry(self.buckets[self.bucket_for(key)], self.sequence, key,
+                         json_line.encode('utf-8', 'surrogatepass'))
+        self.sequence += 1
+    
+    
+    def keep(self, json_line):
+        """Добавляет запись без title — она точно попадёт в результат."""
+        self.write_entry(self.keep_file, self.sequence, b'',
+                         json_line.encode('utf-8', 'surrogatepass'))
+        self.sequence += 1
+    
+    
+    def finish(self, writer, should_stop=None):
+        """
+        Находит первые появления ключей и пишет итог в writer в исходном порядке.
+        Возвращает (сколько записей записано, сколько дубликатов удалено)
+        или None, если обработку остановили.
+        """
+        should_stop = should_stop or (lambda: False)
+        
+        for f in self.buckets:
+            f.close()
+        self.keep_file.close()
+        
+        duplicates = 0
+        survivor_paths = []
+        
+        for bucket_index, bucket_path in enumerate(self.bucket_paths):
+            if should_stop():
+                return None
+            
+            # Проход 1: для каждого ключа запоминаем номер первого появления.
+            # Записи в корзине лежат по возрастанию номера, поэтому первое
+            # встреченное значение и есть первое появление
+            first_seen = {}
+            for sequence, key, _ in self.read_entries(bucket_path, with_lines=False):
+                if key not in first_seen:
+                    first_seen[key] = sequence
+            winners = {sequence for sequence in first_seen.values() if sequence != self.ALREADY_WRITTEN}
+            del first_seen
+            
+            # Проход 2: переписываем победителей в отдельный файл
+            survivor_path = os.path.join(self.temp_dir, f"survivors{bucket_index}.bin")
+            with open(survivor_path, 'wb') as out:
+                for sequence, _, line_bytes in self.read_entries(bucket_path):
+                    if sequence == self.ALREADY_WRITTEN:
+                        continue
+                    if sequence in winners:
+                        self.write_entry(out, sequence, b'', line_bytes)
+                    else:
+                        duplicates += 1
+            survivor_paths.append(survivor_path)
+            os.remove(bucket_path)
+        
+        # Сливаем все файлы по порядковому номеру — получаем исходный порядок
+        written = 0
+        merged = heapq.merge(*(self.read_entries(path) for path in survivor_paths + [self.keep_path]))
+        for sequence, _, line_bytes in merged:
+            if written % 10000 == 0 and should_stop():
+                return None
+            writer.write_line(line_bytes.decode('utf-8', 'surrogatepass'))
+            written += 1
+        
+        return written, duplicates
+    
+    
+    def cleanup(self):
+        """Удаляет временную папку со всем содержимым."""
+        import shutil
+        
+        for f in self.buckets + [self.keep_file]:
+            f.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+# ==================== ПРАВИЛА ПОЛЕЙ ====================
+# Что делать с полями записи, задают правила: по каким полям искать дубликаты,
+# какие поля переименовать и какие значения заменить. Без файла правил
+# действуют правила по умолчанию (замена stock/under_order/price из NEW_*_VALUE).
+#
+# Правила один раз переводятся в "план" для каждого набора ключей записи —
+# у поставщика почти все записи с одними и теми же ключами в одном порядке.
+# Поэтому для записи остаётся найти готовый план и выполнить только те
+# присваивания, поля которых в записи действительно есть
+
+# По каким полям ищутся дубликаты (берётся первое найденное)
+DEFAULT_TITLE_FIELDS = ('title', 'Наименование')
+
+
+def default_field_rules():
+    """Правила по умолчанию: то, что скрипт делал всегда (значения из NEW_*_VALUE)."""
+    return {
+        'title_fields': list(DEFAULT_TITLE_FIELDS),
+        'aliases': {},
+        'rules': [
+            {'fields': ['stock', 'Склад'], 'set': NEW_STOCK_VALUE},
+            {'fields': ['under_order', 'under-order', 'Под заказ'], 'set': NEW_UNDER_ORDER_VALUE},
+            {'fields': ['price', 'Цена'], 'set': NEW_PRICE_VALUE},
+        ],
+    }
+
+
+class FieldPlan:
+    """
+    Готовый план для записей с одним набором ключей (в одном порядке).
+    
+    title_key — из какого поля записи брать title (None — title нет)
+    renames — переименование полей {старое: новое} (None — не нужно)
+    steps — действия (действие, поле, значение) только для полей, которые есть в записи
+    key_names — поля составного ключа дубликатов (None — ключ — это title;
+                None вместо поля — такого поля в записи нет)
+    """
+    
+    def __init__(self, title_key, renames, steps, key_names=None):
+        self.title_key = title_key
+        self.renames = renames
+        self.steps = steps
+        self.key_names = key_names
+    
+    
+    def title(self, record):
+        """
+        Значение title записи (или None). При составном ключе — список
+        значений его полей (None, если ни одного из них в записи нет).
+        """
+        if self.key_names is not None:
+            values = [record.get(name) for name in self.key_names]
+            return values if any(value is not None for value in values) else None
+        if self.title_key is None:
+            return None
+        return record[self.title_key]
+    
+    
+    def apply(self, record):
+        """Применяет правила к записи и возвращает её (при переименовании — новый словарь)."""
+        if self.renames is not None:
+            renames = self.renames
+            record = {renames.get(name, name): value for name, value in record.items()}
+        
+        for action, field, argument in self.steps:
+            if action == 'set':
+                record[field] = argument
+            elif action == 'drop':
+                del record[field]
+            else:
+                value = record[field]
+                if not isinstance(value, str):
+                    continue  # replace и regex меняют только строки
+                if action == 'replace':
+                    record[field] = argument.get(value, value)
+                else:
+                    pattern, replacement = argument
+                    record[field] = pattern.sub(replacement, value)
+        return record
+
+
+class FieldRules:
+    """
+    Правила полей, переведённые в планы (FieldPlan) по наборам ключей записи.
+    
+    spec — правила в виде словаря, как в файле FIELD_RULES:
+    {
+        "title_fields": ["title", "Наименование", "name"],
+        "dedup_key": ["title", "sku"],
+        "aliases": {"Остаток": "stock", "Price": "price"},
+        "rules": [
+            {"fields": ["stock", "Склад"], "set": "188"},
+            {"fields": ["price"], "replace": {"0": "по запросу"}},
+            {"fields": ["description"], "regex": "\\s+", "to": " "},
+            {"fields": ["internal_id"], "drop": true}
+        ]
+    }
+    title_fields — поля для поиска дубликатов (первое найденное, по именам после aliases)
+    dedup_key — составной ключ дубликатов: поля по именам после aliases,
+                "title" — поле из title_fields (по умолчанию — только title;
+                настройка DEDUP_KEY, если задана, заменяет этот раздел)
+    aliases — переименование полей поставщика (до всех правил)
+    rules — по порядку: set — новое значение (только если поле есть),
+            replace — замена отдельных строковых значений,
+            regex — замена по регулярному выражению в строках ("to" — на что, как в re.sub),
+            drop — удалить поле
+    
+    Использование:
+        plan = rules.plan(record)
+        title = plan.title(record)
+        record = plan.apply(record)
+    
+    Ошибку в правилах сообщает через ValueError.
+    """
+    
+    ACTIONS = ('set', 'replace', 'regex', 'drop')
+    PLAN_LIMIT = 4096   # Сколько наборов ключей помнить (дальше планы строятся заново)
+    
+    
+    def __init__(self, spec, dedup_key=None):
+        if not isinstance(spec, dict):
+            raise ValueError("правила должны быть JSON объектом")
+        unknown = set(spec) - {'title_fields', 'dedup_key', 'aliases', 'rules'}
+        if unknown:
+            raise ValueError(f"неизвестные разделы правил: {', '.join(sorted(unknown))}")
+        if dedup_key:
+            spec = dict(spec, dedup_key=list(dedup_key))
+        
+        self.spec = spec
+        self.title_fields = tuple(spec.get('title_fields', DEFAULT_TITLE_FIELDS))
+        self.dedup_key = spec.get('dedup_key') or None
+        if isinstance(self.dedup_key, str):
+            self.dedup_key = [self.dedup_key]
+        if self.dedup_key is not None:
+            if not isinstance(self.dedup_key, (list, tuple)) or \
+                    not all(isinstance(field, str) and field for field in self.dedup_key):
+                raise ValueError("dedup_key — это список имён полей")
+            self.dedup_key = tuple(self.dedup_key)
+        self.aliases = dict(spec.get('aliases', {}))
+        self.rules = []   # (действие, поля, значение)
+        
+        for number, rule in enumerate(spec.get('rules', []), 1):
+            actions = [action for action in self.ACTIONS if action in rule] if isinstance(rule, dict) else []
+            if len(actions) != 1 or not rule.get('fields'):
+                raise ValueError(f"правило {number}: нужны \"fields\" и одно действие "
+                                 f"из {', '.join(self.ACTIONS)}")
+            action = actions[0]
+            fields = rule['fields']
+            if isinstance(fields, str):
+                fields = [fields]
+            argument = rule[action]
+            
+            if action == 'replace' and not isinstance(argument, dict):
+                raise ValueError(f"правило {number}: для replace нужен объект {{старое: новое}}")
+            if action == 'regex':
+                try:
+                    argument = (re.compile(argument), rule.get('to', ''))
+                except (re.error, TypeError) as e:
+                    raise ValueError(f"правило {number}: неверное регулярное выражение: {e}") from None
+            self.rules.append((action, tuple(fields), argument))
+        
+        self.plans = {}   # Набор ключей (кортеж) → FieldPlan
+        self.passthrough = FieldPlan(None, None, [])
+    
+    
+    def plan(self, record):
+        """
+        План для записи (словаря) — по набору и порядку её ключей.
+        Для строки, которая не является объектом (массив, число), — пустой план:
+        у неё нет title, и она записывается как есть.
+        """
+        if not isinstance(record, dict):
+            return self.passthrough
+        keys = tuple(record)
+        plan = self.plans.get(keys)
+        if plan is None:
+            plan = self.compile(keys)
+            if len(self.plans) >= self.PLAN_LIMIT:
+                self.plans.clear()
+            self.plans[keys] = plan
+        return plan
+    
+    
+    def compile(self, keys):
+        """Строит план для набора ключей keys."""
+        aliases = self.aliases
+        renames = {name: aliases[name] for name in keys if name in aliases}
+        
+        # Имя после переименования → исходное поле (title берётся до переименования)
+        originals = {}
+        for name in keys:
+            originals[aliases.get(name, name)] = name
+        title_key = next((originals[field] for field in self.title_fields if field in originals), None)
+        key_names = None
+        if self.dedup_key is not None:
+            key_names = tuple(title_key if field == 'title' else originals.get(field)
+                              for field in self.dedup_key)
+        
+        # Оставляем только действия над полями, которые будут в записи
+        present = set(originals)
+        steps = []
+        for action, fields, argument in self.rules:
+            for field in fields:
+                if field in present:
+                    steps.append((action, field, argument))
+                    if action == 'drop':
+                        present.discard(field)
+        
+        return FieldPlan(title_key, renames or None, steps, key_names)
+    
+    
+    def describe(self):
+        """Короткое описание для лога."""
+        key = f"ключ дубликатов: {', '.join(self.dedup_key)}; " if self.dedup_key else ""
+        return (f"поля title: {', '.join(self.title_fields)}; {key}"
+                f"переименований: {len(self.aliases)}, правил: {len(self.rules)}")
+
+
+def load_field_rules(path, dedup_key=None):
+    """Читает правила полей из JSON файла (ошибки — OSError или ValueError)."""
+    with open(path, encoding='utf-8') as f:
+        return FieldRules(json.load(f), dedup_key)
+
+
+# Готовые правила (переводятся заново, если поменялись настройки)
+FIELD_RULES_CACHE = {}
+
+
+def field_rules():
+    """Текущие правила полей: из файла FIELD_RULES или по умолчанию."""
+    dedup_key = tuple(DEDUP_KEY) if DEDUP_KEY else None
+    settings = (FIELD_RULES, NEW_STOCK_VALUE, NEW_UNDER_ORDER_VALUE, NEW_PRICE_VALUE, dedup_key)
+    rules = FIELD_RULES_CACHE.get(settings)
+    if rules is None:
+        if FIELD_RULES:
+            rules = load_field_rules(FIELD_RULES, dedup_key)
+        else:
+            rules = FieldRules(default_field_rules(), dedup_key)
+        FIELD_RULES_CACHE.clear()
+        FIELD_RULES_CACHE[settings] = rules
+    return rules
+
+
+# ==================== ОБРАБОТКА ОДНОЙ ЗАПИСИ ====================
+
+def extract_title(record):
+    """
+    Возвращает значение title (поля — по правилам, по умолчанию
+    title или Наименование) или None, если его нет.
+    """
+    return field_rules().plan(record).title(record)
+
+
+def replace_field_values(record):
+    """
+    Применяет к записи правила полей (по умолчанию — заменяет
+    значения stock, under_order, price и их русских вариантов).
+    
+    record — это словарь (одна запись из JSON)
+    """
+    return field_rules().plan(record).apply(record)
+
+
+def clean_line(line):
+    """
+    Обработка непустой строки: json.loads → правила полей → json.dumps.
+    Возвращает (title, JSON-строка). Ошибку парсинга JSON
+    пробрасывает (json.JSONDecodeError).
+    """
+    record = json.loads(line)
+    plan = field_rules().plan(record)
+    title = plan.title(record)
+    record = plan.apply(record)
+    return title, json.dumps(record, ensure_ascii=False)
+
+
+def new_stats():
+    """Пустые счётчики статистики одного файла."""
+    return {
+        'lines': 0,             # Всего строк
+        'empty_lines': 0,       # Пустых строк
+        'parse_errors': 0,      # Строк с ошибкой JSON
+        'duplicates': 0,        # Удалено дубликатов
+        'unique': 0,            # Записано уникальных записей
+    }
+
+
+def add_stats(stats, counters):
+    """Прибавляет счётчики counters к stats."""
+    for name, value in counters.items():
+        stats[name] += value
+
+
+# ==================== СЖАТЫЕ ФАЙЛЫ И КОНВЕЙЕР ЧТЕНИЯ/ЗАПИСИ ====================
+# Выгрузки поставщиков часто приходят в .json.gz — распаковывать их
+# заранее не нужно: файл читается как поток. Распаковка и сжатие
+# идут в потоке-помощнике (zlib, bz2 и lzma отпускают GIL на время работы),
+# поэтому они идут одновременно с разбором строк, а не по очереди с ним.
+# При PIPELINE так же (потоки чтения и записи) обрабатываются и обычные файлы:
+# чтение → разбор → запись связаны ограниченными очередями (StageQueue)
+
+# Сжатие → (первые байты файла, расширение результата)
+COMPRESSIONS = {
+    'gz': (b'\x1f\x8b', '.gz'),
+    'bz2': (b'BZh', '.bz2'),
+    'xz': (b'\xfd7zXZ\x00', '.xz'),
+}
+
+
+def detect_compression(file_path):
+    """Сжат ли файл: 'gz', 'bz2', 'xz' (по первым байтам) или None."""
+    with open(file_path, 'rb') as f:
+        head = f.read(6)
+    for compression, (magic, _) in COMPRESSIONS.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def output_base_name(file_path):
+    """Имя исходного файла без расширения (и без .gz/.bz2/.xz): "feed.json.gz" → "feed"."""
+    name = os.path.basename(file_path)
+    for _, extension in COMPRESSIONS.values():
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+            break
+    return os.path.splitext(name)[0]
+
+
+def open_compressed(file, mode, compression, level=None):
+    """
+    Открывает сжатый файл (путь или уже открытый файл) в двоичном режиме.
+    level — степень сжатия (None — COMPRESSION_LEVEL или обычная для формата).
+    """
+    if level is None:
+        level = COMPRESSION_LEVEL
+    if compression == 'gz':
+        import gzip
+        return gzip.open(file, mode, compresslevel=6 if level is None else level)
+    if compression == 'bz2':
+        import bz2
+        return bz2.open(file, mode, compresslevel=9 if level is None else level)
+    if compression == 'xz':
+        import lzma
+        if 'r' in mode:
+            return lzma.open(file, mode)
+        return lzma.open(file, mode, preset=level)
+    raise ValueError(f"Неизвестное сжатие: {compression}")
+
+
+class StageQueue:
+    """
+    Ограниченная очередь между двумя этапами конвейера (чтение → разбор → запись).
+    Когда очередь полна, этап-производитель ждёт ("подпор"), поэтому в памяти
+    никогда не лежит больше capacity блоков, как бы ни отставал следующий этап.
+    
+    name, queues — под каким именем складывать счётчики в словарь queues
+    (RunReport.queues; у одинаковых очередей файла, например у частей, они общие):
+        items — сколько блоков прошло через очередь
+        max_depth, depth_total — наибольшая и суммарная глубина очереди
+        producer_wait — сколько секунд производитель ждал места (очередь полна)
+        consumer_wait — сколько секунд потребитель ждал данных (очередь пуста)
+    """
+    
+    def __init__(self, capacity, name=None, queues=None):
+        self.queue = queue.Queue(maxsize=capacity)
+        if queues is None:
+            self.counters = new_queue_counters(capacity)
+        else:
+            self.counters = queues.setdefault(name, new_queue_counters(capacity))
+    
+    
+    def put(self, item, timeout=None):
+        """Кладёт блок; если места нет — ждёт (queue.Full, если не дождался за timeout)."""
+        counters = self.counters
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            started = time.perf_counter()
+            try:
+                self.queue.put(item, timeout=timeout)
+            finally:
+                counters['producer_wait'] += time.perf_counter() - started
+        depth = self.queue.qsize()
+        if depth > counters['max_depth']:
+            counters['max_depth'] = depth
+    
+    
+    def get(self):
+        """Забирает блок; если очередь пуста — ждёт."""
+        counters = self.counters
+        try:
+            item = self.queue.get_nowait()
+        except queue.Empty:
+            started = time.perf_counter()
+            item = self.queue.get()
+            counters['consumer_wait'] += time.perf_counter() - started
+        if item is not None:
+            counters['items'] += 1
+            counters['depth_total'] += self.queue.qsize() + 1
+        return item
+    
+    
+    def task_done(self):
+        """Потребитель закончил с очередным блоком (см. join)."""
+        self.queue.task_done()
+    
+    
+    def join(self):
+        """Ждёт, пока потребитель закончит со всеми отданными блоками."""
+        self.queue.join()
+
+
+def new_queue_counters(capacity):
+    """Пустые счётчики очереди (см. StageQueue)."""
+    return {
+        'capacity': capacity,
+        'items': 0,
+        'max_depth': 0,
+        'depth_total': 0,
+        'producer_wait': 0.0,
+        'consumer_wait': 0.0,
+    }
+
+
+class BlockReader:
+    """
+    Этап "чтение" конвейера: поток-помощник читает файл (и распаковывает,
+    если он сжат) блоками по IO_BUFFER_KB, обрезает их по последнему
+    переводу строки и передаёт через ограниченную очередь (StageQueue).
+    Строки готовых блоков разбираются, пока читается следующий.
+    
+    При переборе (for line in reader) строки выдаются с переводом строки,
+    как из обычного файла; line_batches выдаёт их списками без перевода строки.
+    position — сколько байт файла (сжатого) уже прочитано (для шкалы прогресса).
+    start — с какого байта читать (только несжатый файл)
+    queues — куда складывать счётчики очереди 'read' (см. StageQueue)
+    line_end — перевод строки: b'\n' или b'\r' (старый Mac, см. detect_line_end)
+    """
+    
+    def __init__(self, file_path, compression=None, buffer_size=None, start=0, queues=None,
+                 line_end=b'\n'):
+        self.buffer_size = buffer_size or IO_BUFFER_KB * 1024
+        self.line_end = line_end
+        self.raw = open(file_path, 'rb')
+        if compression:
+            self.stream = open_compressed(self.raw, 'rb', compression)
+        else:
+            self.raw.seek(start)
+            self.stream = self.raw
+        self.position = self.raw.tell()
+        self.blocks = StageQueue(PIPELINE_QUEUE_BLOCKS, 'read', queues)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    
+    def run(self):
+        """Чтение и распаковка (работает в своём потоке)."""
+        tail = b''
+        try:
+            while not self.stop_event.is_set():
+                block = self.stream.read(self.buffer_size)
+                self.position = self.raw.tell()
+                if not block:
+                    break
+                # Неполная последняя строка блока переходит в следующий блок
+                if tail:
+                    block = tail + block
+                cut = block.rfind(self.line_end) + 1
+                if cut == len(block):
+                    tail = b''
+                    self.put(block)
+                else:
+                    tail = block[cut:]
+                    if cut:
+                        self.put(block[:cut])
+            if tail:
+                self.put(tail)
+        except BaseException as e:
+            # Ошибку (например, повреждённый архив) передаём читающему потоку
+            self.put(e)
+        self.put(None)
+    
+    
+    def put(self, item):
+        """Кладёт блок в очередь, пока читатель не закрыл файл."""
+        while not self.stop_event.is_set():
+            try:
+                self.blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+    
+    
+    def complete_blocks(self):
+        """Выдаёт блоки из целых строк по мере их готовности."""
+        while True:
+            block = self.blocks.get()
+            if block is None:
+                return
+            if isinstance(block, BaseException):
+                raise block
+            yield block
+    
+    
+    def line_batches(self):
+        """Выдаёт строки списками — по одному списку на прочитанный блок."""
+        for block in self.complete_blocks():
+            lines = block.split(self.line_end)
+            if not lines[-1]:
+                lines.pop()  # Блок кончается переводом строки
+            yield lines
+    
+    
+    def __iter__(self):
+        if self.line_end == b'\n':
+            for block in self.complete_blocks():
+                yield from io.BytesIO(block)
+            return
+        # Файл с переводами строк \r: BytesIO их не понимает, режем сами
+        for block in self.complete_blocks():
+            lines = block.split(self.line_end)
+            last = lines.pop()  # Пусто, если блок кончается переводом строки
+            for line in lines:
+                yield line + self.line_end
+            if last:
+                yield last
+    
+    
+    def close(self):
+        """Останавливает чтение и закрывает файл."""
+        self.stop_event.set()
+        self.thread.join()
+        self.stream.close()
+        self.raw.close()
+    
+    
+    def __enter__(self):
+        return self
+    
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BlockWriter:
+    """
+    Этап "запись" конвейера: выходной текстовый файл, в который строки
+    пишутся большими блоками.
+    
+    write_line копит строки, пока не наберётся IO_BUFFER_KB, затем они
+    склеиваются в один блок, кодируются в UTF-8 (и сжимаются, если задано
+    compression) и пишутся одним вызовом. При PIPELINE (а со сжатием всегда)
+    это делает поток-помощник: блоки уходят к нему через ограниченную
+    очередь (StageQueue), и запись на диск идёт одновременно с разбором
+    следующих строк (zlib, bz2, lzma и запись в файл отпускают GIL).
+    Ошибка записи (например, нет места на диске) пробрасывается
+    при следующей записи или при close.
+    queues — куда складывать счётчики очереди 'write' (см. StageQueue)
+    """
+    
+    def __init__(self, path, compression=None, level=None, append=False, buffer_size=None,
+                 queues=None):
+        self.buffer_size = buffer_size or IO_BUFFER_KB * 1024
+        mode = 'ab' if append else 'wb'
+        if compression:
+            self.stream = open_compressed(path, mode, compression, level)
+        else:
+            self.stream = open(path, mode)
+        self.buffer = []
+        self.buffered = 0
+        self.error = None
+        
+        # Для манифеста частей: сколько строк и байт (до сжатия) уже записано
+        # и где (номер строки, байт) начинается каждый записанный блок
+        self.lines_written = 0
+        self.bytes_written = 0
+        self.offsets = []
+        
+        self.blocks = None
+        self.thread = None
+        if PIPELINE or compression:
+            self.blocks = StageQueue(PIPELINE_QUEUE_BLOCKS, 'write', queues)
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+    
+    
+    def run(self):
+        """Кодирование, сжатие и запись (работает в своём потоке)."""
+        while True:
+            lines = self.blocks.get()
+            try:
+                if lines is None:
+                    return
+                if self.error is None:  # После ошибки только разбираем очередь
+                    try:
+                        self.write_block(lines)
+                    except BaseException as e:
+                        self.error = e
+            finally:
+                self.blocks.task_done()
+    
+    
+    def encode(self, lines):
+        """Склеивает строки в блок байт (с переводами строки, как у текстового файла)."""
+        data = '\n'.join(lines) + '\n'
+        if os.linesep != '\n':
+            data = data.replace('\n', os.linesep)
+        return data.encode('utf-8')
+    
+    
+    def write_block(self, lines):
+        """Пишет строки одним блоком и запоминает, где блок начался."""
+        data = self.encode(lines)
+        self.offsets.append((self.lines_written, self.bytes_written))
+        self.stream.write(data)
+        self.lines_written += len(lines)
+        self.bytes_written += len(data)
+    
+    
+    def write_line(self, line):
+        """Добавляет строку (без перевода строки) в файл."""
+        self.buffer.append(line)
+        self.buffered += len(line)
+        if self.buffered >= self.buffer_size:
+            self.send_buffer()
+    
+    
+    def send_buffer(self):
+        """Отдаёт накопленные строки на запись."""
+        if self.error is not None:
+            raise self.error
+        if not self.buffer:
+            return
+        lines = self.buffer
+        self.buffer = []
+        self.buffered = 0
+        if self.thread is not None:
+            self.blocks.put(lines)
+        else:
+            self.write_block(lines)
+    
+    
+    def flush(self):
+        """Дописывает всё накопленное в файл (для контрольных точек)."""
+        self.send_buffer()
+        if self.thread is not None:
+            self.blocks.join()
+            if self.error is not None:
+                raise self.error
+        self.stream.flush()
+    
+    
+    def fileno(self):
+        return self.stream.fileno()
+    
+    
+    def close(self):
+        """Дописывает всё накопленное и закрывает файл."""
+        if self.stream is None:
+            return
+        try:
+            self.send_buffer()
+        finally:
+            if self.thread is not None:
+                self.blocks.put(None)
+                self.thread.join()
+                self.thread = None
+            self.stream.close()
+            self.stream = None
+        if self.error is not None:
+            raise self.error
+    
+    
+    def __enter__(self):
+        return self
+    
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_output(path, compression=None, append=False, queues=None):
+    """
+    Открывает выходной файл на запись строк (см. BlockWriter).
+    append — дописывать в конец (несжатый файл, продолжение с контрольной точки)
+    queues — куда складывать счётчики очереди записи (см. StageQueue)
+    """
+    return BlockWriter(path, compression, append=append, queues=queues)
+
+
+def detect_line_end(file_path, compression=None):
+    """
+    Перевод строки во входном файле: b'\n' (Unix и Windows — \r\n)
+    или b'\r' (старый формат Mac, где строки разделены одним \r).
+    
+    Раньше файл читался в текстовом режиме, и Python сам делил строки
+    по \n, \r\n и \r. Теперь строки режутся в байтах, поэтому формат
+    определяется по началу файла: если в первых 64 КБ есть \r, но нет
+    ни одного \n, строки делятся по \r. В файле с \n одиночный \r
+    остаётся внутри строки (для JSON это обычный пробел).
+    """
+    with open(file_path, 'rb') as raw:
+        stream = open_compressed(raw, 'rb', compression) if compression else raw
+        head = stream.read(64 * 1024)
+    if b'\n' not in head and b'\r' in head:
+        return b'\r'
+    return b'\n'
+
+
+def read_line(f, line_end=b'\n'):
+    """
+    Читает из двоичного файла f одну строку вместе с переводом строки line_end
+    (f.readline понимает только b'\n'). В конце файла возвращает b''.
+    """
+    if line_end == b'\n':
+        return f.readline()
+    parts = []
+    while True:
+        chunk = f.peek(8192)
+        if not chunk:
+            break
+        cut = chunk.find(line_end)
+        if cut >= 0:
+            parts.append(f.read(cut + 1))
+            break
+        parts.append(f.read(len(chunk)))
+    return b''.join(parts)
+
+
+def iter_lines(f, line_end=b'\n'):
+    """Перебирает строки двоичного файла f (с переводом строки line_end на конце)."""
+    if line_end == b'\n':
+        yield from f
+        return
+    while True:
+        line = read_line(f, line_end)
+        if not line:
+            return
+        yield line
+
+
+def open_lines(file_path, compression=None, start=0, queues=None):
+    """
+    Открывает входной файл для чтения строк (bytes) с байта start:
+    сжатый, при PIPELINE или с переводами строк \r (см. detect_line_end) —
+    через BlockReader, обычный — как двоичный файл.
+    queues — куда складывать счётчики очереди чтения (см. StageQueue)
+    """
+    line_end = detect_line_end(file_path, compression)
+    if compression or PIPELINE or line_end != b'\n':
+        return BlockReader(file_path, compression, start=start, queues=queues, line_end=line_end)
+    f = open(file_path, 'rb', buffering=IO_BUFFER_KB * 1024)
+    if start:
+        f.seek(start)
+    return f
+
+
+# ==================== JSON МАССИВ ВМЕСТО NDJSON ====================
+# Обычно поставщики присылают NDJSON — по одной записи на строку.
+# Но бывает и один большой документ [ {...}, {...}, ... ]. Такой файл
+# не загружается целиком (json.load): элементы массива разбираются
+# по одному из небольшого буфера, поэтому памяти нужно столько же,
+# сколько на одну запись, как бы ни был велик файл
+
+# Пробелы между элементами JSON
+JSON_WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+
+
+def detect_input_format(file_path, compression=None):
+    """
+    Формат входного файла: 'array' (весь файл — JSON массив) или 'ndjson'.
+    При INPUT_FORMAT, отличном от "auto", возвращает его.
+    """
+    if INPUT_FORMAT != "auto":
+        return INPUT_FORMAT
+    with open(file_path, 'rb') as raw:
+        stream = open_compressed(raw, 'rb', compression) if compression else raw
+        head = stream.read(64 * 1024)
+    text = head.decode('utf-8-sig', errors='ignore').lstrip()
+    return 'array' if text.startswith('[') else 'ndjson'
+
+
+class JSONArrayReader:
+    """
+    Выдаёт элементы JSON массива из файла по одному (for item in reader).
+    
+    Файл (сжатый — с распаковкой) читается блоками по IO_BUFFER_KB,
+    и очередной элемент разбирается json.JSONDecoder.raw_decode прямо
+    из буфера. Если элемент оборвался на границе блока, дочитывается
+    следующий блок. Разобранная часть буфера сразу отбрасывается.
+    
+    Если массив повреждён, после него уже не найти, где начинается
+    следующий элемент: чтение заканчивается, а в error остаётся описание.
+    position — сколько байт файла (сжатого) уже прочитано (для шкалы прогресса).
+    """
+    
+    def __init__(self, file_path, compression=None, buffer_size=None):
+        self.buffer_size = buffer_size or IO_BUFFER_KB * 1024
+        self.raw = open(file_path, 'rb')
+        self.stream = open_compressed(self.raw, 'rb', compression) if compression else self.raw
+        self.decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0          # Докуда буфер уже разобран
+        self.eof = False
+        self.position = 0
+        self.error = None
+    
+    
+    def read_more(self):
+        """Дочитывает блок файла в буфер (разобранное начало буфера отбрасывается)."""
+        block = self.stream.read(self.buffer_size)
+        self.position = self.raw.tell()
+        if block:
+            text = self.decoder.decode(block)
+        else:
+            self.eof = True
+            text = self.decoder.decode(b'', final=True)
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+    
+    
+    def next_char(self):
+        """Пропускает пробелы и возвращает следующий символ ('' — конец файла)."""
+        while True:
+            self.pos = JSON_WHITESPACE_RE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return ''
+            self.read_more()
+    
+    
+    def decode_item(self):
+        """Разбирает следующий элемент. Возвращает (True, элемент) или (False, None)."""
+        self.next_char()  # raw_decode не пропускает пробелы перед элементом
+        while True:
+            try:
+                item, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                # Ошибка у самого конца буфера — элемент, скорее всего,
+                # просто не дочитан; иначе массив повреждён
+                incomplete = e.pos >= len(self.buffer) - 6 or e.msg.startswith('Unterminated string')
+                if self.eof or not incomplete:
+                    self.fail(f"{e.msg}")
+                    return False, None
+                self.read_more()
+                continue
+            if end == len(self.buffer) and not self.eof:
+                self.read_more()  # Число на границе блока могло оборваться
+                continue
+            self.pos = end
+            return True, item
+    
+    
+    def fail(self, message):
+        """Запоминает, где и почему массив оказался повреждён."""
+        position = f"{self.position:,}".replace(',', ' ')
+        self.error = f"{message} (около байта {position})"
+    
+    
+    def __iter__(self):
+        if self.next_char() != '[':
+            self.fail("файл не начинается с [")
+            return
+        self.pos += 1
+        
+        if self.next_char() == ']':
+            self.pos += 1
+        else:
+            while True:
+                ok, item = self.decode_item()
+                if not ok:
+                    return
+                yield item
+                
+                char = self.next_char()
+                self.pos += 1
+                if char == ']':
+                    break
+                if char != ',':
+                    self.fail("ожидалась , или ] после элемента")
+                    return
+        
+        if self.next_char() != '':
+            self.fail("после закрывающей ] есть ещё данные")
+    
+    
+    def close(self):
+        """Закрывает файл."""
+        self.stream.close()
+        self.raw.close()
+    
+    
+    def __enter__(self):
+        return self
+    
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def clean_record(record, rules=None):
+    """
+    Обрабатывает уже разобранную запись (элемент JSON массива):
+    возвращает (title, JSON-строка) — то же, что clean_line.
+    Элемент, который не является объектом, — ошибка (ValueError).
+    """
+    if not isinstance(record, dict):
+        raise ValueError("элемент массива — не объект")
+    plan = (rules or field_rules()).plan(record)
+    title = plan.title(record)
+    record = plan.apply(record)
+    return title, json.dumps(record, ensure_ascii=False)
+
+
+def process_array_items(reader, batch_size=10000):
+    """
+    Обрабатывает элементы JSON массива из reader (JSONArrayReader) пачками
+    (в процессе-помощнике, см. spool_file). Выдаёт
+    (счётчики статистики, [(номер элемента, ключ title или None, JSON-строка), ...]).
+    Повреждённый остаток массива считается одной ошибкой парсинга.
+    """
+    key_of = create_title_index().key
+    rules = field_rules()
+    stats, records = new_stats(), []
+    
+    for number, item in enumerate(reader):
+        stats['lines'] += 1
+        try:
+            title, json_line = clean_record(item, rules)
+        except ValueError:
+            stats['parse_errors'] += 1
+        else:
+            key = key_of(title) if title is not None else None
+            records.append((number, key, json_line))
+        
+        if len(records) >= batch_size:
+            yield stats, records
+            stats, records = new_stats(), []
+    
+    if reader.error is not None:
+        stats['parse_errors'] += 1
+    yield stats, records
+
+
+# ==================== ПОТОКОВАЯ ЗАПИСЬ РЕЗУЛЬТАТА ====================
+# Записи пишутся на диск сразу, а не копятся в памяти до конца файла
+
+class PartWriter:
+    """
+    Пишет очищенные записи в выходной файл по мере их появления.
+    
+    Пока записей не больше max_lines (и размер не больше max_bytes),
+    результат лежит в "<имя>_cleaned.json".
+    Как только текущая часть заполнилась, файл переименовывается
+    в "<имя>_cleaned_part1.json" и запись продолжается в "_part2", "_part3"...
+    Так имена файлов получаются такими же, как при старой записи целиком,
+    но в памяти не нужно держать ни одной записи.
+    
+    При OUTPUT_COMPRESSION к именам добавляется .gz/.bz2/.xz,
+    а части сжимаются в потоке-помощнике. Строки пишутся на диск
+    блоками (см. BlockWriter).
+    
+    При PART_MANIFEST после закрытия рядом сохраняется манифест частей
+    (см. write_manifest).
+    """
+    
+    def __init__(self, file_dir, base_name, max_lines=None, log=None, resume=None, queues=None,
+                 max_bytes=None):
+        """
+        file_dir — папка для результата
+        base_name — имя исходного файла без расширения
+        max_lines — сколько строк можно записать в одну часть
+        max_bytes — сколько байт можно записать в одну часть (по умолчанию
+                    MAX_PART_MB; запись длиннее лимита всё равно пишется — одна в части)
+        log — функция для сообщений в лог (можно не передавать)
+        resume — состояние из контрольной точки (см. state), с которого
+                 нужно продолжить запись
+        queues — куда складывать счётчики очереди записи (RunReport.queues)
+        """
+        self.file_dir = file_dir
+        self.base_name = base_name
+        self.max_lines = max_lines or MAX_LINES_PER_FILE
+        if max_bytes is None and MAX_PART_MB:
+            max_bytes = int(MAX_PART_MB * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self.newline_bytes = len(os.linesep)
+        self.log = log or (lambda message: None)
+        self.compression = OUTPUT_COMPRESSION
+        self.extension = '.json' + (COMPRESSIONS[self.compression][1] if self.compression else '')
+        self.queues = queues
+        
+        self.part_number = 1          # Номер текущей части
+        self.lines_in_part = 0        # Сколько строк уже в текущей части
+        self.bytes_in_part = 0        # Сколько байт уже в текущей части (при max_bytes)
+        self.total_lines = 0          # Сколько строк записано всего
+        self.parts = []               # Готовые части: (путь, количество строк)
+        self.manifest = []            # Описания готовых частей для манифеста
+        
+        if resume is not None:
+            self.resume(resume)
+            return
+        
+        # Первую часть открываем сразу, чтобы даже при пустом
+        # результате появился файл (как и раньше)
+        self.current_path = self.single_file_path()
+        self.file = self.open_part(self.current_path)
+    
+    
+    def open_part(self, path, append=False):
+        """Открывает файл части на запись."""
+        return open_output(path, self.compression, append, self.queues)
+    
+    
+    def single_file_path(self):
+        """Путь к результату, если он поместился в один файл."""
+        return os.path.join(self.file_dir, f"{self.base_name}_cleaned{self.extension}")
+    
+    
+    def part_path(self, part_number):
+        """Путь к части с номером part_number."""
+        return os.path.join(
+            self.file_dir,
+            f"{self.base_name}_cleaned_part{part_number}{self.extension}"
+        )
+    
+    
+    def write_record(self, record):
+        """
+        Записывает одну запись (словарь) в текущую часть.
+        ensure_ascii=False — чтобы русские буквы сохранялись как есть.
+        """
+        self.write_line(json.dumps(record, ensure_ascii=False))
+    
+    
+    def write_line(self, json_line):
+        """
+        Записывает уже готовую JSON-строку (без перевода строки).
+        Если текущая часть заполнена — сначала переключаемся на следующую.
+        """
+        if self.max_bytes is None:
+            if self.lines_in_part >= self.max_lines:
+                self.next_part()
+        else:
+            # Размер строки в байтах UTF-8 (у строк только из ASCII он равен длине)
+            if json_line.isascii():
+                size = len(json_line) + self.newline_bytes
+            else:
+                size = len(json_line.encode('utf-8', 'surrogatepass')) + self.newline_bytes
+            if self.lines_in_part and (self.lines_in_part >= self.max_lines
+                                       or self.bytes_in_part + size > self.max_bytes):
+                self.next_part()
+            self.bytes_in_part += size
+        
+        self.file.write_line(json_line)
+        self.lines_in_part += 1
+        self.total_lines += 1
+    
+    
+    def next_part(self):
+        """
+        Закрывает текущую часть и открывает следующую.
+        """
+        self.file.close()
+        
+        if self.part_number == 1:
+            # Первая часть писалась под именем "_cleaned.json" —
+            # теперь ясно, что частей будет несколько, переименовываем
+            limit = f"{self.max_lines:,} строк".replace(',', ' ')
+            if self.max_bytes is not None:
+                limit += f" или {self.max_bytes / 1024 / 1024:g} МБ"
+            self.log(f"   📦 Разбиваем на части по {limit}...")
+            first_part_path = self.part_path(1)
+            os.replace(self.current_path, first_part_path)
+            self.current_path = first_part_path
+        
+        self.finish_part()
+        
+        self.part_number += 1
+        self.lines_in_part = 0
+        self.bytes_in_part = 0
+        self.current_path = self.part_path(self.part_number)
+        self.file = self.open_part(self.current_path)
+    
+    
+    def finish_part(self):
+        """Запоминает закрытую часть (файл уже закрыт) и пишет о ней в лог."""
+        self.parts.append((self.current_path, self.lines_in_part))
+        self.manifest.append({
+            'path': os.path.basename(self.current_path),
+            'first_record': self.total_lines - self.lines_in_part,
+            'records': self.lines_in_part,
+            'bytes': os.path.getsize(self.current_path),
+            # Смещения внутри сжатого файла бесполезны — по нему не перейти к записи
+            'offsets': None if self.compression else self.file.offsets,
+        })
+        
+        if self.part_number > 1 or self.current_path != self.single_file_path():
+            self.log(f"   ✓ Часть {self.part_number}: {self.lines_in_part:,} записей → "
+                     f"{os.path.basename(self.current_path)}".replace(',', ' '))
+    
+    
+    def close(self):
+        """
+        Закрывает последнюю часть. Возвращает список частей (путь, строк).
+        """
+        if self.file is None:
+            return self.parts
+        
+        self.file.close()
+        self.finish_part()
+        self.file = None
+        
+        if self.part_number == 1:
+            self.log(f"   ✓ Сохранено в: {os.path.basename(self.current_path)}")
+        if PART_MANIFEST:
+            self.write_manifest()
+        
+        return self.parts
+    
+    
+    def manifest_path(self):
+        """Путь к манифесту частей."""
+        return os.path.join(self.file_dir, f"{self.base_name}_cleaned_manifest.json")
+    
+    
+    def write_manifest(self):
+        """
+        Сохраняет манифест частей: для каждой части — имя файла, номер первой
+        записи (с нуля, по всему результату), число записей, размер в байтах
+        и смещения offsets — пары [номер записи в части, байт], с которых
+        начинается каждый записанный блок (примерно каждые IO_BUFFER_KB).
+        Чтобы прочитать запись номер n части, достаточно перейти к ближайшему
+        смещению не дальше неё и пропустить остаток строк.
+        """
+        manifest = {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'records': self.total_lines,
+            'max_lines': self.max_lines,
+            'max_bytes': self.max_bytes,
+            'compression': self.compression,
+            'parts': self.manifest,
+        }
+        with open(self.manifest_path(), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        self.log(f"   ✓ Манифест частей: {os.path.basename(self.manifest_path())}")
+    
+    
+    def abort(self):
+        """
+        Прерывает запись (например, при остановке пользователем)
+        и удаляет уже записанные части, чтобы не оставлять неполный результат.
+        """
+        if self.file is not None:
+            try:
+                self.file.close()
+            except Exception:
+                pass  # Неполный файл всё равно удаляется
+            self.file = None
+        
+        for path, _ in self.parts:
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(self.current_path):
+            os.remove(self.current_path)
+        # Манифест прошлого запуска описывает уже перезаписанные части
+        if os.path.exists(self.manifest_path()):
+            os.remove(self.manifest_path())
+        self.parts = []
+    
+    
+    def state(self):
+        """
+        Состояние записи для контрольной точки. Перед этим всё записанное
+        сбрасывается на диск, чтобы размер текущей части был точным.
+        Сжатые части продолжить нельзя, поэтому со сжатием контрольные
+        точки не используются.
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return {
+            'part_number': self.part_number,
+            'lines_in_part': self.lines_in_part,
+            'total_lines': self.total_lines,
+            'parts': self.parts,
+            'manifest': self.manifest,
+            'current_path': self.current_path,
+            'current_size': os.fstat(self.file.fileno()).st_size,
+            'current_offsets': self.file.offsets,
+        }
+    
+    
+    def resume(self, state):
+        """
+        Продолжает запись с состояния state: всё, что было дописано
+        после контрольной точки, обрезается или удаляется.
+        """
+        self.part_number = state['part_number']
+        self.lines_in_part = state['lines_in_part']
+        self.total_lines = state['total_lines']
+        self.parts = [tuple(part) for part in state['parts']]
+        self.manifest = state['manifest']
+        self.current_path = state['current_path']
+        
+        # После контрольной точки первая часть могла успеть переименоваться
+        if not os.path.exists(self.current_path) and self.part_number == 1 \
+                and os.path.exists(self.part_path(1)):
+            os.replace(self.part_path(1), self.current_path)
+        
+        # Части, начатые после контрольной точки, удаляем
+        part_number = self.part_number + 1
+        while os.path.exists(self.part_path(part_number)):
+            os.remove(self.part_path(part_number))
+            part_number += 1
+        
+        with open(self.current_path, 'r+b') as f:
+            f.truncate(state['current_size'])
+        self.file = self.open_part(self.current_path, append=True)
+        # Часть уже записана до контрольной точки — продолжаем её счётчики
+        self.bytes_in_part = state['current_size']
+        self.file.lines_written = self.lines_in_part
+        self.file.bytes_written = state['current_size']
+        self.file.offsets = [tuple(offset) for offset in state['current_offsets']]
+    
+    
+    def detach(self):
+        """
+        Закрывает текущую часть, ничего не удаляя и не переименовывая, —
+        чтобы потом продолжить запись с контрольной точки.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+# ==================== ЗАПИСЬ ТОЛЬКО УНИКАЛЬНЫХ ЗАПИСЕЙ ====================
+
+class DeduplicatingWriter:
+    """
+    Пропускает в PartWriter только первые появления каждого title.
+    
+    Держит индекс дубликатов и следит за лимитом памяти: если индекс
+    вот-вот его перерастёт, дальше дубликаты ищутся через DiskDeduplicator,
+    а записи откладываются на диск до вызова finish.
+    
+    Порядок работы с одной записью:
+        if sink.check(key):          # False — точно дубликат
+            sink.write(key, json_line)
+    Для записей без title key = None.
+    """
+    
+    def __init__(self, index, writer, memory_budget_mb=None, log=None):
+        self.index = index
+        self.writer = writer
+        self.memory_budget_mb = memory_budget_mb
+        self.memory_budget = memory_budget_mb * 1024 * 1024 if memory_budget_mb else None
+        self.log = log or (lambda message: None)
+        
+        self.disk = None        # DiskDeduplicator, если перешли на диск
+        self.duplicates = 0     # Сколько дубликатов отброшено
+        self.written = 0        # Сколько записей записано в результат
+    
+    
+    def check(self, key):
+        """
+        Проверяет ключ title.
+        Возвращает False, если это дубликат (запись нужно пропустить),
+        и True, если запись нужно передать в write.
+        """
+        if key is None or self.disk is not None:
+            # Без title дубликатом быть нельзя, а в "дисковом" режиме
+            # решение принимается в finish
+            return True
+        
+        # Индекс вот-вот перерастёт лимит памяти — переходим на диск
+        if self.memory_budget and self.index.memory_bytes_after_add(key) > self.memory_budget:
+            self.log(f"   ⚠ Индекс дубликатов превысил лимит {self.memory_budget_mb} МБ "
+                     f"— продолжаем поиск дубликатов через диск")
+            self.disk = DiskDeduplicator(self.index)
+            return True
+        
+        if self.index.add_key(key):
+            return True
+        
+        self.duplicates += 1
+        return False
+    
+    
+    def write(self, key, json_line):
+        """Записывает готовую JSON-строку (или откладывает её на диск)."""
+        if self.disk is None:
+            self.writer.write_line(json_line)
+            self.written += 1
+        elif key is not None:
+            self.disk.add(key, json_line)
+        else:
+            self.disk.keep(json_line)
+    
+    
+    def finish(self, should_stop=None):
+        """
+        Дописывает отложенные на диск записи в исходном порядке.
+        Возвращает False, если обработку остановили.
+        """
+        if self.disk is None:
+            return True
+        
+        self.log("   Поиск дубликатов во временных файлах...")
+        result = self.disk.finish(self.writer, should_stop)
+        if result is None:
+            return False
+        
+        written, duplicates = result
+        self.written += written
+        self.duplicates += duplicates
+        return True
+    
+    
+    def cleanup(self):
+        """Удаляет временные файлы (если они были)."""
+        if self.disk is not None:
+            self.disk.cleanup()
+    
+    
+    def describe(self):
+        """Описание индекса дубликатов для лога."""
+        if self.disk is None:
+            return describe_title_index(self.index)
+        spilled = f"{self.disk.spilled_bytes / 1024 / 1024:,.1f}".replace(',', ' ')
+        return f"на диске — корзин: {self.disk.bucket_count}, временных файлов: {spilled} МБ"
+
+
+# ==================== ПОСЛЕДНЯЯ ИЛИ ОБЪЕДИНЁННАЯ ЗАПИСЬ (ДВА ПРОХОДА) ====================
+# При DEDUP_KEEP = "last" или "merge" файл читается дважды. В первом проходе
+# для каждого ключа запоминается только позиция нужной строки, во втором
+# записываются только строки-победители. Поэтому память — это размер индекса
+# позиций, даже если большая часть строк заменена более поздними
+
+DEDUP_STRATEGIES = ("first", "last", "merge")
+
+
+class PositionIndex:
+    """
+    Компактный индекс "ключ → позиция строки" для DEDUP_KEEP "last" и "merge".
+    
+    Как HashedTitleIndex, хранит только хеши ключей (DEDUP_HASH_BITS бит)
+    в таблице с открытой адресацией, а рядом с каждым хешем:
+        last — номер последней строки с этим ключом ("last" оставляет её)
+        first — номер первой строки ("merge" пишет запись на её месте)
+        tail — для "merge": последнее звено цепочки следующих строк с этим
+               ключом (links: смещение строки в файле и предыдущее звено)
+    Номера строк начинаются с единицы, ноль в ячейке first/last не встречается.
+    """
+    
+    MAX_LOAD = 0.7
+    
+    def __init__(self, bits=None, chains=False):
+        bits = bits or DEDUP_HASH_BITS
+        if bits not in (64, 128):
+            raise ValueError(f"Длина хеша должна быть 64 или 128 бит, а не {bits}")
+        self.bits = bits
+        self.digest_size = bits // 8
+        self.chains = chains
+        self.count = 0
+        self.superseded = 0      # Сколько строк заменено другими с тем же ключом
+        self.link_offsets = array('Q')
+        self.link_previous = array('Q')
+        self.allocate(1024)
+    
+    
+    def allocate(self, capacity):
+        """Создаёт пустую таблицу на capacity ячеек (capacity — степень двойки)."""
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.grow_at = int(capacity * self.MAX_LOAD)
+        empty = bytes(8 * capacity)
+        self.low = array('Q', empty)
+        self.high = array('Q', empty) if self.bits == 128 else None
+        self.last = array('Q', empty)
+        self.first = array('Q', empty) if self.chains else None
+        self.tail = array('Q', empty) if self.chains else None
+    
+    
+    def key(self, title):
+        """Хеш ключа title: (младшие 8 байт, старшие 8 байт или 0)."""
+        digest = hashlib.blake2b(title_key_bytes(title), digest_size=self.digest_size).digest()
+        low = int.from_bytes(digest[:8], 'little') or 1   # Ноль занят под "пусто"
+        return low, int.from_bytes(digest[8:], 'little')
+    
+    
+    def find(self, low, high):
+        """Ячейка с этим хешем или пустая ячейка, где ему место."""
+        table_low = self.low
+        table_high = self.high
+        mask = self.mask
+        slot = low & mask
+        while True:
+            current = table_low[slot]
+            if current == 0 or (current == low and (table_high is None or table_high[slot] == high)):
+                return slot
+            slot = (slot + 1) & mask
+    
+    
+    def add(self, title, number, offset=0):
+        """Первый проход: строка number (со смещением offset в файле) с ключом title."""
+        low, high = self.key(title)
+        slot = self.find(low, high)
+        
+        if self.low[slot] == 0:
+            self.low[slot] = low
+            if self.high is not None:
+                self.high[slot] = high
+            self.last[slot] = number
+            if self.chains:
+                self.first[slot] = number
+            self.count += 1
+            if self.count > self.grow_at:
+                self.grow()
+            return
+        
+        self.superseded += 1
+        self.last[slot] = number
+        if self.chains:
+            self.link_offsets.append(offset)
+            self.link_previous.append(self.tail[slot])
+            self.tail[slot] = len(self.link_offsets)   # Номер звена с единицы
+    
+    
+    def lookup(self, title):
+        """Второй проход: ячейка ключа title (ключ обязательно есть — он встречался в первом проходе)."""
+        return self.find(*self.key(title))
+    
+    
+    def chain(self, slot):
+        """Смещения следующих строк с ключом ячейки slot — в порядке файла."""
+        offsets = []
+        link = self.tail[slot]
+        while link:
+            offsets.append(self.link_offsets[link - 1])
+            link = self.link_previous[link - 1]
+        offsets.reverse()
+        return offsets
+    
+    
+    def grow(self):
+        """Увеличивает таблицу вдвое и переносит в неё все ячейки."""
+        old_low, old_high, old_last = self.low, self.high, self.last
+        old_first, old_tail = self.first, self.tail
+        self.allocate(self.capacity * 2)
+        
+        for slot, low in enumerate(old_low):
+            if low:
+                high = old_high[slot] if old_high is not None else 0
+                new_slot = self.find(low, high)
+                self.low[new_slot] = low
+                if self.high is not None:
+                    self.high[new_slot] = high
+                self.last[new_slot] = old_last[slot]
+                if self.chains:
+                    self.first[new_slot] = old_first[slot]
+                    self.tail[new_slot] = old_tail[slot]
+    
+    
+    def __len__(self):
+        return self.count
+    
+    
+    def memory_bytes(self):
+        """Примерный объём памяти, занятый индексом (в байтах)."""
+        tables = [self.low, self.high, self.last, self.first, self.tail,
+                  self.link_offsets, self.link_previous]
+        return sum(table.buffer_info()[1] * table.itemsize for table in tables if table is not None)
+
+
+class RecordScanner:
+    """
+    Перебирает записи входного файла для двух проходов DEDUP_KEEP:
+    выдаёт (номер строки, смещение строки в файле, запись).
+    Пустые строки и ошибки разбора не выдаются, а считаются в empty_lines
+    и parse_errors; lines — сколько строк (элементов массива) прочитано.
+    Как и при обычном чтении, строка NDJSON, которая не является объектом,
+    выдаётся как есть, а такой элемент массива — ошибка разбора.
+    position — сколько байт файла прочитано (у сжатого — сжатых байт).
+    Смещения есть только у несжатого NDJSON (у остальных — 0).
+    """
+    
+    def __init__(self, file_path, compression=None, input_format='ndjson'):
+        self.file_path = file_path
+        self.compression = compression
+        self.input_format = input_format
+        self.lines = 0
+        self.empty_lines = 0
+        self.parse_errors = 0
+        self.position = 0
+        self.error = None       # Ошибка в повреждённом JSON массиве (если была)
+    
+    
+    def __iter__(self):
+        if self.input_format == 'array':
+            with JSONArrayReader(self.file_path, self.compression) as reader:
+                for number, item in enumerate(reader, 1):
+                    self.lines = number
+                    self.position = reader.position
+                    if isinstance(item, dict):
+                        yield number, 0, item
+                    else:
+                        self.parse_errors += 1
+                if reader.error is not None:
+                    self.parse_errors += 1
+                    self.error = reader.error
+            return
+        
+        offset = 0
+        with open_lines(self.file_path, self.compression) as f:
+            for number, raw_line in enumerate(f, 1):
+                self.lines = number
+                line_offset = offset
+                offset += len(raw_line)
+                self.position = f.position if self.compression else offset
+                
+                line = raw_line.decode('utf-8').strip()
+                if not line:
+                    self.empty_lines += 1
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    self.parse_errors += 1
+                    continue
+                yield number, line_offset, record
+
+
+# ==================== ПАРАЛЛЕЛЬНАЯ ОБРАБОТКА ====================
+# Большой файл режется на куски по границам строк. Каждый кусок разбирается
+# в отдельном процессе, а поиск дубликатов делается в главном процессе
+# строго в порядке файла — поэтому результат такой же, как без параллельности
+
+# Настройки, которые нужно передать в процессы-помощники
+# (на Windows они запускаются "с нуля" и не видят изменений в главном процессе)
+WORKER_SETTINGS = (
+    'NEW_STOCK_VALUE', 'NEW_UNDER_ORDER_VALUE', 'NEW_PRICE_VALUE', 'FIELD_RULES', 'DEDUP_KEY',
+    'DEDUP_INDEX', 'DEDUP_HASH_BITS', 'NEAR_DUPLICATES', 'NEAR_DUP_THRESHOLD', 'NEAR_DUP_PERMUTATIONS',
+    'IO_BUFFER_KB',
+    'PIPELINE', 'PIPELINE_QUEUE_BLOCKS', 'INPUT_FORMAT',
+)
+
+
+def current_settings():
+    """Текущие значения настроек для процессов-помощников."""
+    return {name: globals()[name] for name in WORKER_SETTINGS}
+
+
+def apply_settings(settings):
+    """Применяет настройки в процессе-помощнике (вызывается при его запуске)."""
+    globals().update(settings)
+
+
+def resolve_workers(workers=None):
+    """Сколько процессов использовать: None — из настроек, 0 — по числу ядер."""
+    if workers is None:
+        workers = PARALLEL_WORKERS
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    return max(1, workers)
+
+
+def split_into_ranges(file_path, file_size, chunk_size, start=0, line_end=b'\n'):
+    """
+    Делит файл (начиная с байта start — начала строки) на куски
+    примерно по chunk_size байт.
+    Каждая граница сдвигается к началу следующей строки, поэтому
+    ни одна строка не разрезается пополам.
+    Возвращает список пар (начало, конец) в байтах.
+    line_end — перевод строки в файле (см. detect_line_end)
+    """
+    boundaries = [start]
+    with open(file_path, 'rb') as f:
+        position = start + chunk_size
+        while position < file_size:
+            f.seek(position)
+            read_line(f, line_end)  # Дочитываем строку до конца
+            boundary = f.tell()
+            if boundary >= file_size:
+                break
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+            position = boundary + chunk_size
+    boundaries.append(file_size)
+    return [(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1)]
+
+
+def process_line_range(file_path, start, end, line_end=b'\n'):
+    """
+    Обрабатывает кусок файла [start, end) в процессе-помощнике.
+    line_end — перевод строки в файле (см. detect_line_end).
+    
+    Делает всё, что не зависит от других строк: декодирует, пропускает
+    пустые строки, парсит JSON, считает ключ title и заменяет поля.
+    Возвращает (счётчики, записи), где счётчики — как в new_stats,
+    а записи — список (смещение строки, ключ title или None, готовая JSON-строка).
+    """
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        block = f.read(end - start)
+    
+    raw_lines = block.split(line_end)
+    if raw_lines[-1] == b'':
+        # После последнего перевода строки ничего нет — это не строка
+        raw_lines.pop()
+    
+    return process_raw_lines(raw_lines, start)
+
+
+def process_raw_lines(raw_lines, offset=0):
+    """
+    Обрабатывает список строк (bytes без перевода строки), которые
+    начинаются с байта offset файла. Возвращает то же, что process_line_range.
+    """
+    key_of = create_title_index().key
+    stats = new_stats()
+    stats['lines'] = len(raw_lines)
+    records = []
+    
+    for raw_line in raw_lines:
+        line_offset = offset
+        offset += len(raw_line) + 1
+        
+        line = raw_line.decode('utf-8').strip()
+        if not line:
+            stats['empty_lines'] += 1
+            continue
+        
+        try:
+            title, json_line = clean_line(line)
+        except json.JSONDecodeError:
+            stats['parse_errors'] += 1
+            continue
+        
+        key = key_of(title) if title is not None else None
+        records.append((line_offset, key, json_line))
+    
+    return stats, records
+
+
+# ==================== ПАРАЛЛЕЛЬНАЯ ОБРАБОТКА НЕСКОЛЬКИХ ФАЙЛОВ ====================
+# Тяжёлая часть (разбор JSON и замена полей) идёт для всех файлов одновременно,
+# а результат каждого файла складывается во временный файл ("спул").
+# Поиск дубликатов и запись результата идут в главном процессе по порядку
+# файлов — поэтому результат не зависит от того, какой файл разобрался раньше
+
+# Заголовок записи в спуле: длина ключа (-1 — записи без title), длина строки
+SPOOL_HEADER = struct.Struct('<iI')
+
+
+def spool_file(file_path, spool_path):
+    """
+    Разбирает файл целиком (в процессе-помощнике) и складывает готовые
+    записи в спул: (ключ title или None, JSON-строка) в порядке файла.
+    Возвращает счётчики статистики (как в new_stats).
+    """
+    file_size = os.path.getsize(file_path)
+    chunk_size = PARALLEL_CHUNK_MB * 1024 * 1024
+    compression = detect_compression(file_path)
+    line_end = detect_line_end(file_path, compression)
+    stats = new_stats()
+    
+    with open(spool_path, 'wb') as out:
+        if detect_input_format(file_path, compression) == 'array':
+            reader = JSONArrayReader(file_path, compression)
+            batches = process_array_items(reader)
+        elif compression:
+            # Сжатый файл режется не по байтам, а по распакованным блокам
+            reader = BlockReader(file_path, compression, line_end=line_end)
+            batches = (process_raw_lines(lines) for lines in reader.line_batches())
+        else:
+            reader = None
+            batches = (process_line_range(file_path, start, end, line_end)
+                       for start, end in split_into_ranges(file_path, file_size, chunk_size,
+                                                           line_end=line_end))
+        
+        try:
+            for counters, records in batches:
+                add_stats(stats, counters)
+                
+                for _, key, json_line in records:
+                    line_bytes = json_line.encode('utf-8', 'surrogatepass')
+                    if key is None:
+                        out.write(SPOOL_HEADER.pack(-1, len(line_bytes)))
+                    else:
+                        out.write(SPOOL_HEADER.pack(len(key), len(line_bytes)))
+                        out.write(key)
+                    out.write(line_bytes)
+        finally:
+            if reader is not None:
+                reader.close()
+    
+    return stats
+
+
+def read_spool(spool_path):
+    """
+    Читает спул: выдаёт (ключ или None, JSON-строка, байт прочитано всего).
+    """
+    header_size = SPOOL_HEADER.size
+    position = 0
+    with open(spool_path, 'rb') as f:
+        while True:
+            header = f.read(header_size)
+            if not header:
+                return
+            key_length, line_length = SPOOL_HEADER.unpack(header)
+            key = f.read(key_length) if key_length >= 0 else None
+            line_bytes = f.read(line_length)
+            position += header_size + max(key_length, 0) + line_length
+            yield key, line_bytes.decode('utf-8', 'surrogatepass'), position
+
+
+class SpoolBatch:
+    """
+    Запускает разбор всех файлов пакета в процессах-помощниках
+    и отдаёт готовые спулы по одному в порядке выбора файлов.
+    """
+    
+    def __init__(self, file_paths, workers):
+        import tempfile
+        from concurrent.futures import ProcessPoolExecutor
+        
+        self.temp_dir = tempfile.mkdtemp(prefix='json_cleaner_batch_', dir=SPILL_DIR)
+        self.spool_paths = [
+            os.path.join(self.temp_dir, f"spool{i}.bin") for i in range(len(file_paths))
+        ]
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=apply_settings,
+            initargs=(current_settings(),)
+        )
+        self.futures = [
+            self.executor.submit(spool_file, file_path, spool_path)
+            for file_path, spool_path in zip(file_paths, self.spool_paths)
+        ]
+    
+    
+    def result(self, index, should_stop=None):
+        """
+        Ждёт, пока файл с номером index будет разобран.
+        Возвращает счётчики статистики или None, если обработку
+        остановили. Ошибка разбора файла пробрасывается дальше.
+        """
+        from concurrent.futures import TimeoutError as FuturesTimeoutError
+        
+        should_stop = should_stop or (lambda: False)
+        future = self.futures[index]
+        while True:
+            if should_stop():
+                return None
+            try:
+                return future.result(timeout=0.2)
+            except FuturesTimeoutError:
+                continue
+    
+    
+    def discard(self, index):
+        """Удаляет спул уже обработанного файла."""
+        if os.path.exists(self.spool_paths[index]):
+            os.remove(self.spool_paths[index])
+    
+    
+    def close(self):
+        """Останавливает процессы-помощники и удаляет временные файлы."""
+        import shutil
+        
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+# ==================== ЗАМЕРЫ И ОТЧЁТ О ЗАПУСКЕ ====================
+# Пока файл обрабатывается, RunReport собирает замеры: время по этапам,
+# байты на входе и выходе, скорость по ходу работы и пик памяти.
+# Отчёт возвращается в статистике файла ('report'), а при RUN_REPORT
+# ещё и сохраняется в JSON рядом с результатом
+
+# Этапы обработки (название → что в него входит)
+STAGES = {
+    'read': "чтение и декодирование строк",
+    'parse': "json.loads, план правил и поиск title",
+    'dedup': "поиск дубликатов",
+    'transform': "правила полей (FieldPlan.apply)",
+    'serialize': "json.dumps",
+    'write': "запись результата",
+    'wait': "ожидание процессов-помощников",
+    'merge': "поиск дубликатов и запись записей, разобранных помощниками",
+    'finish': "дописывание отложенного на диск и закрытие частей",
+}
+
+
+def peak_memory_mb():
+    """
+    Пик памяти главного процесса в МБ (None, если узнать нельзя, например на Windows).
+    Память процессов-помощников сюда не входит.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    if sys.platform == 'darwin':
+        return round(peak / 1024 / 1024, 1)
+    return round(peak / 1024, 1)
+
+
+class SamplingProfiler:
+    """
+    Простой профилировщик "по выборке".
+    
+    Отдельный поток каждые interval секунд смотрит, какая строка кода
+    сейчас выполняется в потоке обработки, и считает попадания.
+    В отличие от cProfile, почти не замедляет обработку.
+    
+    Вместо него движку можно передать свой профилировщик
+    (CleanerEngine(profiler=...)): любой объект с методами start()
+    и stop(), где stop() возвращает словарь для отчёта.
+    """
+    
+    def __init__(self, interval=None, top=20):
+        self.interval = interval or PROFILE_INTERVAL
+        self.top = top                  # Сколько самых частых строк показывать
+        self.counts = {}                # (файл, функция, строка) → сколько раз
+        self.samples = 0
+        self.thread = None
+        self.stop_event = threading.Event()
+    
+    
+    def start(self):
+        """Начинает выборки в потоке, который вызвал start."""
+        self.target_id = threading.get_ident()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    
+    def run(self):
+        """Цикл выборок (работает в своём потоке)."""
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target_id)
+            if frame is None:
+                continue
+            code = frame.f_code
+            place = (os.path.basename(code.co_filename), code.co_name, frame.f_lineno)
+            self.counts[place] = self.counts.get(place, 0) + 1
+            self.samples += 1
+    
+    
+    def stop(self):
+        """Останавливает выборки и возвращает самые частые строки кода."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        
+        top = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:self.top]
+        return {
+            'interval': self.interval,
+            'samples': self.samples,
+            'top': [
+                {
+                    'place': f"{file_name}:{line} ({function})",
+                    'samples': count,
+                    'percent': round(count / self.samples * 100, 1),
+                }
+                for (file_name, function, line), count in top
+            ],
+        }
+
+
+class RunReport:
+    """
+    Замеры обработки одного файла.
+    
+    stages — секунды по этапам (см. STAGES). Этапы каждой строки
+    замеряются только при stage_timing, крупные (ожидание помощников,
+    дописывание с диска) — всегда.
+    """
+    
+    def __init__(self, file_path, stage_timing=None):
+        self.file_path = file_path
+        self.stage_timing = STAGE_TIMING if stage_timing is None else stage_timing
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.started_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.start = time.perf_counter()
+        self.next_sample = self.start + TIMELINE_INTERVAL
+        self.timeline = []      # (секунд с начала, строк, байт)
+        self.profile = None     # Результат профилировщика (если он был)
+        self.queues = {}        # Счётчики очередей конвейера: 'read', 'write' (см. StageQueue)
+    
+    
+    def sample(self, lines, bytes_done):
+        """
+        Запоминает, сколько уже обработано (не чаще раза в TIMELINE_INTERVAL
+        секунд) — по этим точкам видно, как менялась скорость.
+        """
+        now = time.perf_counter()
+        if now >= self.next_sample:
+            self.next_sample = now + TIMELINE_INTERVAL
+            self.timeline.append((now - self.start, lines, bytes_done))
+    
+    
+    def to_dict(self, stats, bytes_in, output_paths):
+        """Отчёт в виде словаря (для JSON)."""
+        elapsed = time.perf_counter() - self.start
+        bytes_out = sum(os.path.getsize(path) for path in output_paths if os.path.exists(path))
+        
+        # Скорость между соседними точками
+        timeline = []
+        previous_seconds, previous_lines = 0.0, 0
+        for seconds, lines, bytes_done in self.timeline + [(elapsed, stats['lines'], bytes_in)]:
+            interval = seconds - previous_seconds
+            timeline.append({
+                'seconds': round(seconds, 3),
+                'lines': lines,
+                'bytes': bytes_done,
+                'rows_per_sec': round((lines - previous_lines) / interval, 1) if interval > 0 else None,
+            })
+            previous_seconds, previous_lines = seconds, lines
+        
+        stages = {name: round(seconds, 4) for name, seconds in self.stages.items() if seconds}
+        
+        return {
+            'file': os.path.abspath(self.file_path),
+            'started_at': self.started_at,
+            'seconds': round(elapsed, 4),
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'rows_per_sec': round(stats['lines'] / elapsed, 1) if elapsed else None,
+            'mb_per_sec': round(bytes_in / 1024 / 1024 / elapsed, 2) if elapsed else None,
+            'peak_memory_mb': peak_memory_mb(),
+            'stage_timing': self.stage_timing,
+            'stages': stages,
+            'stages_other': round(elapsed - sum(self.stages.values()), 4) if self.stage_timing else None,
+            'counters': {name: value for name, value in stats.items() if name in new_stats()},
+            'duplicate_tiers': stats.get('duplicate_tiers'),
+            'parts': [{'path': path, 'lines': lines} for path, lines in stats.get('parts', [])],
+            'timeline': timeline,
+            'queues': self.queue_summary(),
+            'profile': self.profile,
+        }
+    
+    
+    def queue_summary(self):
+        """Глубина очередей конвейера и время ожидания этапов (для настройки)."""
+        return {
+            name: {
+                'capacity': counters['capacity'],
+                'blocks': counters['items'],
+                'max_depth': counters['max_depth'],
+                'mean_depth': round(counters['depth_total'] / counters['items'], 2) if counters['items'] else 0,
+                'producer_wait_seconds': round(counters['producer_wait'], 4),
+                'consumer_wait_seconds': round(counters['consumer_wait'], 4),
+            }
+            for name, counters in self.queues.items()
+        }
+
+
+def write_report(path, report):
+    """Сохраняет отчёт в JSON файл."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+# ==================== КОНТРОЛЬНЫЕ ТОЧКИ ====================
+# Чтобы остановка или сбой на середине большого файла не означали
+# "начинай сначала", обработка периодически сохраняет своё состояние
+
+class Checkpoint:
+    """
+    Контрольная точка обработки одного файла.
+    
+    Хранится в папке "<имя>_cleaned.checkpoint" рядом с результатом:
+        state.json — смещение во входном файле (всё до него уже обработано),
+                     счётчики, состояние частей результата
+        index_<N>.bin — снимок индекса дубликатов
+    Состояние заменяется целиком (сначала пишется новый снимок индекса,
+    потом state.json), поэтому сбой во время сохранения не портит
+    предыдущую точку.
+    
+    Время на сохранение ограничено: следующая точка ставится не раньше,
+    чем через CHECKPOINT_INTERVAL секунд, и так, чтобы на сохранения
+    уходило не больше CHECKPOINT_MAX_OVERHEAD от времени обработки.
+    """
+    
+    VERSION = 1
+    
+    def __init__(self, file_path, file_dir, base_name, log=None):
+        self.file_path = file_path
+        self.dir = os.path.join(file_dir, f"{base_name}_cleaned.checkpoint")
+        self.state_path = os.path.join(self.dir, 'state.json')
+        self.log = log or (lambda message: None)
+        
+        self.state = None       # Состояние, с которого продолжаем (если есть)
+        self.saved = False      # Есть ли на диске точка, на которую можно опереться
+        self.generation = 0     # Номер последнего снимка индекса
+        self.writer = None
+        self.sink = None
+        self.stats = None
+        self.next_save = time.monotonic() + CHECKPOINT_INTERVAL
+        self.disabled_logged = False
+    
+    
+    def fingerprint(self):
+        """
+        По чему проверяется, что точка подходит: тот же входной файл
+        и те же настройки, от которых зависит результат.
+        """
+        file_stat = os.stat(self.file_path)
+        return {
+            'file_size': file_stat.st_size,
+            'file_mtime': file_stat.st_mtime,
+            'max_lines': MAX_LINES_PER_FILE,
+            'max_part_mb': MAX_PART_MB,
+            'rules': field_rules().spec,
+            'dedup_index': DEDUP_INDEX,
+            'hash_bits': DEDUP_HASH_BITS,
+            'near_duplicates': [NEAR_DUP_THRESHOLD, NEAR_DUP_PERMUTATIONS] if NEAR_DUPLICATES else None,
+        }
+    
+    
+    def exists(self):
+        """Осталась ли точка от прошлого запуска."""
+        return os.path.exists(self.state_path)
+    
+    
+    def load(self):
+        """
+        Читает точку прошлого запуска.
+        Возвращает True, если с неё можно продолжить.
+        """
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        
+        if state.get('version') != self.VERSION or state.get('fingerprint') != self.fingerprint():
+            return False
+        
+        # Готовые части и снимок индекса должны быть на месте
+        if not all(os.path.exists(path) for path, _ in state['writer']['parts']):
+            return False
+        if not os.path.exists(os.path.join(self.dir, state['index_file'])):
+            return False
+        
+        self.state = state
+        self.saved = True
+        self.generation = state['generation']
+        return True
+    
+    
+    @property
+    def start_offset(self):
+        """С какого байта входного файла продолжать."""
+        return self.state['offset'] if self.state is not None else 0
+    
+    
+    def attach(self, writer, sink, stats):
+        """
+        Подключает точку к записи файла. Если продолжаем — восстанавливает
+        индекс дубликатов и счётчики из сохранённого состояния.
+        """
+        self.writer = writer
+        self.sink = sink
+        self.stats = stats
+        
+        if self.state is not None:
+            with open(os.path.join(self.dir, self.state['index_file']), 'rb') as f:
+                sink.index.load(f)
+            stats.update(self.state['counters'])
+            sink.duplicates = self.state['duplicates']
+            sink.written = self.state['written']
+    
+    
+    def due(self):
+        """Пора ли сохранять точку (и можно ли это сделать)."""
+        if time.monotonic() < self.next_save:
+            return False
+        if self.sink.disk is not None:
+            # Записи отложены на диск до конца файла — состояние
+            # уже не описывается смещением, новые точки не ставим
+            if not self.disabled_logged:
+                self.disabled_logged = True
+                self.log("   ⚠ После перехода на поиск дубликатов через диск "
+                         "контрольные точки больше не сохраняются")
+            return False
+        return True
+    
+    
+    def save(self, offset, **extra):
+        """
+        Сохраняет точку: всё до байта offset входного файла обработано.
+        extra — счётчики, которые ещё не прибавлены к stats (lines, empty_lines...).
+        Возвращает False, если сохранить нельзя (записи отложены на диск).
+        """
+        if self.sink.disk is not None:
+            return False
+        
+        start = time.monotonic()
+        os.makedirs(self.dir, exist_ok=True)
+        
+        counters = {name: self.stats[name] for name in new_stats()}
+        for name, value in extra.items():
+            counters[name] += value
+        
+        # Сначала результат и снимок индекса, потом state.json
+        writer_state = self.writer.state()
+        generation = self.generation + 1
+        index_file = f"index_{generation}.bin"
+        with open(os.path.join(self.dir, index_file), 'wb') as f:
+            self.sink.index.save(f)
+            f.flush()
+            os.fsync(f.fileno())
+        
+        state = {
+            'version': self.VERSION,
+            'fingerprint': self.fingerprint(),
+            'saved_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'offset': offset,
+            'counters': counters,
+            'duplicates': self.sink.duplicates,
+            'written': self.sink.written,
+            'writer': writer_state,
+            'generation': generation,
+            'index_file': index_file,
+        }
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.state_path)
+        
+        # Старый снимок индекса больше не нужен
+        old_index = os.path.join(self.dir, f"index_{self.generation}.bin")
+        if self.generation and os.path.exists(old_index):
+            os.remove(old_index)
+        self.generation = generation
+        self.saved = True
+        
+        # Следующая точка — не раньше, чем позволяет ограничение времени
+        duration = time.monotonic() - start
+        self.next_save = time.monotonic() + max(CHECKPOINT_INTERVAL, duration / CHECKPOINT_MAX_OVERHEAD)
+        return True
+    
+    
+    def remove(self):
+        """Удаляет точку (файл обработан до конца или точка не подходит)."""
+        import shutil
+        
+        shutil.rmtree(self.dir, ignore_errors=True)
+        self.saved = False
+
+
+# ==================== ПРЕДВАРИТЕЛЬНАЯ ОЦЕНКА ФАЙЛА ====================
+# Прежде чем занимать обработкой сервер на несколько часов, полезно знать,
+# сколько в файле уникальных title, сколько получится частей и сколько это
+# займёт. Для этого читается небольшая выборка (ESTIMATE_SAMPLE_PERCENT файла
+# кусками, равномерно разбросанными по нему). Title выборки считаются точно
+# (по 8-байтовым хешам), а число различных title во всём файле оценивается
+# по тому, сколько title встретилось в выборке один раз, два раза и т. д.
+
+
+def estimate_distinct(frequencies, total_records):
+    """
+    Сколько различных title во всём файле из total_records записей с title.
+    frequencies — {k: сколько title встретилось в выборке ровно k раз}.
+    Возвращает (оценка, нижняя граница, верхняя граница).
+    
+    В выборку из 1% файла обе записи пары с одинаковым title попадают редко
+    (с вероятностью 0.01%), поэтому по ней одинаково хорошо объясняются
+    и "почти все title разные", и "много title повторяется".
+    Берутся две известные оценки, которые ошибаются в разные стороны:
+    - "складной нож" первого порядка (Haas и др.): d / (1 - (1 - q) * f1 / n) —
+      занижает, когда большинство title в файле встречается один раз;
+    - оценка Шлоссера: d + f1 * Σ (1 - q)^k * f_k / Σ k * q * (1 - q)^(k - 1) * f_k —
+      завышает, когда повторы редки.
+    Здесь d — различных title в выборке, n — записей в ней, q — доля выборки,
+    f_k — title, встреченных k раз. Истинное число обычно между ними,
+    оценка — их среднее геометрическое.
+    """
+    sample_records = sum(k * count for k, count in frequencies.items())
+    distinct = sum(frequencies.values())
+    if not sample_records:
+        return 0.0, 0.0, 0.0
+    share = sample_records / total_records
+    if share >= 1:
+        return distinct, distinct, distinct
+    
+    singles = frequencies.get(1, 0)
+    jackknife = distinct / (1 - (1 - share) * singles / sample_records)
+    missed = sum((1 - share) ** k * count for k, count in frequencies.items())
+    found = sum(k * share * (1 - share) ** (k - 1) * count for k, count in frequencies.items())
+    shlosser = distinct + singles * missed / found
+    
+    low = min(jackknife, shlosser, total_records)
+    high = min(max(jackknife, shlosser), total_records)
+    return math.sqrt(low * high), low, high
+
+
+def sample_lines(file_path, file_size, sample_bytes, windows, line_end=b'\n'):
+    """
+    Выдаёт строки (bytes) из windows кусков файла, равномерно разбросанных
+    по нему, — всего около sample_bytes байт. Кусок начинается со следующей
+    целой строки. Маленький файл читается целиком.
+    line_end — перевод строки в файле (см. detect_line_end)
+    """
+    with open(file_path, 'rb') as f:
+        if sample_bytes >= file_size:
+            yield from iter_lines(f, line_end)
+            return
+        
+        window = max(1, sample_bytes // windows)
+        for number in range(windows):
+            offset = number * file_size // windows
+            f.seek(offset)
+            if offset:
+                read_line(f, line_end)   # Неполная строка — из предыдущего куска
+            read = 0
+            while read < window:
+                line = read_line(f, line_end)
+                if not line:
+                    break
+                read += len(line)
+                yield line
+
+
+def estimate_file(file_path, sample_percent=None):
+    """
+    Оценивает обработку файла по выборке, не обрабатывая его целиком.
+    
+    sample_percent — какую долю файла читать (по умолчанию ESTIMATE_SAMPLE_PERCENT,
+    но не меньше ESTIMATE_MIN_SAMPLE_MB). Несжатый NDJSON читается кусками
+    по всему файлу, сжатый файл и JSON массив — с начала (с середины их не прочитать).
+    
+    Строки выборки обрабатываются так же, как при обычной обработке
+    (правила полей, сжатие результата), поэтому время на них
+    даёт скорость этой машины. Возвращает словарь:
+        lines — строк в файле, blank_rate, parse_error_rate — доля пустых
+        и битых строк, distinct_titles — различных ключей дубликатов,
+        unique_records — сколько записей останется, duplicate_ratio,
+        avg_output_line_bytes, output_bytes — размер результата (со сжатием —
+        сжатый), parts — частей, seconds — время обработки в одном процессе,
+        а также размер выборки и время самой оценки.
+    Для distinct_titles, unique_records, output_bytes и parts есть ещё
+    *_range — вероятный диапазон [от, до] (см. estimate_distinct).
+    Поиск похожих title (NEAR_DUPLICATES) и DEDUP_KEEP в оценке не учитываются.
+    """
+    start = time.perf_counter()
+    if sample_percent is None:
+        sample_percent = ESTIMATE_SAMPLE_PERCENT
+    file_size = os.path.getsize(file_path)
+    sample_bytes = max(int(file_size * sample_percent / 100), int(ESTIMATE_MIN_SAMPLE_MB * 1024 * 1024))
+    compression = detect_compression(file_path)
+    input_format = detect_input_format(file_path, compression)
+    line_end = detect_line_end(file_path, compression)
+    
+    rules = field_rules()
+    counters = new_stats()
+    title_counts = {}   # Хеш title → сколько раз встретился в выборке
+    lines = 0
+    records_with_title = 0
+    output_bytes = 0
+    output = io.BytesIO() if OUTPUT_COMPRESSION else None
+    
+    def take(title, json_line):
+        """Учитывает обработанную запись выборки."""
+        nonlocal records_with_title, output_bytes
+        if title is not None:
+            digest = hashlib.blake2b(title_key_bytes(title), digest_size=8).digest()
+            title_counts[digest] = title_counts.get(digest, 0) + 1
+            records_with_title += 1
+        encoded = json_line.encode('utf-8', 'surrogatepass') + b'\n'
+        output_bytes += len(encoded)
+        if output is not None:
+            output.write(encoded)
+    
+    process_start = time.perf_counter()
+    if input_format == 'array':
+        method = 'prefix'
+        # Небольшие блоки — чтобы прочитанная доля файла была точнее
+        with JSONArrayReader(file_path, compression, buffer_size=64 * 1024) as reader:
+            for item in reader:
+                lines += 1
+                try:
+                    take(*clean_record(item, rules))
+                except ValueError:
+                    counters['parse_errors'] += 1
+                if reader.position >= sample_bytes:
+                    break
+            sampled_bytes = reader.position or file_size
+    else:
+        raw = None
+        if compression:
+            method = 'prefix'
+            raw = open(file_path, 'rb')
+            source = open_compressed(raw, 'rb', compression)
+        else:
+            method = 'strided'
+            source = sample_lines(file_path, file_size, sample_bytes, ESTIMATE_WINDOWS, line_end)
+        sampled_bytes = 0
+        try:
+            for raw_line in (iter_lines(source, line_end) if raw is not None else source):
+                lines += 1
+                sampled_bytes += len(raw_line)
+                line = raw_line.decode('utf-8').strip()
+                if not line:
+                    counters['empty_lines'] += 1
+                else:
+                    try:
+                        take(*clean_line(line))
+                    except json.JSONDecodeError:
+                        counters['parse_errors'] += 1
+                if raw is not None and raw.tell() >= sample_bytes:
+                    break
+            if raw is not None:
+                # Для сжатого файла доля выборки — по прочитанным сжатым байтам
+                sampled_bytes = raw.tell()
+        finally:
+            if raw is not None:
+                source.close()
+                raw.close()
+    
+    if output is not None:
+        # Сжимаем результат выборки тем же способом, что и настоящий результат
+        compressed = io.BytesIO()
+        with open_compressed(compressed, 'wb', OUTPUT_COMPRESSION) as f:
+            f.write(output.getvalue())
+        compression_ratio = len(compressed.getvalue()) / max(1, output_bytes)
+    process_seconds = time.perf_counter() - process_start
+    
+    # Переносим выборку на весь файл
+    scale = file_size / max(1, sampled_bytes)
+    records = lines - counters['empty_lines'] - counters['parse_errors']
+    total_lines = lines * scale
+    total_records = records * scale
+    records_without_title = (records - records_with_title) * scale
+    average_line = output_bytes / records if records else 0
+    
+    frequencies = {}
+    for count in title_counts.values():
+        frequencies[count] = frequencies.get(count, 0) + 1
+    distinct_range = estimate_distinct(frequencies, records_with_title * scale)
+    
+    def project(distinct):
+        """Записей, байт и частей результата при distinct различных title."""
+        unique = min(total_records, distinct + records_without_title)
+        result_bytes = unique * average_line
+        parts = math.ceil(unique / MAX_LINES_PER_FILE) if unique else 1
+        if MAX_PART_MB:
+            parts = max(parts, math.ceil(result_bytes / (MAX_PART_MB * 1024 * 1024)))
+        if output is not None:
+            result_bytes *= compression_ratio
+        return unique, result_bytes, parts
+    
+    distinct, low, high = distinct_range
+    unique, result_bytes, parts = project(distinct)
+    unique_low, bytes_low, parts_low = project(low)
+    unique_high, bytes_high, parts_high = project(high)
+    
+    return {
+        'file': os.path.abspath(file_path),
+        'file_bytes': file_size,
+        'sample_method': method,
+        'sample_bytes': min(sampled_bytes, file_size),
+        'sample_lines': lines,
+        'lines': round(total_lines),
+        'blank_rate': round(counters['empty_lines'] / lines, 4) if lines else 0.0,
+        'parse_error_rate': round(counters['parse_errors'] / lines, 4) if lines else 0.0,
+        'distinct_titles': round(distinct),
+        'distinct_titles_range': [round(low), round(high)],
+        'unique_records': round(unique),
+        'unique_records_range': [round(unique_low), round(unique_high)],
+        'duplicate_ratio': round(1 - unique / total_records, 4) if total_records else 0.0,
+        'avg_output_line_bytes': round(average_line, 1),
+        'output_bytes': round(result_bytes),
+        'output_bytes_range': [round(bytes_low), round(bytes_high)],
+        'parts': parts,
+        'parts_range': [parts_low, parts_high],
+        'seconds': round(process_seconds * scale, 1),
+        'estimate_seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+# ==================== ДВИЖОК ОЧИСТКИ (БЕЗ ОКНА) ====================
+# Вся обработка файлов живёт здесь и не зависит от tkinter:
+# движок можно вызывать из других программ, из командной строки
+# и на серверах без экрана. Окно (JSONCleanerApp) только показывает его работу
+
+def clean_lines(lines, stats=None, title_index=None):
+    """
+    Очищает строки NDJSON без файлов и окон.
+    
+    lines — любые строки (str или bytes), например открытый файл
+    stats — словарь счётчиков (как в new_stats), обновляется по ходу работы
+    title_index — индекс title (если нужно искать дубликаты вместе с другими данными)
+    
+    Выдаёт очищенные JSON-строки (без перевода строки) по одной:
+    пустые строки, ошибки JSON и дубликаты title пропускаются,
+    значения полей заменяются. Строки идут потоком, поэтому из дубликатов
+    всегда остаётся первый (DEDUP_KEEP здесь не действует).
+        
+        stats = new_stats()
+        for json_line in clean_lines(open("feed.json", encoding="utf-8"), stats):
+            ...
+    """
+    if stats is None:
+        stats = new_stats()
+    index = title_index if title_index is not None else create_title_index()
+    
+    for raw_line in lines:
+        stats['lines'] += 1
+        if isinstance(raw_line, bytes):
+            raw_line = raw_line.decode('utf-8')
+        
+        line = raw_line.strip()
+        if not line:
+            stats['empty_lines'] += 1
+            continue
+        
+        try:
+            title, json_line = clean_line(line)
+        except json.JSONDecodeError:
+            stats['parse_errors'] += 1
+            continue
+        
+        if title is not None and not index.add(title):
+            stats['duplicates'] += 1
+            continue
+        
+        stats['unique'] += 1
+        yield json_line
+
+
+class CleanerEngine:
+    """
+    Обработка файлов без окна.
+    
+    О ходе работы движок сообщает через функции, переданные при создании:
+        log(message) — сообщение в лог
+        on_progress(percent) — прогресс текущего файла (0–100)
+        on_file_start(index, total, file_path) — начат файл номер index
+        on_file_done(index, total) — файл номер index закончен
+    Замеры каждого файла возвращаются в его статистике ('report'),
+    при RUN_REPORT они ещё и сохраняются в JSON (см. RunReport).
+    Чтобы остановить обработку, нужно выставить stop_processing = True
+    (например, из другого потока).
+    """
+    
+    def __init__(self, log=None, on_progress=None, on_file_start=None, on_file_done=None,
+                 output_dir=None, profiler=None):
+        """
+        output_dir — куда сохранять результат (None — рядом с исходным файлом)
+        profiler — функция без аргументов, создающая профилировщик для каждого
+                   файла (см. SamplingProfiler). None — SamplingProfiler,
+                   если включён PROFILE_SAMPLING
+        """
+        self.log = log or (lambda message: None)
+        self.on_progress = on_progress or (lambda percent: None)
+        self.on_file_start = on_file_start or (lambda index, total, file_path: None)
+        self.on_file_done = on_file_done or (lambda index, total: None)
+        self.output_dir = output_dir
+        self.profiler = profiler
+        
+        # Флаг для остановки обработки
+        self.stop_processing = False
+        
+        # Когда последний раз сообщали о прогрессе (прогресс отправляется
+        # не чаще, чем раз в PROGRESS_INTERVAL секунд)
+        self.last_progress_time = 0.0
+        
+        # Сколько файлов не удалось обработать из-за ошибки (за последний запуск)
+        self.failed_files = 0
+        
+        # Отчёт о последнем запуске process_files (см. RunReport)
+        self.batch_report = None
+    
+    
+    def report_progress(self, percent, force=False):
+        """
+        Сообщает прогресс текущего файла, но не чаще раза в PROGRESS_INTERVAL
+        секунд (force=True — сообщить в любом случае, например 0% и 100%).
+        """
+        now = time.monotonic()
+        if force or now - self.last_progress_time >= PROGRESS_INTERVAL:
+            self.last_progress_time = now
+            self.on_progress(percent)
+    
+    
+    def process_files(self, file_paths):
+        """
+        Обрабатывает все файлы по очереди (или параллельно, см. PARALLEL_FILES).
+        Возвращает время работы в секундах.
+        """
+        total_files = len(file_paths)
+        start_time = time.time()
+        self.failed_files = 0
+        file_results = []   # Итог каждого файла для отчёта о запуске
+        
+        self.log("=" * 50)
+        self.log(f"🚀 Начинаем обработку {total_files} файлов...")
+        self.log("=" * 50)
+        
+        # Правила полей читаются заново (файл могли поменять между запусками)
+        FIELD_RULES_CACHE.clear()
+        try:
+            rules = field_rules()
+        except (OSError, ValueError) as e:
+            self.failed_files = total_files
+            self.log(f"❌ Не удалось прочитать правила полей: {e}")
+            return time.time() - start_time
+        if FIELD_RULES:
+            self.log(f"📐 Правила полей: {FIELD_RULES} ({rules.describe()})")
+        
+        # Постоянный индекс title между запусками (если задан)
+        store = None
+        if PERSISTENT_INDEX:
+            try:
+                store = open_persistent_index(PERSISTENT_INDEX)
+            except (OSError, ValueError) as e:
+                self.failed_files = total_files
+                self.log(f"❌ Не удалось открыть постоянный индекс title: {e}")
+                return time.time() - start_time
+            self.log(f"📚 Постоянный индекс title: {PERSISTENT_INDEX} "
+                     f"({len(store):,} title)".replace(',', ' '))
+        
+        # Общий индекс title для всех файлов (если включён общий поиск дубликатов)
+        shared_index = None
+        if GLOBAL_DEDUP and store is None:
+            shared_index = create_title_index()
+            self.log("🔗 Общий поиск дубликатов по всем файлам (в порядке выбора)")
+            if MEMORY_BUDGET_MB:
+                self.log("   ⚠ Лимит памяти MEMORY_BUDGET_MB при общем поиске не применяется")
+        
+        # Несколько файлов можно разбирать одновременно в процессах-помощниках
+        # (кроме DEDUP_KEEP "last" и "merge": им нужен второй проход по файлу)
+        parallel_files = min(resolve_workers(PARALLEL_FILES), total_files)
+        if parallel_files > 1 and DEDUP_KEEP != "first":
+            self.log(f'   ⚠ При DEDUP_KEEP = "{DEDUP_KEEP}" файлы разбираются по очереди')
+            parallel_files = 1
+        batch = None
+        
+        try:
+            if parallel_files > 1:
+                self.log(f"⚙ Файлы разбираются параллельно: процессов — {parallel_files}")
+                batch = SpoolBatch(file_paths, parallel_files)
+            
+            for index, file_path in enumerate(file_paths):
+                # Проверяем, не нажата ли кнопка "Остановить"
+                if self.stop_processing:
+                    self.log("❌ Обработка остановлена пользователем")
+                    break
+                
+                self.on_file_start(index, total_files, file_path)
+                self.log(f"\n📄 Файл {index + 1}/{total_files}: {os.path.basename(file_path)}")
+                
+                # С постоянным или общим индексом у каждого файла свои новые title,
+                # которые попадают в общий индекс, только если файл обработан целиком
+                title_index = None
+                if store is not None:
+                    title_index = AttachedTitleIndex(store, HashedTitleIndex(store.bits))
+                elif shared_index is not None:
+                    title_index = AttachedTitleIndex(shared_index, create_title_index())
+                
+                result = {'file': os.path.abspath(file_path)}
+                try:
+                    # Обрабатываем файл
+                    if batch is not None:
+                        stats = self.process_spooled_file(file_path, batch, index, title_index=title_index)
+                    else:
+                        stats = self.process_single_file(file_path, title_index=title_index)
+                    if stats is None:
+                        result['status'] = 'stopped'
+                    else:
+                        result['status'] = 'ok'
+                        result['report'] = stats['report']
+                        if title_index is not None:
+                            added = title_index.commit()
+                            if store is not None:
+                                self.log(f"   📚 В постоянный индекс добавлено title: {added:,}".replace(',', ' '))
+                except Exception as e:
+                    self.failed_files += 1
+                    self.log(f"❌ Ошибка при обработке файла: {str(e)}")
+                    result['status'] = 'error'
+                    result['error'] = str(e)
+                if title_index is not None and result['status'] != 'ok':
+                    # Файл без результата: его title в общий индекс не попадают
+                    title_index.release()
+                file_results.append(result)
+                
+                self.on_file_done(index, total_files)
+        finally:
+            if batch is not None:
+                batch.close()
+            if store is not None:
+                store.close()
+        
+        # Обработка завершена
+        elapsed_time = time.time() - start_time
+        self.batch_report = self.build_batch_report(file_paths, file_results, elapsed_time)
+        if RUN_REPORT and file_paths:
+            report_dir = self.output_dir or os.path.dirname(os.path.abspath(file_paths[0]))
+            report_path = os.path.join(
+                report_dir, f"json_cleaner_report_{time.strftime('%Y%m%d_%H%M%S')}.json")
+            write_report(report_path, self.batch_report)
+            self.log(f"📊 Отчёт о запуске: {report_path}")
+        
+        self.log("=" * 50)
+        self.log(f"✅ Обработка завершена за {elapsed_time:.1f} секунд")
+        self.log("=" * 50)
+        
+        return elapsed_time
+    
+    
+    def estimate_files(self, file_paths):
+        """
+        Предварительная оценка файлов по выборке (см. estimate_file) — без обработки.
+        Выводит оценки в лог (при RUN_REPORT сохраняет ещё и
+        "<имя>_cleaned_estimate.json") и возвращает их списком.
+        """
+        total_files = len(file_paths)
+        estimates = []
+        self.failed_files = 0
+        FIELD_RULES_CACHE.clear()
+        number = lambda value: f"{value:,}".replace(',', ' ')
+        
+        for index, file_path in enumerate(file_paths):
+            if self.stop_processing:
+                self.log("❌ Оценка остановлена пользователем")
+                break
+            
+            self.log(f"\n📏 Оценка файла {index + 1}/{total_files}: {os.path.basename(file_path)}")
+            try:
+                estimate = estimate_file(file_path)
+            except (OSError, ValueError) as e:
+                self.failed_files += 1
+                self.log(f"❌ Не удалось оценить файл: {e}")
+                continue
+            estimates.append(estimate)
+            
+            share = estimate['sample_bytes'] / max(1, estimate['file_bytes']) * 100
+            where = "кусками по всему файлу" if estimate['sample_method'] == 'strided' else "с начала файла"
+            self.log(f"   Выборка: {share:.1f}% файла ({where}), строк: {number(estimate['sample_lines'])}")
+            self.log(f"   Строк в файле: ~{number(estimate['lines'])} "
+                     f"(пустых {estimate['blank_rate'] * 100:.1f}%, "
+                     f"с ошибками {estimate['parse_error_rate'] * 100:.1f}%)")
+            low, high = estimate['distinct_titles_range']
+            self.log(f"   Различных title: ~{number(estimate['distinct_titles'])} "
+                     f"(вероятно, от {number(low)} до {number(high)}), "
+                     f"дубликатов: ~{estimate['duplicate_ratio'] * 100:.1f}%")
+            megabytes = lambda value: f"{value / 1024 / 1024:,.1f}".replace(',', ' ')
+            low, high = estimate['unique_records_range']
+            self.log(f"   Результат: ~{number(estimate['unique_records'])} записей "
+                     f"(от {number(low)} до {number(high)})")
+            low, high = estimate['output_bytes_range']
+            parts_low, parts_high = estimate['parts_range']
+            parts = f"{parts_low}–{parts_high}" if parts_low != parts_high else f"{parts_low}"
+            self.log(f"   Размер: ~{megabytes(estimate['output_bytes'])} МБ "
+                     f"(от {megabytes(low)} до {megabytes(high)} МБ), частей: {parts}")
+            self.log(f"   Время обработки: ~{estimate['seconds']:.0f} с в одном процессе "
+                     f"(оценка заняла {estimate['estimate_seconds']:.1f} с)")
+            
+            if RUN_REPORT:
+                report_dir = self.output_dir or os.path.dirname(os.path.abspath(file_path))
+                report_path = os.path.join(report_dir, f"{output_base_name(file_path)}_cleaned_estimate.json")
+                write_report(report_path, estimate)
+                self.log(f"   📊 Оценка сохранена: {os.path.basename(report_path)}")
+        
+        return estimates
+    
+    
+    def build_batch_report(self, file_paths, file_results, elapsed_time):
+        """Отчёт о запуске process_files: итоги по всем файлам и по каждому."""
+        totals = new_stats()
+        bytes_in = 0
+        bytes_out = 0
+        for result in file_results:
+            report = result.get('report')
+            if report is not None:
+                add_stats(totals, report['counters'])
+                bytes_in += report['bytes_in']
+                bytes_out += report['bytes_out']
+        
+        return {
+            'files': len(file_paths),
+            'processed': sum(1 for result in file_results if result['status'] == 'ok'),
+            'failed': self.failed_files,
+            'seconds': round(elapsed_time, 4),
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'rows_per_sec': round(totals['lines'] / elapsed_time, 1) if elapsed_time else None,
+            'mb_per_sec': round(bytes_in / 1024 / 1024 / elapsed_time, 2) if elapsed_time else None,
+            'peak_memory_mb': peak_memory_mb(),
+            'counters': totals,
+            'settings': {
+                'parallel_workers': PARALLEL_WORKERS, 'parallel_files': PARALLEL_FILES,
+                'dedup_index': DEDUP_INDEX, 'memory_budget_mb': MEMORY_BUDGET_MB,
+                'near_duplicates': NEAR_DUP_THRESHOLD if NEAR_DUPLICATES else None,
+                'dedup_key': list(DEDUP_KEY) if DEDUP_KEY else None, 'dedup_keep': DEDUP_KEEP,
+                'global_dedup': GLOBAL_DEDUP,
+                'stage_timing': STAGE_TIMING,
+            },
+            'results': file_results,
+        }
+    
+    
+    def process_single_file(self, file_path, memory_budget_mb=None, workers=None, title_index=None):
+        """
+        Обрабатывает один JSON файл.
+        
+        Шаги:
+        1. Читаем файл построчно
+        2. Пропускаем пустые строки
+        3. Парсим JSON
+        4. Проверяем на дубликаты по title/Наименование
+        5. Заменяем значения полей
+        6. Сразу записываем запись в выходной файл
+        7. Если строк больше 3 000 000 — автоматически переходим к следующей части
+        
+        В памяти хранятся только встреченные title, сами записи
+        на диск уходят сразу (см. PartWriter).
+        
+        memory_budget_mb — лимит памяти для индекса дубликатов в МБ
+        (по умолчанию MEMORY_BUDGET_MB). Если индекс его перерастает,
+        дубликаты дальше ищутся через временные файлы (см. DiskDeduplicator).
+        
+        Возвращает статистику файла (счётчики new_stats, список частей 'parts'
+        и замеры 'report', см. RunReport) или None, если обработку остановили.
+        
+        workers — сколько процессов использовать (по умолчанию PARALLEL_WORKERS).
+        Результат и статистика не зависят от количества процессов.
+        
+        title_index — общий индекс title для нескольких файлов (GLOBAL_DEDUP).
+        Если не передан, у файла свой индекс.
+        
+        Сжатые файлы (gzip/bz2/xz) читаются как поток — без распаковки на диск.
+        Файл, в котором весь JSON — один массив [...], читается по одному
+        элементу (см. JSONArrayReader).
+        """
+        
+        # ШАГ 1: Узнаём размер файла — прогресс считаем по прочитанным байтам,
+        # поэтому отдельный проход для подсчёта строк не нужен
+        self.report_progress(0, force=True)
+        report = RunReport(file_path)
+        compression = detect_compression(file_path)
+        input_format = detect_input_format(file_path, compression)
+        checkpoint = self.open_checkpoint(file_path, title_index, compression, input_format)
+        
+        file_size = os.path.getsize(file_path)
+        self.log(f"   Размер файла: {file_size / 1024 / 1024:,.1f} МБ".replace(',', ' '))
+        if compression:
+            # По выборке из сжатого файла строки не посчитать
+            self.log(f"   Сжатый файл ({compression}) — читаем с распаковкой на лету")
+        line_end = detect_line_end(file_path, compression) if input_format == 'ndjson' else b'\n'
+        if line_end != b'\n':
+            self.log("   Строки разделены символом \\r (старый формат Mac)")
+        if input_format == 'array':
+            self.log("   Файл — один JSON массив: элементы читаются по одному")
+        elif not compression:
+            estimated_lines = estimate_line_count(file_path, file_size, line_end=line_end)
+            self.log(f"   Примерно строк в файле: ~{estimated_lines:,} (оценка по выборке)".replace(',', ' '))
+        
+        # ШАГ 2: Читаем и обрабатываем файл
+        self.log("   Чтение и обработка данных...")
+        
+        workers = resolve_workers(workers)
+        chunk_size = PARALLEL_CHUNK_MB * 1024 * 1024
+        
+        if DEDUP_KEEP not in DEDUP_STRATEGIES:
+            raise ValueError(f"Неизвестная стратегия DEDUP_KEEP: {DEDUP_KEEP}")
+        if DEDUP_KEEP == "merge" and (compression or input_format == 'array'):
+            raise ValueError('DEDUP_KEEP = "merge" читает строки по смещениям — '
+                             'нужен несжатый NDJSON файл')
+        
+        if DEDUP_KEEP != "first":
+            self.log(f"   Из записей с одинаковым ключом остаётся "
+                     f"{'последняя' if DEDUP_KEEP == 'last' else 'первая, дополненная следующими'} "
+                     f"(два прохода по файлу)")
+            if workers > 1:
+                self.log("   Файл обрабатывается в одном процессе")
+        elif workers > 1 and (compression or input_format == 'array'):
+            # Сжатый файл и JSON массив нельзя начать читать с середины
+            self.log("   Файл обрабатывается в одном процессе (его нельзя читать с середины)")
+        
+        if DEDUP_KEEP != "first":
+            read_records = lambda sink, stats: self.read_keep_last(
+                file_path, file_size, sink, stats, report, compression, input_format)
+        elif input_format == 'array':
+            read_records = lambda sink, stats: self.read_array(
+                file_path, file_size, sink, stats, report, compression)
+        elif workers > 1 and file_size > chunk_size and not compression:
+            self.log(f"   Параллельная обработка: процессов — {workers}")
+            read_records = lambda sink, stats: self.read_parallel(
+                file_path, file_size, sink, stats, workers, chunk_size, report, checkpoint)
+        else:
+            read_records = lambda sink, stats: self.read_sequential(
+                file_path, file_size, sink, stats, report, checkpoint, compression)
+        
+        return self.write_unique_records(file_path, read_records, memory_budget_mb, title_index,
+                                         report, checkpoint)
+    
+    
+    def open_checkpoint(self, file_path, title_index=None, compression=None, input_format='ndjson'):
+        """
+        Контрольная точка для файла (если включены CHECKPOINTS).
+        Если от прошлого запуска осталась подходящая точка, обработка
+        продолжится с неё, неподходящая — удаляется.
+        """
+        if not CHECKPOINTS:
+            return None
+        if title_index is not None:
+            self.log("   ⚠ Контрольные точки при общем или постоянном индексе title не сохраняются")
+            return None
+        if compression or OUTPUT_COMPRESSION:
+            self.log("   ⚠ Контрольные точки для сжатых файлов не сохраняются")
+            return None
+        if input_format == 'array':
+            self.log("   ⚠ Контрольные точки для JSON массива не сохраняются")
+            return None
+        if DEDUP_KEEP != "first":
+            self.log("   ⚠ Контрольные точки при двух проходах по файлу (DEDUP_KEEP) не сохраняются")
+            return None
+        
+        file_dir = self.output_dir or os.path.dirname(file_path)
+        base_name = output_base_name(file_path)
+        checkpoint = Checkpoint(file_path, file_dir, base_name, log=self.log)
+        
+        if checkpoint.exists():
+            if CHECKPOINT_RESUME and checkpoint.load():
+                percent = checkpoint.start_offset / max(1, os.path.getsize(file_path)) * 100
+                self.log(f"   ⏩ Продолжаем с контрольной точки от {checkpoint.state['saved_at']} "
+                         f"({percent:.1f}% файла уже обработано)")
+            else:
+                self.log("   Контрольная точка от прошлого запуска не подходит "
+                         "(изменился файл или настройки) — начинаем сначала")
+                checkpoint.remove()
+        
+        return checkpoint
+    
+    
+    def saved_checkpoints(self, file_paths):
+        """
+        Контрольные точки, оставшиеся от прошлого (остановленного) запуска
+        для этих файлов. Нужны окну, чтобы предложить продолжить обработку.
+        """
+        found = []
+        for file_path in file_paths:
+            file_dir = self.output_dir or os.path.dirname(file_path)
+            checkpoint = Checkpoint(file_path, file_dir, output_base_name(file_path), log=self.log)
+            if checkpoint.exists():
+                found.append(checkpoint)
+        return found
+    
+    
+    def process_spooled_file(self, file_path, batch, index, title_index=None):
+        """
+        Обрабатывает файл, который уже разобран процессом-помощником (SpoolBatch).
+        Остаётся только найти дубликаты и записать результат.
+        """
+        self.report_progress(0, force=True)
+        report = RunReport(file_path)
+        
+        self.log("   Ожидание разбора файла...")
+        counters = batch.result(index, lambda: self.stop_processing)
+        report.stages['wait'] += time.perf_counter() - report.start
+        if counters is None:
+            return None
+        
+        spool_path = batch.spool_paths[index]
+        spool_size = os.path.getsize(spool_path)
+    
+        def read_records(sink, stats):
+            add_stats(stats, counters)
+            merge_start = time.perf_counter()
+            for count, (key, json_line, position) in enumerate(read_spool(spool_path), 1):
+                if count & 1023 == 0:
+                    if self.stop_processing:
+                        return False
+                    self.report_progress((position / spool_size) * 100)
+                    report.sample(count, position)
+                if sink.check(key):
+                    sink.write(key, json_line)
+            report.stages['merge'] += time.perf_counter() - merge_start
+            return True
+        
+        self.log("   Поиск дубликатов и запись результата...")
+        try:
+            return self.write_unique_records(file_path, read_records, title_index=title_index,
+                                             report=report)
+        finally:
+            batch.discard(index)
+    
+    
+    def write_unique_records(self, file_path, read_records, memory_budget_mb=None, title_index=None,
+                             report=None, checkpoint=None):
+        """
+        Общая часть обработки файла: создаёт PartWriter и DeduplicatingWriter,
+        вызывает read_records(sink, stats), которая передаёт записи в sink,
+        дописывает отложенное, закрывает результат и выводит статистику.
+        
+        read_records должна вернуть False, если обработку остановили.
+        report — замеры файла (RunReport), в которые пишет и read_records.
+        checkpoint — контрольная точка (Checkpoint): если обработку остановили
+        или она упала, а точка уже сохранена, результат не удаляется —
+        следующий запуск продолжит с неё.
+        """
+        if report is None:
+            report = RunReport(file_path)
+        
+        file_dir = self.output_dir or os.path.dirname(file_path)
+        file_name_without_ext = output_base_name(file_path)
+        
+        if title_index is not None:
+            # Общий индекс нескольких файлов на диск не переносится:
+            # после файла он должен остаться целым для следующих
+            memory_budget_mb = None
+        elif memory_budget_mb is None:
+            memory_budget_mb = MEMORY_BUDGET_MB
+        if memory_budget_mb and NEAR_DUPLICATES:
+            # На диске дубликаты ищутся только точным сравнением
+            self.log("   ⚠ Лимит памяти при поиске похожих title не применяется")
+            memory_budget_mb = None
+        
+        # Записи не копим в списке, а сразу пишем в файл (с разбивкой на части).
+        # Индекс уже встреченных title позволяет быстро проверять, было ли такое значение
+        resume = checkpoint.state['writer'] if checkpoint is not None and checkpoint.state else None
+        writer = PartWriter(file_dir, file_name_without_ext, MAX_LINES_PER_FILE, log=self.log,
+                            resume=resume, queues=report.queues)
+        index = title_index if title_index is not None else create_title_index()
+        sink = DeduplicatingWriter(index, writer, memory_budget_mb, log=self.log)
+        # Ступени поиска похожих title считаются за этот файл (общий индекс копит их за все)
+        tiers = getattr(index, 'tiers', None)
+        tiers_before = dict(tiers) if tiers is not None else None
+        
+        # Счётчики для статистики (дубликаты и уникальные записи считает sink)
+        stats = new_stats()
+        if checkpoint is not None:
+            checkpoint.attach(writer, sink, stats)
+        
+        profiler = self.profiler() if self.profiler else (SamplingProfiler() if PROFILE_SAMPLING else None)
+        if profiler is not None:
+            profiler.start()
+        
+        try:
+            finished = read_records(sink, stats)
+            
+            if finished:
+                # Дописываем записи, отложенные на диск (если до этого дошло)
+                finish_start = time.perf_counter()
+                finished = sink.finish(lambda: self.stop_processing)
+                report.stages['finish'] += time.perf_counter() - finish_start
+        except BaseException:
+            if checkpoint is not None and checkpoint.saved:
+                # Результат до контрольной точки пригодится при следующем запуске
+                writer.detach()
+                self.log("   💾 Прогресс до последней контрольной точки сохранён")
+            else:
+                # При ошибке неполный результат тоже не оставляем
+                writer.abort()
+            raise
+        finally:
+            sink.cleanup()
+            if profiler is not None:
+                report.profile = profiler.stop()
+        
+        if not finished:
+            if checkpoint is not None and checkpoint.saved:
+                writer.detach()
+                self.log("   💾 Прогресс сохранён — при следующем запуске файл "
+                         "продолжится с места остановки")
+            else:
+                # Обработку остановили — неполный результат не оставляем
+                writer.abort()
+            return None
+        
+        # Закрываем последнюю часть
+        finish_start = time.perf_counter()
+        parts = writer.close()
+        report.stages['finish'] += time.perf_counter() - finish_start
+        if checkpoint is not None:
+            checkpoint.remove()
+        stats['duplicates'] = sink.duplicates
+        stats['unique'] = sink.written
+        if tiers_before is not None:
+            stats['duplicate_tiers'] = {name: count - tiers_before[name]
+                                        for name, count in index.tiers.items()}
+        
+        # Обновляем прогресс на 100%
+        self.report_progress(100, force=True)
+        
+        # Выводим статистику
+        self.log(f"   Всего строк в файле: {stats['lines']:,}".replace(',', ' '))
+        self.log(f"   ✓ Пустых строк удалено: {stats['empty_lines']:,}".replace(',', ' '))
+        self.log(f"   ✓ Дубликатов удалено: {sink.duplicates:,}".replace(',', ' '))
+        if tiers_before is not None:
+            labels = {'exact': "точных", 'normalized': "после нормализации", 'near': "похожих"}
+            self.log("     из них: " + ", ".join(f"{labels[name]} {count:,}".replace(',', ' ')
+                                                for name, count in stats['duplicate_tiers'].items()))
+        self.log(f"   ✓ Ошибок парсинга: {stats['parse_errors']:,}".replace(',', ' '))
+        self.log(f"   ✓ Уникальных записей: {sink.written:,}".replace(',', ' '))
+        self.log(f"   Индекс дубликатов: {sink.describe()}")
+        if PIPELINE:
+            for name, queue_stats in report.queue_summary().items():
+                self.log(f"   Очередь {name}: блоков {queue_stats['blocks']}, "
+                         f"глубина ср. {queue_stats['mean_depth']} / макс. {queue_stats['max_depth']} "
+                         f"из {queue_stats['capacity']}, ожидание: "
+                         f"до очереди {queue_stats['producer_wait_seconds']:.2f} с, "
+                         f"после {queue_stats['consumer_wait_seconds']:.2f} с")
+        if report.stage_timing:
+            self.log("   Время по этапам: " + ", ".join(
+                f"{name} {seconds:.2f} с" for name, seconds in report.stages.items() if seconds))
+        
+        stats['parts'] = parts
+        stats['report'] = report.to_dict(stats, os.path.getsize(file_path), [path for path, _ in parts])
+        if RUN_REPORT:
+            report_path = os.path.join(file_dir, f"{file_name_without_ext}_cleaned_report.json")
+            write_report(report_path, stats['report'])
+            self.log(f"   📊 Отчёт: {os.path.basename(report_path)}")
+        
+        self.log(f"   ✅ Файл обработан успешно!")
+        
+        return stats
+    
+    
+    def read_sequential(self, file_path, file_size, sink, stats, report=None, checkpoint=None,
+                        compression=None):
+        """
+        Читает и обрабатывает файл в текущем потоке.
+        Возвращает False, если обработку остановили.
+        
+        checkpoint — контрольная точка: чтение начинается с её смещения,
+        и она периодически (и при остановке) сохраняется.
+        compression — сжатие входного файла (см. detect_compression)
+        """
+        if report is None:
+            report = RunReport(file_path)
+        if report.stage_timing:
+            return self.read_sequential_timed(file_path, file_size, sink, stats, report, checkpoint,
+                                              compression)
+        if READER == "mmap" and not compression:
+            return self.read_mapped(file_path, file_size, sink, stats, report, checkpoint)
+        
+        key_of = sink.index.key
+        rules = field_rules()
+        
+        # Сколько байт файла уже прочитано (для шкалы прогресса)
+        bytes_read = checkpoint.start_offset if checkpoint is not None else 0
+        line_number = 0
+        empty_lines = 0
+        parse_errors = 0
+        
+        # Открываем файл в двоичном режиме: так можно считать прочитанные байты,
+        # а строки декодируем сами
+        with open_lines(file_path, compression, bytes_read, report.queues) as f:
+            for line_number, raw_line in enumerate(f, 1):
+                bytes_read += len(raw_line)
+                
+                # Раз в 1024 строки проверяем, не остановлена ли обработка,
+                # и обновляем прогресс (если с прошлого раза прошло достаточно времени)
+                if line_number & 1023 == 0:
+                    if checkpoint is not None and (self.stop_processing or checkpoint.due()):
+                        # Текущая строка ещё не обработана — точка ставится перед ней
+                        checkpoint.save(bytes_read - len(raw_line), lines=line_number - 1,
+                                        empty_lines=empty_lines, parse_errors=parse_errors)
+                    if self.stop_processing:
+                        return False
+                    # У сжатого файла прогресс считаем по прочитанным сжатым байтам
+                    done = f.position if compression else bytes_read
+                    self.report_progress((done / file_size) * 100)
+                    report.sample(line_number, done)
+                
+                # Декодируем строку и убираем пробелы и переносы в начале и конце
+                line = raw_line.decode('utf-8').strip()
+                
+                # Пропускаем пустые строки
+                if not line:
+                    empty_lines += 1
+                    continue
+                
+                # Пытаемся распарсить JSON
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Если строка — не валидный JSON, пропускаем её
+                    parse_errors += 1
+                    continue
+                
+                # Получаем title (план правил — по набору ключей записи)
+                plan = rules.plan(record)
+                title = plan.title(record)
+                
+                # Если title есть и уже был — это дубликат
+                key = None
+                if title is not None:
+                    key = key_of(title)
+                    if not sink.check(key):
+                        continue  # Пропускаем дубликат
+                
+                # Применяем правила полей и сразу записываем запись
+                record = plan.apply(record)
+                sink.write(key, json.dumps(record, ensure_ascii=False))
+        
+        stats['lines'] += line_number
+        stats['empty_lines'] += empty_lines
+        stats['parse_errors'] += parse_errors
+        return True
+    
+    
+    def read_mapped(self, file_path, file_size, sink, stats, report, checkpoint=None):
+        """
+        То же, что read_sequential, но файл отображается в память (mmap)
+        и режется на строки большими блоками прямо в байтах (READER = "mmap").
+        
+        Пустые строки узнаются без декодирования, а обычные строки
+        вида {...} отдаются json.loads байтами — без отдельных decode и strip.
+        Остановка, прогресс и контрольные точки — на границах блоков.
+        """
+        key_of = sink.index.key
+        rules = field_rules()
+        block_size = IO_BUFFER_KB * 1024
+        line_end = detect_line_end(file_path)
+        
+        position = checkpoint.start_offset if checkpoint is not None else 0
+        line_count = 0
+        empty_lines = 0
+        parse_errors = 0
+        
+        if file_size == 0:
+            return True  # Пустой файл в память не отобразить
+        
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            while position < file_size:
+                if checkpoint is not None and (self.stop_processing or checkpoint.due()):
+                    checkpoint.save(position, lines=line_count, empty_lines=empty_lines,
+                                    parse_errors=parse_errors)
+                if self.stop_processing:
+                    return False
+                self.report_progress((position / file_size) * 100)
+                report.sample(line_count, position)
+                
+                # Блок заканчивается на переводе строки (последний — на конце файла)
+                end = file_size
+                if position + block_size < file_size:
+                    newline = data.find(line_end, position + block_size)
+                    if newline >= 0:
+                        end = newline + 1
+                raw_lines = data[position:end].split(line_end)
+                if raw_lines[-1] == b'':
+                    raw_lines.pop()
+                position = end
+                line_count += len(raw_lines)
+                
+                for raw_line in raw_lines:
+                    stripped = raw_line.strip()
+                    if not stripped:
+                        empty_lines += 1
+                        continue
+                    
+                    # Обычная строка {...} идёт в json.loads байтами. Остальное
+                    # (необычные пробелы по краям, BOM) — через декодирование,
+                    # как в read_sequential
+                    if stripped[0] != 0x7B or stripped[-1] != 0x7D or stripped[1] == 0:
+                        line = raw_line.decode('utf-8').strip()
+                        if not line:
+                            empty_lines += 1
+                            continue
+                    else:
+                        line = stripped
+                    
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        parse_errors += 1
+                        continue
+                    
+                    plan = rules.plan(record)
+                    title = plan.title(record)
+                    key = None
+                    if title is not None:
+                        key = key_of(title)
+                        if not sink.check(key):
+                            continue
+                    
+                    record = plan.apply(record)
+                    sink.write(key, json.dumps(record, ensure_ascii=False))
+        
+        stats['lines'] += line_count
+        stats['empty_lines'] += empty_lines
+        stats['parse_errors'] += parse_errors
+        return True
+    
+    
+    def read_array(self, file_path, file_size, sink, stats, report, compression=None):
+        """
+        Читает и обрабатывает файл, в котором весь JSON — один массив
+        (см. JSONArrayReader). Элемент массива считается строкой файла,
+        элемент, который не является объектом, — ошибкой парсинга.
+        Возвращает False, если обработку остановили.
+        """
+        key_of = sink.index.key
+        rules = field_rules()
+        item_count = 0
+        parse_errors = 0
+        
+        with JSONArrayReader(file_path, compression) as reader:
+            for item_count, item in enumerate(reader, 1):
+                if item_count & 1023 == 0:
+                    if self.stop_processing:
+                        return False
+                    self.report_progress((reader.position / file_size) * 100)
+                    report.sample(item_count, reader.position)
+                
+                try:
+                    title, json_line = clean_record(item, rules)
+                except ValueError:
+                    parse_errors += 1
+                    continue
+                
+                key = key_of(title) if title is not None else None
+                if key is None or sink.check(key):
+                    sink.write(key, json_line)
+            
+            if reader.error is not None:
+                # Остаток повреждённого массива не разобрать — считаем его одной ошибкой
+                parse_errors += 1
+                self.log(f"   ⚠ JSON массив повреждён: {reader.error}; остаток файла пропущен")
+        
+        stats['lines'] += item_count
+        stats['parse_errors'] += parse_errors
+        return True
+    
+    
+    def read_keep_last(self, file_path, file_size, sink, stats, report, compression=None,
+                       input_format='ndjson'):
+        """
+        DEDUP_KEEP = "last" или "merge": два прохода по файлу.
+        1. Запоминаются только позиции строк по ключам (PositionIndex)
+        2. Файл читается снова, и в sink попадает только строка-победитель
+           каждого ключа: последняя ("last") или первая, дополненная полями
+           следующих строк ("merge" — они читаются по смещениям в файле)
+        Прогресс: первый проход — до 50%, второй — до 100%.
+        Возвращает False, если обработку остановили.
+        """
+        merge = DEDUP_KEEP == "merge"
+        rules = field_rules()
+        positions = PositionIndex(chains=merge)
+        
+        # Проход 1: только ключи и позиции
+        scanner = RecordScanner(file_path, compression, input_format)
+        for number, offset, record in scanner:
+            if number & 1023 == 0:
+                if self.stop_processing:
+                    return False
+                self.report_progress((scanner.position / file_size) * 50)
+            title = rules.plan(record).title(record)
+            if title is not None:
+                positions.add(title, number, offset)
+        
+        keys = f"{len(positions):,}".replace(',', ' ')
+        repeats = f"{positions.superseded:,}".replace(',', ' ')
+        megabytes = f"{positions.memory_bytes() / 1024 / 1024:,.1f}".replace(',', ' ')
+        self.log(f"   Первый проход: ключей {keys}, повторов ключа {repeats}, "
+                 f"индекс позиций: {megabytes} МБ")
+        
+        # Проход 2: записываем победителей
+        key_of = sink.index.key
+        winners = positions.first if merge else positions.last
+        superseded = 0
+        scanner = RecordScanner(file_path, compression, input_format)
+        source = open(file_path, 'rb') if merge else None
+        line_end = detect_line_end(file_path) if merge else b'\n'
+        try:
+            for number, offset, record in scanner:
+                if number & 1023 == 0:
+                    if self.stop_processing:
+                        return False
+                    self.report_progress(50 + (scanner.position / file_size) * 50)
+                    report.sample(number, scanner.position)
+                
+                plan = rules.plan(record)
+                title = plan.title(record)
+                key = None
+                if title is not None:
+                    slot = positions.lookup(title)
+                    if winners[slot] != number:
+                        superseded += 1
+                        continue
+                    
+                    if merge and positions.tail[slot]:
+                        # Поля следующих строк дополняют и заменяют поля первой
+                        for later_offset in positions.chain(slot):
+                            source.seek(later_offset)
+                            record.update(json.loads(read_line(source, line_end)))
+                        plan = rules.plan(record)
+                    
+                    key = key_of(title)
+                    if not sink.check(key):
+                        continue
+                
+                sink.write(key, json.dumps(plan.apply(record), ensure_ascii=False))
+        finally:
+            if source is not None:
+                source.close()
+        
+        if scanner.error is not None:
+            self.log(f"   ⚠ JSON массив повреждён: {scanner.error}; остаток файла пропущен")
+        
+        sink.duplicates += superseded
+        stats['lines'] += scanner.lines
+        stats['empty_lines'] += scanner.empty_lines
+        stats['parse_errors'] += scanner.parse_errors
+        return True
+    
+    
+    def read_sequential_timed(self, file_path, file_size, sink, stats, report, checkpoint=None,
+                              compression=None):
+        """
+        То же, что read_sequential, но время каждого этапа каждой строки
+        складывается в report.stages (STAGE_TIMING). Сами замеры занимают
+        время, поэтому без STAGE_TIMING используется read_sequential.
+        """
+        key_of = sink.index.key
+        rules = field_rules()
+        stages = report.stages
+        clock = time.perf_counter
+        
+        bytes_read = checkpoint.start_offset if checkpoint is not None else 0
+        line_number = 0
+        empty_lines = 0
+        parse_errors = 0
+        
+        with open_lines(file_path, compression, bytes_read, report.queues) as f:
+            lines = iter(f)
+            while True:
+                # Чтение и декодирование
+                t0 = clock()
+                raw_line = next(lines, None)
+                if raw_line is None:
+                    stages['read'] += clock() - t0
+                    break
+                line = raw_line.decode('utf-8').strip()
+                t1 = clock()
+                stages['read'] += t1 - t0
+                
+                line_number += 1
+                bytes_read += len(raw_line)
+                if line_number & 1023 == 0:
+                    if checkpoint is not None and (self.stop_processing or checkpoint.due()):
+                        checkpoint.save(bytes_read - len(raw_line), lines=line_number - 1,
+                                        empty_lines=empty_lines, parse_errors=parse_errors)
+                    if self.stop_processing:
+                        return False
+                    done = f.position if compression else bytes_read
+                    self.report_progress((done / file_size) * 100)
+                    report.sample(line_number, done)
+                
+                if not line:
+                    empty_lines += 1
+                    continue
+                
+                # Разбор JSON
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    parse_errors += 1
+                    stages['parse'] += clock() - t1
+                    continue
+                plan = rules.plan(record)
+                title = plan.title(record)
+                t2 = clock()
+                stages['parse'] += t2 - t1
+                
+                # Поиск дубликатов
+                key = None
+                if title is not None:
+                    key = key_of(title)
+                    keep = sink.check(key)
+                    t3 = clock()
+                    stages['dedup'] += t3 - t2
+                    if not keep:
+                        continue
+                else:
+                    t3 = t2
+                
+                # Замена полей, json.dumps и запись
+                record = plan.apply(record)
+                t4 = clock()
+                stages['transform'] += t4 - t3
+                
+                json_line = json.dumps(record, ensure_ascii=False)
+                t5 = clock()
+                stages['serialize'] += t5 - t4
+                
+                sink.write(key, json_line)
+                stages['write'] += clock() - t5
+        
+        stats['lines'] += line_number
+        stats['empty_lines'] += empty_lines
+        stats['parse_errors'] += parse_errors
+        return True
+    
+    
+    def read_parallel(self, file_path, file_size, sink, stats, workers, chunk_size, report=None,
+                      checkpoint=None):
+        """
+        Обрабатывает файл на нескольких ядрах.
+        
+        Куски файла разбираются в процессах-помощниках (process_line_range),
+        а результаты принимаются строго по порядку кусков — так поиск
+        дубликатов идёт в том же порядке, что и при обычной обработке.
+        Одновременно в работе не больше workers * 2 кусков, чтобы
+        готовые результаты не копились в памяти.
+        Возвращает False, если обработку остановили.
+        """
+        from concurrent.futures import ProcessPoolExecutor  # Процессы-помощники
+        
+        if report is None:
+            report = RunReport(file_path)
+        clock = time.perf_counter
+        
+        # Контрольная точка ставится между кусками: всё до конца
+        # последнего принятого куска уже обработано
+        bytes_done = checkpoint.start_offset if checkpoint is not None else 0
+        line_end = detect_line_end(file_path)
+        ranges = split_into_ranges(file_path, file_size, chunk_size, bytes_done, line_end)
+        next_range = 0
+        pending = deque()   # (размер куска, задача) в порядке файла
+        
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=apply_settings,
+            initargs=(current_settings(),)
+        )
+        try:
+            while pending or next_range < len(ranges):
+                # Держим процессы загруженными
+                while next_range < len(ranges) and len(pending) < workers * 2:
+                    start, end = ranges[next_range]
+                    future = executor.submit(process_line_range, file_path, start, end, line_end)
+                    pending.append((end - start, future))
+                    next_range += 1
+                
+                if checkpoint is not None and (self.stop_processing or checkpoint.due()):
+                    checkpoint.save(bytes_done)
+                if self.stop_processing:
+                    return False
+                
+                size, future = pending.popleft()
+                t0 = clock()
+                counters, records = future.result()
+                t1 = clock()
+                add_stats(stats, counters)
+                
+                for _, key, json_line in records:
+                    if sink.check(key):
+                        sink.write(key, json_line)
+                
+                report.stages['wait'] += t1 - t0
+                report.stages['merge'] += clock() - t1
+                bytes_done += size
+                self.report_progress((bytes_done / file_size) * 100)
+                report.sample(stats['lines'], bytes_done)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        
+        return True
+    
+    
+    def save_records_to_file(self, records, output_file, compression=None):
+        """
+        Сохраняет список записей в JSON файл (по одной записи на строку).
+        
+        records — список словарей
+        output_file — путь к файлу для сохранения
+        compression — "gz", "bz2", "xz" или None (без сжатия)
+        """
+        with open_output(output_file, compression) as f:
+            for record in records:
+                # Записываем каждую запись в отдельную строку
+                # ensure_ascii=False — чтобы русские буквы сохранялись как есть
+                f.write_line(json.dumps(record, ensure_ascii=False))
+
+
+# ==================== ГЛАВНЫЙ КЛАСС ПРИЛОЖЕНИЯ ====================
+# Класс — это как "чертёж" нашей программы, в котором описано всё, что она умеет делать
+
+class JSONCleanerApp:
+    """
+    Главный класс приложения.
+    Создаёт окно с кнопками и управляет всей работой программы.
+    """
+    
+    def __init__(self, root):
+        """
+        Инициализация — это то, что происходит при запуске программы.
+        root — это главное окно программы.
+        """
+        self.root = root  # Сохраняем ссылку на главное окно
+        self.root.title("Очистка JSON от дубликатов")  # Заголовок окна
+        self.root.geometry("700x530")  # Размер окна: ширина x высота
+        self.root.resizable(True, True)  # Можно ли менять размер окна
+        
+        # Список выбранных файлов (пока пустой)
+        self.selected_files = []
+        
+        # Очередь событий от потока обработки. Поток только кладёт в неё
+        # события, а окно само забирает их раз в UI_REFRESH_MS миллисекунд —
+        # виджеты tkinter трогаются только из главного потока
+        self.events = queue.Queue()
+        
+        # Движок, который делает всю работу (окно только показывает прогресс)
+        self.engine = CleanerEngine(
+            log=self.log,
+            on_progress=lambda percent: self.events.put(('progress', percent)),
+            on_file_start=lambda index, total, file_path: self.events.put(('file_start', index, total, file_path)),
+            on_file_done=lambda index, total: self.events.put(('file_done', index, total))
+        )
+        
+        # Создаём все элементы интерфейса
+        self.create_widgets()
+        
+        # Начинаем забирать события из очереди
+        self.root.after(UI_REFRESH_MS, self.drain_events)
+    
+    
+    def create_widgets(self):
+        """
+        Создание всех элементов интерфейса: кнопок, надписей, шкалы прогресса.
+        """
+        
+        # ---------- РАМКА ДЛЯ КНОПОК ВВЕРХУ ----------
+        # Frame — это как "контейнер" для группировки элементов
+        top_frame = tk.Frame(self.root, pady=10)  # pady — отступ сверху и снизу
+        top_frame.pack(fill=tk.X)  # pack — размещаем на окне, fill=X — растянуть по ширине
+        
+        # Кнопка "Загрузить файлы"
+        self.btn_load = tk.Button(
+            top_frame,                          # В какой рамке разместить
+            text="📂 Загрузить файлы (до 10)",  # Текст на кнопке
+            command=self.load_files,            # Какую функцию вызвать при нажатии
+            font=("Arial", 12),                 # Шрифт и размер
+            width=25,                           # Ширина кнопки
+            height=2                            # Высота кнопки
+        )
+        self.btn_load.pack(side=tk.LEFT, padx=10)  # Разместить слева с отступом
+        
+        # Кнопка "Удалить дубликаты"
+        self.btn_process = tk.Button(
+            top_frame,
+            text="🔧 Удалить дубликаты",
+            command=self.start_processing,
+            font=("Arial", 12),
+            width=25,
+            height=2,
+            state=tk.DISABLED  # Кнопка неактивна, пока не выбраны файлы
+        )
+        self.btn_process.pack(side=tk.LEFT, padx=10)
+        
+        # Кнопка "Остановить"
+        self.btn_stop = tk.Button(
+            top_frame,
+            text="⏹ Остановить",
+            command=self.stop_process,
+            font=("Arial", 12),
+            width=15,
+            height=2,
+            state=tk.DISABLED  # Неактивна, пока обработка не идёт
+        )
+        self.btn_stop.pack(side=tk.LEFT, padx=10)
+        
+        # ---------- НАСТРОЙКИ ----------
+        # Галочка "сохранять прогресс": включает контрольные точки (CHECKPOINTS),
+        # чтобы после кнопки "Остановить" файл можно было продолжить с того же места
+        options_frame = tk.Frame(self.root)
+        options_frame.pack(fill=tk.X, padx=10)
+        
+        self.checkpoints_var = tk.BooleanVar(value=CHECKPOINTS)
+        tk.Checkbutton(
+            options_frame,
+            text="💾 Сохранять прогресс (после остановки можно продолжить)",
+            variable=self.checkpoints_var,
+            font=("Arial", 10)
+        ).pack(anchor=tk.W)
+        
+        # ---------- СПИСОК ВЫБРАННЫХ ФАЙЛОВ ----------
+        files_frame = tk.Frame(self.root, pady=5)
+        files_frame.pack(fill=tk.BOTH, expand=True, padx=10)
+        
+        # Заголовок списка
+        tk.Label(
+            files_frame, 
+            text="Выбранные файлы:", 
+            font=("Arial", 11, "bold")
+        ).pack(anchor=tk.W)  # anchor=W — прижать к левому краю (West)
+        
+        # Список файлов с прокруткой
+        list_container = tk.Frame(files_frame)
+        list_container.pack(fill=tk.BOTH, expand=True)
+        
+        # Полоса прокрутки
+        scrollbar = tk.Scrollbar(list_container)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        # Сам список (Listbox)
+        self.files_listbox = tk.Listbox(
+            list_container,
+            font=("Consolas", 10),
+            height=8,
+            yscrollcommand=scrollbar.set  # Связываем с прокруткой
+        )
+        self.files_listbox.pack(fill=tk.BOTH, expand=True)
+        scrollbar.config(command=self.files_listbox.yview)
+        
+        # ---------- ШКАЛА ПРОГРЕССА ----------
+        progress_frame = tk.Frame(self.root, pady=10)
+        progress_frame.pack(fill=tk.X, padx=10)
+        
+        # Надпись над шкалой прогресса (для текущего файла)
+        self.label_current_file = tk.Label(
+            progress_frame,
+            text="Ожидание...",
+            font=("Arial", 10)
+        )
+        self.label_current_file.pack(anchor=tk.W)
+        
+        # Шкала прогресса для файлов
+        tk.Label(
+            progress_frame, 
+            text="Прогресс по файлам:", 
+            font=("Arial", 9)
+        ).pack(anchor=tk.W)
+        
+        self.progress_files = ttk.Progressbar(
+            progress_frame,
+            orient=tk.HORIZONTAL,  # Горизонтальная шкала
+            length=650,            # Длина шкалы
+            mode='determinate'     # Режим с конкретным прогрессом (0-100%)
+        )
+        self.progress_files.pack(fill=tk.X, pady=2)
+        
+        # Шкала прогресса для текущего файла
+        tk.Label(
+            progress_frame, 
+            text="Прогресс текущего файла:", 
+            font=("Arial", 9)
+        ).pack(anchor=tk.W)
+        
+        self.progress_current = ttk.Progressbar(
+            progress_frame,
+            orient=tk.HORIZONTAL,
+            length=650,
+            mode='determinate'
+        )
+        self.progress_current.pack(fill=tk.X, pady=2)
+        
+        # ---------- ОБЛАСТЬ ДЛЯ ЛОГОВ (СООБЩЕНИЙ) ----------
+        log_frame = tk.Frame(self.root, pady=5)
+        log_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+        
+        tk.Label(
+            log_frame, 
+            text="Лог выполнения:", 
+            font=("Arial", 11, "bold")
+        ).pack(anchor=tk.W)
+        
+        # Полоса прокрутки для лога
+        log_scrollbar = tk.Scrollbar(log_frame)
+        log_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        # Текстовое поле для лога
+        self.log_text = tk.Text(
+            log_frame,
+            font=("Consolas", 9),
+            height=8,
+            state=tk.DISABLED,  # Нельзя редактировать вручную
+            yscrollcommand=log_scrollbar.set
+        )
+        self.log_text.pack(fill=tk.BOTH, expand=True)
+        log_scrollbar.config(command=self.log_text.yview)
+    
+    
+    def log(self, message):
+        """
+        Добавляет сообщение в лог (текстовое поле внизу окна).
+        Можно вызывать из любого потока: сообщение попадёт в окно
+        при следующей выборке событий (drain_events).
+        """
+        self.events.put(('log', message))
+    
+    
+    def drain_events(self):
+        """
+        Забирает все накопившиеся события из очереди и показывает их.
+        Вызывается в главном потоке раз в UI_REFRESH_MS миллисекунд.
+        Из нескольких обновлений прогресса показывается только последнее,
+        а сообщения лога добавляются одной вставкой.
+        """
+        messages = []
+        progress = None
+        
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            
+            kind = event[0]
+            if kind == 'log':
+                messages.append(event[1])
+            elif kind == 'progress':
+                progress = event[1]
+            elif kind == 'file_start':
+                self.show_file_start(*event[1:])
+            elif kind == 'file_done':
+                self.show_file_done(*event[1:])
+            elif kind == 'finished':
+                # Сначала выводим лог, который пришёл до конца обработки
+                self.append_log(messages)
+                messages = []
+                self.show_finished(*event[1:])
+        
+        if progress is not None:
+            self.progress_current['value'] = progress
+        self.append_log(messages)
+        
+        self.root.after(UI_REFRESH_MS, self.drain_events)
+    
+    
+    def append_log(self, messages):
+        """
+        Добавляет сообщения в текстовое поле лога. На экране остаются
+        только последние LOG_MAX_LINES строк, чтобы лог не рос бесконечно.
+        """
+        if not messages:
+            return
+        
+        self.log_text.config(state=tk.NORMAL)  # Разрешаем редактирование
+        self.log_text.insert(tk.END, "\n".join(messages) + "\n")  # Добавляем текст в конец
+        
+        # Удаляем самые старые строки, если их стало слишком много
+        # (в Text после последнего перевода строки всегда есть пустая строка)
+        line_count = int(self.log_text.index('end-1c').split('.')[0]) - 1
+        if line_count > LOG_MAX_LINES:
+            self.log_text.delete('1.0', f"{line_count - LOG_MAX_LINES + 1}.0")
+        
+        self.log_text.see(tk.END)  # Прокручиваем к концу
+        self.log_text.config(state=tk.DISABLED)  # Запрещаем редактирование
+    
+    
+    def load_files(self):
+        """
+        Открывает диалог выбора файлов.
+        Позволяет выбрать до 10 JSON файлов.
+        """
+        # Открываем диалог выбора файлов
+        files = filedialog.askopenfilenames(
+            title="Выберите JSON файлы (до 10 штук)",
+            filetypes=[
+                ("JSON файлы", "*.json *.json.gz *.json.bz2 *.json.xz"),
+                ("Все файлы", "*.*")
+            ]
+        )
+        
+        # Если пользователь нажал "Отмена", files будет пустым
+        if not files:
+            return
+        
+        # Проверяем, что выбрано не более 10 файлов
+        if len(files) > 10:
+            messagebox.showwarning(
+                "Слишком много файлов",
+                "Можно выбрать максимум 10 файлов.\nВыбраны первые 10."
+            )
+            files = files[:10]  # Берём только первые 10
+        
+        # Сохраняем список файлов
+        self.selected_files = list(files)
+        
+        # Очищаем список в интерфейсе
+        self.files_listbox.delete(0, tk.END)
+        
+        # Добавляем файлы в список
+        for file_path in self.selected_files:
+            # Получаем только имя файла (без полного пути)
+            file_name = os.path.basename(file_path)
+            self.files_listbox.insert(tk.END, file_name)
+        
+        # Активируем кнопку обработки
+        self.btn_process.config(state=tk.NORMAL)
+        
+        # Сообщение в лог
+        self.log(f"Выбрано файлов: {len(self.selected_files)}")
+    
+    
+    def start_processing(self):
+        """
+        Запускает обработку файлов в отдельном потоке.
+        Отдельный поток нужен, чтобы окно не зависало во время работы.
+        """
+        if not self.selected_files:
+            messagebox.showwarning("Нет файлов", "Сначала выберите файлы для обработки!")
+            return
+        
+        # Если прошлая обработка этих файлов была остановлена с сохранением
+        # прогресса — спрашиваем, продолжить её или начать заново
+        saved = self.engine.saved_checkpoints(self.selected_files)
+        if saved:
+            names = "\n".join(os.path.basename(checkpoint.file_path) for checkpoint in saved)
+            answer = messagebox.askyesnocancel(
+                "Обработка не закончена",
+                f"Для этих файлов сохранён прогресс прошлой обработки:\n{names}\n\n"
+                "Продолжить с места остановки?\n"
+                "Да — продолжить, Нет — начать заново"
+            )
+            if answer is None:  # "Отмена" — ничего не запускаем
+                return
+            if answer:
+                self.checkpoints_var.set(True)  # Продолжить можно только с контрольными точками
+            else:
+                for checkpoint in saved:
+                    checkpoint.remove()
+        
+        # Галочка в окне включает или выключает контрольные точки
+        globals().update(CHECKPOINTS=self.checkpoints_var.get())
+        
+        # Сбрасываем флаг остановки
+        self.engine.stop_processing = False
+        
+        # Блокируем кнопки во время обработки
+        self.btn_load.config(state=tk.DISABLED)
+        self.btn_process.config(state=tk.DISABLED)
+        self.btn_stop.config(state=tk.NORMAL)
+        
+        # Сбрасываем прогресс
+        self.progress_files['value'] = 0
+        self.progress_current['value'] = 0
+        
+        # Запускаем обработку в отдельном потоке
+        # threading.Thread создаёт новый поток выполнения
+        processing_thread = threading.Thread(target=self.process_files)
+        processing_thread.daemon = True  # Поток завершится при закрытии программы
+        processing_thread.start()
+    
+    
+    def stop_process(self):
+        """
+        Останавливает обработку файлов.
+        """
+        self.engine.stop_processing = True
+        if CHECKPOINTS:
+            self.log("⏹ Остановка обработки... Прогресс текущего файла сохраняется — "
+                     "при следующем запуске его можно будет продолжить.")
+        else:
+            self.log("⏹ Остановка обработки... Дождитесь завершения текущего файла.")
+    
+    
+    def process_files(self):
+        """
+        Основная функция обработки всех выбранных файлов.
+        Выполняется в отдельном потоке, вся работа — в CleanerEngine.
+        Окно об окончании узнаёт из события 'finished'.
+        """
+        total_files = len(self.selected_files)
+        elapsed_time = self.engine.process_files(self.selected_files)
+        self.events.put(('finished', total_files, elapsed_time))
+    
+    
+    def show_finished(self, total_files, elapsed_time):
+        """Возвращает окно в исходное состояние после обработки."""
+        # Разблокируем кнопки
+        self.btn_load.config(state=tk.NORMAL)
+        self.btn_process.config(state=tk.NORMAL)
+        self.btn_stop.config(state=tk.DISABLED)
+        self.label_current_file.config(text="Готово!")
+        
+        # Показываем сообщение об успешном завершении
+        if not self.engine.stop_processing:
+            messagebox.showinfo(
+                "Готово!", 
+                f"Обработка {total_files} файлов завершена!\n"
+                f"Время: {elapsed_time:.1f} секунд"
+            )
+    
+    
+    def show_file_start(self, index, total, file_path):
+        """Обновляет надпись текущего файла."""
+        file_name = os.path.basename(file_path)
+        self.label_current_file.config(
+            text=f"Обрабатывается: {file_name} ({index + 1}/{total})"
+        )
+    
+    
+    def show_file_done(self, index, total):
+        """Обновляет прогресс по файлам."""
+        progress_percent = ((index + 1) / total) * 100
+        self.progress_files['value'] = progress_percent
+
+
+# ==================== ЗАПУСК ОКНА ====================
+
+def load_tkinter():
+    """
+    Подключает tkinter. Делается только перед открытием окна,
+    чтобы движок и командная строка работали там, где tkinter нет.
+    """
+    global tk, filedialog, ttk, messagebox
+    import tkinter as tk                    # Библиотека для создания окон и кнопок
+    from tkinter import filedialog          # Для окна выбора файлов
+    from tkinter import ttk                 # Для красивой шкалы прогресса
+    from tkinter import messagebox          # Для всплывающих сообщений
+
+
+def run_gui():
+    """Открывает окно программы."""
+    load_tkinter()
+    
+    # Создаём главное окно
+    root = tk.Tk()
+    
+    # Создаём наше приложение
+    JSONCleanerApp(root)
+    
+    # Запускаем главный цикл обработки событий
+    # (программа будет работать, пока окно не закроют)
+    root.mainloop()
+
+
+# ==================== КОМАНДНАЯ СТРОКА ====================
+# Пример:
+#   python json_cleaner.py feed1.json feed2.json -o cleaned --part-lines 1000000
+# Без файлов в командной строке открывается окно (как раньше)
+
+def build_arg_parser():
+    """Описание параметров командной строки."""
+    import argparse
+    
+    parser = argparse.ArgumentParser(
+        prog="json_cleaner",
+        description="Удаляет пустые строки и дубликаты по title/Наименование "
+                    "в JSON файлах (по одной записи на строку) и заменяет значения полей."
+    )
+    parser.add_argument("files", nargs="*",
+                        help="JSON файлы для обработки (без файлов открывается окно)")
+    parser.add_argument("-o", "--output-dir",
+                        help="папка для результата (по умолчанию — рядом с исходным файлом)")
+    parser.add_argument("--part-lines", type=int, default=MAX_LINES_PER_FILE,
+                        help=f"строк в одной части (по умолчанию {MAX_LINES_PER_FILE})")
+    parser.add_argument("--part-mb", type=float, default=MAX_PART_MB,
+                        help="наибольший размер одной части в МБ (новая часть — по любому из лимитов)")
+    parser.add_argument("--no-manifest", action="store_true", default=not PART_MANIFEST,
+                        help="не сохранять манифест частей (_cleaned_manifest.json)")
+    parser.add_argument("--stock", default=NEW_STOCK_VALUE,
+                        help=f"новое значение stock/Склад (по умолчанию {NEW_STOCK_VALUE!r})")
+    parser.add_argument("--under-order", default=NEW_UNDER_ORDER_VALUE,
+                        help=f"новое значение under_order/Под заказ (по умолчанию {NEW_UNDER_ORDER_VALUE!r})")
+    parser.add_argument("--price", default=NEW_PRICE_VALUE,
+                        help=f"новое значение price/Цена (по умолчанию {NEW_PRICE_VALUE!r})")
+    parser.add_argument("--rules", metavar="PATH", default=FIELD_RULES,
+                        help="JSON файл с правилами полей (заменяет --stock, --under-order, --price)")
+    parser.add_argument("--dedup-index", choices=("hashed", "exact"), default=DEDUP_INDEX,
+                        help="как хранить встреченные title (см. DEDUP_INDEX)")
+    parser.add_argument("--hash-bits", type=int, choices=(64, 128), default=DEDUP_HASH_BITS,
+                        help="длина хеша для --dedup-index hashed")
+    parser.add_argument("--dedup-key", metavar="FIELDS",
+                        help="составной ключ дубликатов через запятую, например title,sku")
+    parser.add_argument("--keep", choices=DEDUP_STRATEGIES, default=DEDUP_KEEP,
+                        help="какую из записей с одинаковым ключом оставлять (см. DEDUP_KEEP)")
+    parser.add_argument("--near-duplicates", action="store_true", default=NEAR_DUPLICATES,
+                        help="считать дубликатами и похожие title (регистр, пробелы, порядок слов)")
+    parser.add_argument("--near-threshold", type=float, default=NEAR_DUP_THRESHOLD,
+                        help="насколько похожими должны быть title для --near-duplicates (0–1)")
+    parser.add_argument("--memory-budget-mb", type=float, default=MEMORY_BUDGET_MB,
+                        help="лимит памяти индекса, после которого дубликаты ищутся через диск")
+    parser.add_argument("--workers", type=int, default=PARALLEL_WORKERS,
+                        help="процессов на один файл (0 — по числу ядер)")
+    parser.add_argument("--parallel-files", type=int, default=PARALLEL_FILES,
+                        help="сколько файлов разбирать одновременно (0 — по числу ядер)")
+    parser.add_argument("--global-dedup", action="store_true", default=GLOBAL_DEDUP,
+                        help="удалять title, уже встреченные в предыдущих файлах")
+    parser.add_argument("--report", action="store_true", default=RUN_REPORT,
+                        help="сохранить JSON отчёт для каждого файла и для всего запуска")
+    parser.add_argument("--stage-timing", action="store_true", default=STAGE_TIMING,
+                        help="замерять время каждого этапа обработки (немного медленнее)")
+    parser.add_argument("--profile", action="store_true", default=PROFILE_SAMPLING,
+                        help="добавить в отчёт самые частые строки кода (профилировщик по выборке)")
+    parser.add_argument("--checkpoint-interval", type=float, metavar="SECONDS",
+                        help="сохранять контрольные точки не чаще, чем раз в SECONDS секунд "
+                             "(после остановки или сбоя файл продолжится с последней точки)")
+    parser.add_argument("--compress", choices=tuple(COMPRESSIONS), default=OUTPUT_COMPRESSION,
+                        help="сжимать результат (.gz, .bz2 или .xz); сжатые входные файлы "
+                             "распознаются сами")
+    parser.add_argument("--compression-level", type=int, default=COMPRESSION_LEVEL,
+                        help="степень сжатия (по умолчанию — обычная для формата)")
+    parser.add_argument("--io-buffer-kb", type=int, default=IO_BUFFER_KB,
+                        help=f"буфер чтения и записи в КБ (по умолчанию {IO_BUFFER_KB})")
+    parser.add_argument("--pipeline", action="store_true", default=PIPELINE,
+                        help="читать, разбирать и записывать одновременно (потоки с очередями)")
+    parser.add_argument("--queue-blocks", type=int, default=PIPELINE_QUEUE_BLOCKS,
+                        help=f"блоков в каждой очереди конвейера (по умолчанию {PIPELINE_QUEUE_BLOCKS})")
+    parser.add_argument("--estimate", action="store_true",
+                        help="только оценить файлы по выборке: уникальные title, части, размер и время")
+    parser.add_argument("--estimate-percent", type=float, default=ESTIMATE_SAMPLE_PERCENT,
+                        help="какую долю файла (в процентах) читать для --estimate")
+    parser.add_argument("--input-format", choices=("auto", "ndjson", "array"), default=INPUT_FORMAT,
+                        help="формат входных файлов: по записи на строку или один JSON массив "
+                             "(по умолчанию определяется по началу файла)")
+    parser.add_argument("--reader", choices=("buffered", "mmap"), default=READER,
+                        help="как читать несжатые файлы (см. READER)")
+    parser.add_argument("--index", metavar="PATH", default=PERSISTENT_INDEX,
+                        help="постоянный индекс title: записи с title из него удаляются, "
+                             "новые title дописываются (файл создаётся, если его нет)")
+    parser.add_argument("--restart", action="store_true",
+                        help="не продолжать с контрольных точек, а начинать файлы сначала")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="не выводить лог (ошибки всё равно выводятся)")
+    return parser
+
+
+def check_arguments(parser, args):
+    """
+    Проверяет числа из командной строки. При неверном значении
+    parser.error выводит подсказку и завершает программу (код 2).
+    """
+    # Размеры, лимиты и доли: только больше нуля
+    # (сравнение "not value > 0" отбрасывает и nan)
+    positive = {
+        '--part-lines': args.part_lines,
+        '--part-mb': args.part_mb,
+        '--memory-budget-mb': args.memory_budget_mb,
+        '--io-buffer-kb': args.io_buffer_kb,
+        '--queue-blocks': args.queue_blocks,
+        '--estimate-percent': args.estimate_percent,
+    }
+    for option, value in positive.items():
+        if value is not None and not value > 0:
+            parser.error(f"значение {option} должно быть больше нуля (указано {value})")
+    
+    # Здесь ноль допустим (0 — по числу ядер, 0 секунд — сохранять при каждой возможности)
+    not_negative = {
+        '--workers': args.workers,
+        '--parallel-files': args.parallel_files,
+        '--checkpoint-interval': args.checkpoint_interval,
+    }
+    for option, value in not_negative.items():
+        if value is not None and not value >= 0:
+            parser.error(f"значение {option} не может быть отрицательным (указано {value})")
+    
+    if args.estimate_percent > 100:
+        parser.error(f"значение --estimate-percent не может быть больше 100 (указано {args.estimate_percent})")
+    if not 0 <= args.near_threshold <= 1:
+        parser.error(f"значение --near-threshold должно быть от 0 до 1 (указано {args.near_threshold})")
+    if args.compression_level is not None and not 0 <= args.compression_level <= 9:
+        parser.error(f"значение --compression-level должно быть от 0 до 9 (указано {args.compression_level})")
+
+
+def quiet_log(message):
+    """Лог для -q: обычные сообщения не выводятся, а ошибки (❌) выводятся в stderr."""
+    if message.lstrip().startswith("❌"):
+        print(message, file=sys.stderr, flush=True)
+
+
+def apply_arguments(args):
+    """Переносит параметры командной строки в настройки программы."""
+    globals().update(
+        MAX_LINES_PER_FILE=args.part_lines,
+        MAX_PART_MB=args.part_mb,
+        PART_MANIFEST=not args.no_manifest,
+        NEW_STOCK_VALUE=args.stock,
+        NEW_UNDER_ORDER_VALUE=args.under_order,
+        NEW_PRICE_VALUE=args.price,
+        FIELD_RULES=args.rules,
+        DEDUP_INDEX=args.dedup_index,
+        DEDUP_HASH_BITS=args.hash_bits,
+        DEDUP_KEEP=args.keep,
+        NEAR_DUPLICATES=args.near_duplicates,
+        NEAR_DUP_THRESHOLD=args.near_threshold,
+        MEMORY_BUDGET_MB=args.memory_budget_mb,
+        PARALLEL_WORKERS=args.workers,
+        PARALLEL_FILES=args.parallel_files,
+        GLOBAL_DEDUP=args.global_dedup,
+        RUN_REPORT=args.report,
+        STAGE_TIMING=args.stage_timing,
+        PROFILE_SAMPLING=args.profile,
+        CHECKPOINT_RESUME=not args.restart,
+        PERSISTENT_INDEX=args.index,
+        OUTPUT_COMPRESSION=args.compress,
+        COMPRESSION_LEVEL=args.compression_level,
+        IO_BUFFER_KB=args.io_buffer_kb,
+        READER=args.reader,
+        INPUT_FORMAT=args.input_format,
+        ESTIMATE_SAMPLE_PERCENT=args.estimate_percent,
+        PIPELINE=args.pipeline,
+        PIPELINE_QUEUE_BLOCKS=args.queue_blocks,
+    )
+    if args.checkpoint_interval is not None:
+        globals().update(CHECKPOINTS=True, CHECKPOINT_INTERVAL=args.checkpoint_interval)
+    if args.dedup_key:
+        globals().update(DEDUP_KEY=tuple(field.strip() for field in args.dedup_key.split(",")
+                                         if field.strip()))
+
+
+def main(argv=None):
+    """
+    Точка входа. Без файлов открывает окно, с файлами — обрабатывает их
+    без окна. Возвращает код завершения: 0 — успех, 1 — были ошибки.
+    """
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    
+    if not args.files:
+        run_gui()
+        return 0
+    
+    check_arguments(parser, args)
+    apply_arguments(args)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    
+    log = quiet_log if args.quiet else (lambda message: print(message, flush=True))
+    engine = CleanerEngine(log=log, output_dir=args.output_dir)
+    if args.estimate:
+        engine.estimate_files(args.files)
+    else:
+        engine.process_files(args.files)
+    
+    return 1 if engine.failed_files else 0
+
+
+# ==================== ЗАПУСК ПРОГРАММЫ ====================
+
+if __name__ == "__main__":
+    """
+    Эта часть кода выполняется только если файл запущен напрямую
+    (а не импортирован как модуль в другую программу).
+    """
+    sys.exit(main())
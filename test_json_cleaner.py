@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Проверки json_cleaner: разные режимы обработки должны давать тот же
+результат, что и обычная последовательная обработка.
+
+Запуск:  python -m pytest -q
+"""
+
+import bz2
+import gzip
+import json
+import lzma
+import os
+import re
+
+import pytest
+
+import json_cleaner
+
+
+# ==================== ВСПОМОГАТЕЛЬНОЕ ====================
+
+# Чем распаковывать части результата (по расширению)
+OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+
+def make_catalog(path, lines=36000):
+    """
+    Небольшой каталог (около 3 МБ — больше одного куска PARALLEL_CHUNK_MB):
+    повторяющиеся title, русские поля, пустые строки, строки с ошибкой JSON
+    и записи без title.
+    """
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        for number in range(lines):
+            if number % 997 == 0:
+                f.write('\n')
+            elif number % 1499 == 0:
+                f.write('{"title": "сломанная строка", \n')
+            elif number % 3 == 0:
+                record = {'id': number, 'Наименование': f'Розетка {number % 9000}',
+                          'Склад': '0', 'Под заказ': '', 'Цена': str(number % 500)}
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            elif number % 101 == 0:
+                f.write(json.dumps({'id': number, 'stock': '1'}) + '\n')
+            else:
+                record = {'title': f'USB {number % 15000}', 'stock': '1', 'under_order': '2',
+                          'price': str(number), 'sku': number}
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def configure(monkeypatch, **settings):
+    """Меняет настройки json_cleaner на время одной проверки."""
+    for name, value in settings.items():
+        assert hasattr(json_cleaner, name), name
+        monkeypatch.setattr(json_cleaner, name, value)
+
+
+def read_outputs(folder):
+    """Все файлы результата в папке: {имя: содержимое} (без отчётов и манифестов)."""
+    outputs = {}
+    for name in sorted(os.listdir(folder)):
+        if 'report' in name or name.endswith('_manifest.json'):
+            continue
+        with open(os.path.join(folder, name), 'rb') as f:
+            outputs[name] = f.read()
+    return outputs
+
+
+def part_number(name):
+    """Номер части по имени файла результата (1 — если результат в одном файле)."""
+    found = re.search(r'_part(\d+)\.', name)
+    return int(found.group(1)) if found else 1
+
+
+def result_parts(folder):
+    """Имена частей результата в папке по порядку."""
+    names = [name for name in os.listdir(folder)
+             if '_cleaned' in name and not name.endswith(('_manifest.json', '.checkpoint'))]
+    return sorted(names, key=part_number)
+
+
+def read_result(folder):
+    """Содержимое всех частей результата подряд (сжатые части распаковываются)."""
+    data = b''
+    for name in result_parts(folder):
+        opener = OPENERS.get(os.path.splitext(name)[1], open)
+        with opener(os.path.join(folder, name), 'rb') as f:
+            data += f.read()
+    return data
+
+
+def counters(stats):
+    """Только счётчики статистики (без замеров и путей к частям)."""
+    return {name: stats[name] for name in json_cleaner.new_stats()}
+
+
+def run_single(file_path, out_dir):
+    """Обрабатывает один файл через CleanerEngine. Возвращает (статистика, лог)."""
+    os.makedirs(out_dir, exist_ok=True)
+    logs = []
+    engine = json_cleaner.CleanerEngine(log=logs.append, output_dir=str(out_dir))
+    stats = engine.process_single_file(str(file_path))
+    assert stats is not None
+    return stats, '\n'.join(logs)
+
+
+def run_files(paths, out_dir):
+    """Обрабатывает файлы через CleanerEngine. Возвращает (результат, число файлов с ошибкой)."""
+    os.makedirs(out_dir)
+    engine = json_cleaner.CleanerEngine(output_dir=str(out_dir))
+    engine.process_files([str(path) for path in paths])
+    return read_outputs(out_dir), engine.failed_files
+
+
+@pytest.fixture(scope='module')
+def catalog(tmp_path_factory):
+    """Путь к общему для всех проверок каталогу."""
+    path = tmp_path_factory.mktemp('catalog') / 'catalog.json'
+    make_catalog(path)
+    return path
+
+
+@pytest.fixture(scope='module')
+def sequential(catalog, tmp_path_factory):
+    """Результат и счётчики обычной последовательной обработки каталога."""
+    out_dir = tmp_path_factory.mktemp('sequential')
+    stats, _ = run_single(catalog, out_dir)
+    return read_result(out_dir), counters(stats)
+
+
+# ==================== РЕЖИМЫ ОБРАБОТКИ ====================
+
+# Режим → (настройки, что должно появиться в логе — режим действительно включился)
+MODES = {
+    'parts': ({'MAX_LINES_PER_FILE': 7000}, 'Разбиваем на части'),
+    'part-bytes': ({'MAX_PART_MB': 0.5}, 'Разбиваем на части'),
+    'workers-2': ({'PARALLEL_WORKERS': 2, 'PARALLEL_CHUNK_MB': 1}, 'процессов — 2'),
+    'workers-4': ({'PARALLEL_WORKERS': 4, 'PARALLEL_CHUNK_MB': 1}, 'процессов — 4'),
+    'spill': ({'MEMORY_BUDGET_MB': 0.05}, 'через диск'),
+    'spill-workers': ({'MEMORY_BUDGET_MB': 0.05, 'PARALLEL_WORKERS': 3,
+                       'PARALLEL_CHUNK_MB': 1}, 'через диск'),
+    'exact-index': ({'DEDUP_INDEX': 'exact'}, None),
+    'gzip-output': ({'OUTPUT_COMPRESSION': 'gz'}, None),
+    'xz-output-parts': ({'OUTPUT_COMPRESSION': 'xz', 'MAX_LINES_PER_FILE': 7000},
+                        'Разбиваем на части'),
+    'mmap': ({'READER': 'mmap'}, None),
+    'pipeline': ({'PIPELINE': True}, None),
+    'pipeline-parts': ({'PIPELINE': True, 'MAX_LINES_PER_FILE': 7000}, 'Разбиваем на части'),
+}
+
+
+@pytest.mark.parametrize('mode', list(MODES))
+def test_mode_matches_sequential(catalog, sequential, tmp_path, monkeypatch, mode):
+    """Результат и счётчики (empty_lines, duplicates, parse_errors...) не зависят от режима."""
+    settings, expected_log = MODES[mode]
+    configure(monkeypatch, **settings)
+    stats, log = run_single(catalog, tmp_path)
+    if expected_log:
+        assert expected_log in log
+    assert counters(stats) == sequential[1]
+    assert read_result(tmp_path) == sequential[0]
+
+
+@pytest.mark.parametrize('compression', ['gz', 'bz2', 'xz'])
+def test_compressed_input_matches_sequential(catalog, sequential, tmp_path, compression):
+    """Сжатый каталог даёт тот же результат, что и несжатый."""
+    packed = tmp_path / f'catalog.json.{compression}'
+    with open(catalog, 'rb') as source, OPENERS['.' + compression](packed, 'wb') as target:
+        target.write(source.read())
+    stats, log = run_single(packed, tmp_path / 'out')
+    assert f'Сжатый файл ({compression})' in log
+    assert counters(stats) == sequential[1]
+    assert read_result(tmp_path / 'out') == sequential[0]
+
+
+def test_manifest_offsets(catalog, sequential, tmp_path, monkeypatch):
+    """
+    Манифест частей: номера первых записей идут подряд, а каждое смещение
+    [номер записи в части, байт] указывает на начало этой записи в файле части.
+    """
+    configure(monkeypatch, MAX_LINES_PER_FILE=7000, IO_BUFFER_KB=16)
+    run_single(catalog, tmp_path)
+    with open(tmp_path / 'catalog_cleaned_manifest.json', encoding='utf-8') as f:
+        manifest = json.load(f)
+    
+    parts = manifest['parts']
+    assert [part['path'] for part in parts] == result_parts(tmp_path)
+    assert manifest['records'] == sequential[1]['unique']
+    first_record = 0
+    for part in parts:
+        with open(tmp_path / part['path'], 'rb') as f:
+            data = f.read()
+        starts = [0] + [match.end() for match in re.finditer(b'\n', data)][:-1]
+        assert part['first_record'] == first_record
+        assert part['records'] == len(starts)
+        assert part['bytes'] == len(data)
+        assert len(part['offsets']) > 1
+        for record, offset in part['offsets']:
+            assert starts[record] == offset
+        first_record += part['records']
+    assert first_record == manifest['records']
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_checkpoint_resume_matches_uninterrupted(catalog, sequential, tmp_path, monkeypatch, workers):
+    """
+    Обработку останавливают несколько раз, и она продолжается с контрольной
+    точки — результат и счётчики те же, что без остановок.
+    """
+    source = tmp_path / 'catalog.json'
+    source.write_bytes(catalog.read_bytes())
+    configure(monkeypatch, CHECKPOINTS=True, CHECKPOINT_INTERVAL=0, CHECKPOINT_MAX_OVERHEAD=1.0,
+              PROGRESS_INTERVAL=0, IO_BUFFER_KB=64, MAX_LINES_PER_FILE=7000,
+              PARALLEL_WORKERS=workers, PARALLEL_CHUNK_MB=1)
+    
+    stops = 0
+    resumed = 0
+    while True:
+        logs = []
+        engine = json_cleaner.CleanerEngine(log=logs.append)
+        calls = []
+        
+        def stop_on_progress(percent, engine=engine, calls=calls):
+            # Первые два запуска останавливаем, не дав дойти до конца
+            calls.append(percent)
+            if stops < 2 and len(calls) > 1 and percent < 100:
+                engine.stop_processing = True
+        
+        engine.on_progress = stop_on_progress
+        stats = engine.process_single_file(str(source))
+        resumed += any('Продолжаем с контрольной точки' in message for message in logs)
+        if stats is not None:
+            break
+        stops += 1
+        assert os.path.isdir(tmp_path / 'catalog_cleaned.checkpoint')
+    
+    assert stops == 2
+    assert resumed == 2
+    assert counters(stats) == sequential[1]
+    assert read_result(tmp_path) == sequential[0]
+
+
+# ==================== ОБЩИЙ ПОИСК ДУБЛИКАТОВ ====================
+
+@pytest.mark.parametrize('near_duplicates', [False, True])
+def test_global_dedup_ignores_failed_file(tmp_path, monkeypatch, near_duplicates):
+    """
+    title файла, который упал посередине, не должны попадать в общий индекс:
+    иначе следующий файл теряет записи, и результат зависит от того,
+    разбираются файлы по очереди или параллельно.
+    """
+    first = tmp_path / 'f1.json'
+    broken = tmp_path / 'f2.json'
+    last = tmp_path / 'f3.json'
+    first.write_bytes(b'{"title": "a"}\n')
+    broken.write_bytes(b'{"title": "b"}\n' + b'{"title": "\xff\xfe"}\n' * 3)
+    last.write_bytes(b'{"title": "b", "n": 3}\n{"title": "a"}\n')
+    
+    results = {}
+    for parallel_files in (1, 3):
+        configure(monkeypatch, GLOBAL_DEDUP=True, PARALLEL_FILES=parallel_files,
+                  NEAR_DUPLICATES=near_duplicates, RUN_REPORT=False)
+        results[parallel_files] = run_files([first, broken, last], tmp_path / f'out{parallel_files}')
+    
+    outputs, failed = results[1]
+    assert failed == 1
+    assert outputs['f3_cleaned.json'] == b'{"title": "b", "n": 3}\n'
+    assert results[3] == results[1]